@@ -1,12 +1,148 @@
 from functools import wraps
-from flask import request, jsonify
+from flask import request, jsonify, g, after_this_request
 from models import ApiKey
 from datetime import datetime, timedelta
+import os
+import time
+import atexit
 import logging
+import threading
+from sqlalchemy import update, bindparam, func
 from extensions import db
+from utils.ratelimit import get_rate_limiter, rate_limit_headers, DEFAULT_COST
 
 logger = logging.getLogger(__name__)
 
+# Проверенные ключи кэшируются в процессе, чтобы не ходить в БД на каждый запрос.
+# Деактивация/удаление через /api/keys сбрасывает кэш текущего воркера сразу,
+# остальных — по истечении TTL.
+API_KEY_CACHE_TTL = int(os.environ.get('API_KEY_CACHE_TTL', 60))
+# Счетчики использования копятся в памяти и пишутся в БД одним пакетным UPDATE
+USAGE_FLUSH_INTERVAL = int(os.environ.get('USAGE_FLUSH_INTERVAL', 10))
+
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+_pending_usage = {}
+_usage_lock = threading.Lock()
+usage_flush_thread = None
+
+def _snapshot(key):
+    """Легковесная копия ключа, не привязанная к сессии БД"""
+    return {
+        'id': key.id,
+        'key': key.key,
+        'name': key.name,
+        'is_active': key.is_active,
+        'expires_at': key.expires_at,
+        'rate_limit': key.rate_limit,
+        'speculative_prefetch': bool(key.speculative_prefetch)
+    }
+
+def _is_snapshot_valid(snapshot):
+    """Проверка валидности закэшированного ключа (аналог ApiKey.is_valid)"""
+    if not snapshot['is_active']:
+        return False
+    if snapshot['expires_at'] and snapshot['expires_at'] < datetime.utcnow():
+        return False
+    return True
+
+def get_api_key(api_key):
+    """Возвращает данные ключа из кэша или БД (None, если ключ не найден)"""
+    now = time.monotonic()
+    with _key_cache_lock:
+        entry = _key_cache.get(api_key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    key = ApiKey.query.filter_by(key=api_key).first()
+    if not key:
+        return None
+
+    snapshot = _snapshot(key)
+    with _key_cache_lock:
+        _key_cache[api_key] = (now + API_KEY_CACHE_TTL, snapshot)
+    return snapshot
+
+def invalidate_api_key(api_key):
+    """Удаляет ключ из кэша (после деактивации или удаления)"""
+    with _key_cache_lock:
+        _key_cache.pop(api_key, None)
+
+def record_usage(key_id):
+    """Учитывает запрос по ключу в памяти до следующего сброса в БД"""
+    with _usage_lock:
+        count, _ = _pending_usage.get(key_id, (0, None))
+        _pending_usage[key_id] = (count + 1, datetime.utcnow())
+
+def flush_usage():
+    """Записывает накопленные счетчики одним пакетным UPDATE"""
+    global _pending_usage
+    with _usage_lock:
+        pending, _pending_usage = _pending_usage, {}
+    if not pending:
+        return 0
+
+    table = ApiKey.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('b_id'))
+        .values(
+            downloads_count=func.coalesce(table.c.downloads_count, 0) + bindparam('b_count'),
+            last_used_at=bindparam('b_last_used')
+        )
+    )
+    params = [
+        {'b_id': key_id, 'b_count': count, 'b_last_used': last_used}
+        for key_id, (count, last_used) in pending.items()
+    ]
+    try:
+        db.session.execute(stmt, params)
+        db.session.commit()
+        logger.debug(f"Flushed usage for {len(params)} API keys")
+        return len(params)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error flushing API key usage: {e}")
+        # Возвращаем счетчики, чтобы не потерять их при следующем сбросе
+        with _usage_lock:
+            for key_id, (count, last_used) in pending.items():
+                current_count, current_last = _pending_usage.get(key_id, (0, None))
+                _pending_usage[key_id] = (current_count + count, current_last or last_used)
+        return 0
+
+def _usage_flush_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            flush_usage()
+
+def _flush_on_exit(app):
+    with app.app_context():
+        flush_usage()
+
+def start_usage_flush_thread(app, interval=None):
+    """Запускает фоновый сброс счетчиков использования API ключей
+
+    Args:
+        app: Объект Flask приложения
+        interval (int, optional): Период сброса в секундах.
+            По умолчанию берется из USAGE_FLUSH_INTERVAL.
+    """
+    global usage_flush_thread
+    if usage_flush_thread is not None:
+        return
+
+    interval = interval or USAGE_FLUSH_INTERVAL
+    logger.info(f"Starting API key usage flush thread, interval: {interval}s")
+
+    usage_flush_thread = threading.Thread(
+        target=_usage_flush_loop,
+        args=(app, interval),
+        daemon=True
+    )
+    usage_flush_thread.start()
+    atexit.register(_flush_on_exit, app)
+
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -14,18 +150,43 @@ def require_api_key(f):
         if not api_key:
             return jsonify({'error': 'API key is required'}), 401
 
-        key = ApiKey.query.filter_by(key=api_key).first()
+        key = get_api_key(api_key)
         if not key:
             return jsonify({'error': 'Invalid API key'}), 401
 
-        if not key.is_valid():
+        if not _is_snapshot_valid(key):
             return jsonify({'error': 'API key is expired or inactive'}), 401
 
-        # Обновляем статистику использования
-        key.last_used_at = datetime.utcnow()
-        key.downloads_count += 1
-        db.session.add(key)
-        db.session.commit()
+        # Ограничение частоты запросов (ApiKey.rate_limit - токенов в минуту)
+        if key['rate_limit'] and key['rate_limit'] > 0:
+            cost = getattr(f, 'rate_limit_cost', DEFAULT_COST)
+            if callable(cost):
+                # Стоимость зависит от запроса
+                cost = cost()
+            # Не больше полной корзины ключа, иначе запрос не пройдет никогда
+            cost = min(cost, key['rate_limit'])
+            try:
+                result = get_rate_limiter().hit(key['id'], key['rate_limit'], cost)
+            except Exception as e:
+                logger.error(f"Rate limiter error, request allowed: {e}")
+                result = None
+
+            if result is not None:
+                headers = rate_limit_headers(result)
+                if not result.allowed:
+                    return jsonify({
+                        'error': 'Rate limit exceeded',
+                        'retry_after': result.retry_after
+                    }), 429, headers
+
+                @after_this_request
+                def add_rate_limit_headers(response):
+                    response.headers.update(headers)
+                    return response
+
+        # Статистика использования пишется в БД пакетно в фоне
+        record_usage(key['id'])
+        g.api_key = key
 
         return f(*args, **kwargs)
-    return decorated_function 
\ No newline at end of file
+    return decorated_function
@@ -1,16 +1,29 @@
 import os
 import glob
+import math
+import shutil
 import time
 from uuid import UUID
 import secrets
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context, redirect, g
 from marshmallow import ValidationError
 from extensions import db
-from models import Download, ApiKey
+from models import Download, ApiKey, BulkJob, InfoTask
 from api.schemas import VideoInfoSchema, DownloadSchema, CombinedVideoInfoSchema
-from utils.downloader import get_cached_video_info, get_cached_formats, start_download_task
-from api.middleware import require_api_key
+from utils.downloader import get_cached_video_info, get_cached_formats, get_cached_raw_info, find_raw_format, downloads_dir, PREFER_MODES, get_budget_formats, get_format_size, VIDEO_QUALITIES, AUDIO_QUALITIES
+from utils.scheduler import download_scheduler, is_quota_exceeded, bytes_used_today, get_queue_position, PRIORITY_CLASSES, PRIORITY_NAMES, CANCELLABLE_STATUSES
+from utils.cancellation import cancel_local
+from utils.backends import BACKENDS
+from utils.batch import iter_batch, MAX_BATCH_URLS
+from utils.playlist import get_playlist_page, PlaylistError, PLAYLIST_PAGE_SIZE
+from utils.bulk import expand_playlist, normalize_urls, bulk_status, MAX_BULK_ITEMS
+from utils.archive import iter_zip, archive_entries, MAX_ARCHIVE_TASKS
+from utils.prefetch import schedule_prefetch, claim_prefetched
+from utils.info_tasks import submit_info_task, info_task_status
+from utils.streaming import StreamError, StreamProcessError, ffmpeg_available, build_stream_command, open_ffmpeg_stream, get_direct_media
+from api.middleware import require_api_key, invalidate_api_key
+from utils.ratelimit import rate_limit_cost, EXTRACTION_COST, DOWNLOAD_COST
 import logging
 from functools import wraps
 import re
@@ -21,6 +34,9 @@ logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__)
 
+# task - загрузка через сервер, direct - прямая ссылка на файл источника
+DOWNLOAD_MODES = ('task', 'direct')
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
@@ -103,7 +119,11 @@ def create_api_key():
             key=generate_api_key(),
             name=name,
             expires_at=datetime.utcnow() + timedelta(days=expires_in_days),
-            rate_limit=rate_limit
+            rate_limit=rate_limit,
+            max_concurrent_downloads=data.get('max_concurrent_downloads'),
+            scheduling_weight=data.get('scheduling_weight', 1),
+            daily_byte_quota=data.get('daily_byte_quota'),
+            speculative_prefetch=bool(data.get('speculative_prefetch', False))
         )
 
         db.session.add(key)
@@ -113,7 +133,11 @@ def create_api_key():
             'key': key.key,
             'name': key.name,
             'expires_at': key.expires_at.isoformat() if key.expires_at else None,
-            'rate_limit': key.rate_limit
+            'rate_limit': key.rate_limit,
+            'max_concurrent_downloads': key.max_concurrent_downloads,
+            'scheduling_weight': key.scheduling_weight,
+            'daily_byte_quota': key.daily_byte_quota,
+            'speculative_prefetch': key.speculative_prefetch
         }), 201
 
     except Exception as e:
@@ -135,7 +159,12 @@ def get_api_key_info(key):
             'last_used_at': api_key.last_used_at.isoformat() if api_key.last_used_at else None,
             'expires_at': api_key.expires_at.isoformat() if api_key.expires_at else None,
             'rate_limit': api_key.rate_limit,
-            'downloads_count': api_key.downloads_count
+            'downloads_count': api_key.downloads_count,
+            'max_concurrent_downloads': api_key.max_concurrent_downloads,
+            'scheduling_weight': api_key.scheduling_weight,
+            'daily_byte_quota': api_key.daily_byte_quota,
+            'speculative_prefetch': bool(api_key.speculative_prefetch),
+            'bytes_used_today': bytes_used_today(api_key.id)
         })
 
     except Exception as e:
@@ -152,6 +181,7 @@ def delete_api_key(key):
 
         db.session.delete(api_key)
         db.session.commit()
+        invalidate_api_key(key)
 
         return '', 204
 
@@ -170,6 +200,7 @@ def deactivate_api_key(key):
         api_key.is_active = False
         db.session.add(api_key)
         db.session.commit()
+        invalidate_api_key(key)
 
         return jsonify({'message': 'API key deactivated'})
 
@@ -177,14 +208,109 @@ def deactivate_api_key(key):
         logger.error(f"Error deactivating API key: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def get_max_size_mb():
+    """Параметр max_size_mb запроса (None, если не задан)
+
+    Raises:
+        ValueError: Значение не является конечным положительным числом
+    """
+    value = request.args.get('max_size_mb')
+    if value is None:
+        return None
+    try:
+        max_size_mb = float(value)
+    except ValueError:
+        raise ValueError(f'Invalid max_size_mb: {value}')
+    if not math.isfinite(max_size_mb) or max_size_mb <= 0:
+        raise ValueError(f'Invalid max_size_mb: {value}')
+    return max_size_mb
+
+def parse_timestamp(value):
+    """Время в секундах из '90', '1:30' или '01:02:03.5'
+
+    Raises:
+        ValueError: Часть времени не является конечным неотрицательным числом
+    """
+    seconds = 0.0
+    for part in value.split(':'):
+        part = float(part)
+        if not math.isfinite(part) or part < 0:
+            raise ValueError(f'Invalid timestamp: {value}')
+        seconds = seconds * 60 + part
+    return seconds
+
+def get_clip_range():
+    """Параметры start/end запроса: (start, end) в секундах или None
+
+    Raises:
+        ValueError: Некорректное время или end не больше start
+    """
+    start = request.args.get('start')
+    end = request.args.get('end')
+    if start is None and end is None:
+        return None
+    try:
+        clip = (parse_timestamp(start) if start else 0.0, parse_timestamp(end) if end else None)
+    except ValueError:
+        raise ValueError(f'Invalid clip range: start={start}, end={end}')
+    if clip[0] < 0 or (clip[1] is not None and clip[1] <= clip[0]):
+        raise ValueError(f'Invalid clip range: start={start}, end={end}')
+    return clip
+
+def check_clip_start(url, clip):
+    """Начало фрагмента должно быть раньше конца видео (если длительность известна)
+
+    Raises:
+        ValueError: start не меньше длительности видео
+    """
+    duration = get_cached_raw_info(url).get('duration')
+    if duration and clip[0] >= duration:
+        raise ValueError(f'Clip start {clip[0]:g}s is beyond the end of the video ({duration:g}s)')
+
+def is_async_request():
+    return request.args.get('async', 'false').lower() == 'true'
+
+def info_task_response(kind, url, extract):
+    """Ответ 202 для async=true: извлечение выполняется в фоновом пуле"""
+    task = submit_info_task(g.api_key['id'], kind, url, extract, encoder=CustomJSONEncoder)
+    status_url = f"https://{request.host}/api/info/tasks/{task.task_id}"
+    response = jsonify({
+        'task_id': str(task.task_id),
+        'kind': kind,
+        'status': task.status,
+        'status_url': status_url
+    })
+    response.headers['Location'] = status_url
+    return response, 202
+
+@api_bp.route('/info/tasks/<task_id>', methods=['GET'])
+@require_api_key
+def get_info_task(task_id):
+    """Get the status and result of an asynchronous metadata request"""
+    try:
+        task_uuid = UUID(task_id)
+    except ValueError:
+        return jsonify({'error': 'Invalid task ID format'}), 400
+
+    task = InfoTask.query.filter_by(task_id=task_uuid, api_key_id=g.api_key['id']).first()
+    if not task:
+        return jsonify({'error': 'Info task not found'}), 404
+
+    response = jsonify(info_task_status(task))
+    response.ensure_ascii = False
+    return response
+
 # Добавляем декоратор require_api_key ко всем эндпоинтам, требующим авторизации
 @api_bp.route('/info', methods=['GET'])
 @require_api_key
+@rate_limit_cost(EXTRACTION_COST)
 def get_info():
     """Get basic video metadata without formats"""
     url = request.args.get('url')
     if not url:
         return jsonify({'error': 'URL parameter is required'}), 400
+    if is_async_request():
+        return info_task_response('info', url, lambda: get_cached_video_info(url))
 
     try:
         info = get_cached_video_info(url)
@@ -195,6 +321,7 @@ def get_info():
 
 @api_bp.route('/formats', methods=['GET'])
 @require_api_key
+@rate_limit_cost(EXTRACTION_COST)
 def get_formats():
     """Get available video formats"""
     url = request.args.get('url')
@@ -203,15 +330,120 @@ def get_formats():
 
     try:
         filtered = request.args.get('filtered', 'false').lower() == 'true'
-        logger.debug(f"Getting formats with filtered={filtered}")
-        formats = get_cached_formats(url, filtered=filtered)
-        return jsonify(formats)
+        prefer = request.args.get('prefer')
+        if prefer and prefer not in PREFER_MODES:
+            return jsonify({'error': f'Invalid prefer: {prefer}'}), 400
+        try:
+            max_size_mb = get_max_size_mb()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        logger.debug(f"Getting formats with filtered={filtered}, prefer={prefer}, max_size_mb={max_size_mb}")
+        if is_async_request():
+            return info_task_response('formats', url, lambda: build_formats(url, filtered, prefer, max_size_mb))
+        return jsonify(build_formats(url, filtered, prefer, max_size_mb))
     except Exception as e:
         logger.error(f"Error getting video formats: {str(e)}")
         return jsonify({'error': str(e)}), 400
 
+def build_formats(url, filtered=False, prefer=None, max_size_mb=None):
+    """Ответ /formats (без обращения к request, вызывается и в фоновом пуле)"""
+    formats = get_cached_formats(url, filtered=filtered, prefer=prefer if filtered else None)
+    if max_size_mb:
+        all_formats = get_cached_formats(url, filtered=False)
+        if filtered:
+            # Лучшая комбинация в пределах размера; кэшированный результат не изменяется
+            formats = {**formats, 'budget': get_budget_formats(all_formats, max_size_mb)}
+        else:
+            budget = max_size_mb * 1024 * 1024
+            formats = [f for f in all_formats if get_format_size(f) and get_format_size(f) <= budget]
+    return formats
+
+def batch_extraction_cost():
+    """Стоимость пакетного запроса: как отдельные запросы для каждой ссылки"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    return EXTRACTION_COST * max(1, len(urls) if isinstance(urls, list) else 1)
+
+def batch_response(extract):
+    """NDJSON ответ пакетного запроса: строка на каждую ссылку по мере готовности"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls:
+        return jsonify({'error': 'urls must be a non-empty list'}), 400
+    if len(urls) > MAX_BATCH_URLS:
+        return jsonify({'error': f'Too many URLs: {len(urls)} (max {MAX_BATCH_URLS})'}), 400
+
+    def generate():
+        for item in iter_batch(urls, extract):
+            yield json.dumps(item, ensure_ascii=False, cls=CustomJSONEncoder) + '\n'
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_bp.route('/info/batch', methods=['POST'])
+@require_api_key
+@rate_limit_cost(batch_extraction_cost)
+def get_info_batch():
+    """Get basic metadata for a list of URLs, streamed as NDJSON
+
+    Тело запроса: {"urls": ["...", "..."]}
+    """
+    return batch_response(get_cached_video_info)
+
+@api_bp.route('/formats/batch', methods=['POST'])
+@require_api_key
+@rate_limit_cost(batch_extraction_cost)
+def get_formats_batch():
+    """Get formats for a list of URLs, streamed as NDJSON
+
+    Тело запроса: {"urls": ["...", "..."], "filtered": true}
+    """
+    data = request.get_json(silent=True) or {}
+    filtered = bool(data.get('filtered', False))
+    return batch_response(lambda url: get_cached_formats(url, filtered=filtered))
+
+def playlist_cost():
+    """Страница плейлиста; с full=true - плюс извлечение каждого элемента"""
+    if request.args.get('full', 'false').lower() != 'true':
+        return EXTRACTION_COST
+    try:
+        limit = int(request.args.get('limit', PLAYLIST_PAGE_SIZE))
+    except ValueError:
+        limit = PLAYLIST_PAGE_SIZE
+    return EXTRACTION_COST * (1 + max(1, limit))
+
+@api_bp.route('/playlist', methods=['GET'])
+@require_api_key
+@rate_limit_cost(playlist_cost)
+def get_playlist():
+    """Get a page of playlist or channel entries (flat extraction with cursor paging)"""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'URL parameter is required'}), 400
+
+    try:
+        limit = int(request.args.get('limit', PLAYLIST_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    full = request.args.get('full', 'false').lower() == 'true'
+
+    try:
+        page = get_playlist_page(url, cursor=request.args.get('cursor'), limit=limit, full=full)
+    except (ValueError, PlaylistError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting playlist: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    response = jsonify(page)
+    response.ensure_ascii = False
+    return response
+
 @api_bp.route('/download', methods=['GET'])
 @require_api_key
+@rate_limit_cost(DOWNLOAD_COST)
 def create_download():
     """Create download task"""
     try:
@@ -224,18 +456,73 @@ def create_download():
         audio_format_id = request.args.get('audio_format_id')
         audio_only = request.args.get('audio_only', 'false').lower() == 'true'
         convert_to_mp3 = request.args.get('convert_to_mp3', 'false').lower() == 'true'
+        mode = request.args.get('mode', 'task')
+        if mode not in DOWNLOAD_MODES:
+            return jsonify({'error': f'Invalid mode: {mode}'}), 400
+        priority = request.args.get('priority', 'normal')
+        if priority not in PRIORITY_CLASSES:
+            return jsonify({'error': f'Invalid priority: {priority}'}), 400
+        backend = request.args.get('backend')
+        if backend and backend not in BACKENDS:
+            return jsonify({'error': f'Invalid backend: {backend}'}), 400
+        prefer = request.args.get('prefer')
+        if prefer and prefer not in PREFER_MODES:
+            return jsonify({'error': f'Invalid prefer: {prefer}'}), 400
+        try:
+            max_size_mb = get_max_size_mb()
+            clip = get_clip_range()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if clip and mode == 'direct':
+            return jsonify({'error': 'Clips are not available in direct mode'}), 400
+        # Без явных форматов max_size_mb выбирает лучшую комбинацию в пределах размера
+        budget_selection = max_size_mb and not audio_only and not format_id and not video_format_id
         
         if audio_only:
             if not audio_format_id and not format_id:
                 return jsonify({'error': 'Either format or audio_format_id is required for audio download'}), 400
-        elif not format_id and (not video_format_id or not audio_format_id):
+        elif not budget_selection and not format_id and (not video_format_id or not audio_format_id):
             return jsonify({'error': 'Either format or both video_format_id and audio_format_id are required'}), 400
             
+        if mode == 'direct':
+            # Прямая ссылка возможна только на прогрессивный файл, поэтому
+            # качество раскрывается в него, если он есть
+            prefer = 'fast'
+
         # Get video info for format validation
-        formats = get_cached_formats(url, filtered=True)
+        formats = get_cached_formats(url, filtered=True, prefer=prefer)
         video_info = get_cached_formats(url, filtered=False)
+        if clip:
+            try:
+                check_clip_start(url, clip)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        format_data = None
         
-        if format_id:
+        if budget_selection:
+            format_data = get_budget_formats(video_info, max_size_mb)
+            if not format_data:
+                return jsonify({'error': f'No formats fit in {max_size_mb:g} MB'}), 400
+            video_format = format_data['video']
+            audio_format = format_data['audio'] or {}
+            video_format_id = video_format['format_id']
+            audio_format_id = audio_format.get('format_id')
+            
+            task_id = UUID(bytes=os.urandom(16))
+            if format_data['progressive']:
+                download = Download(
+                    task_id=task_id,
+                    url=url,
+                    format=video_format_id
+                )
+            else:
+                download = Download(
+                    task_id=task_id,
+                    url=url,
+                    video_format=video_format_id,
+                    audio_format=audio_format_id
+                )
+        elif format_id:
             # Проверяем, является ли format_id качеством видео (SD, HD, FullHD, 2K, 4K) или аудио (low, medium, high)
             if format_id in ['SD', 'HD', 'FullHD', '2K', '4K']:
                 if format_id not in formats.get('formats', {}):
@@ -243,19 +530,27 @@ def create_download():
                     
                 format_data = formats['formats'][format_id]
                 video_format_id = format_data['video']['format_id']
-                audio_format_id = format_data['audio']['format_id']
+                audio_format_id = format_data['audio']['format_id'] if format_data.get('audio') else None
                 
                 # Получаем полную информацию о форматах для ответа
                 video_format = next((f for f in video_info if f.get('format_id') == video_format_id), {})
                 audio_format = next((f for f in video_info if f.get('format_id') == audio_format_id), {})
                 
                 task_id = UUID(bytes=os.urandom(16))
-                download = Download(
-                    task_id=task_id,
-                    url=url,
-                    video_format=video_format_id,
-                    audio_format=audio_format_id
-                )
+                if format_data.get('progressive'):
+                    # Прогрессивный формат качается одним файлом без склейки
+                    download = Download(
+                        task_id=task_id,
+                        url=url,
+                        format=video_format_id
+                    )
+                else:
+                    download = Download(
+                        task_id=task_id,
+                        url=url,
+                        video_format=video_format_id,
+                        audio_format=audio_format_id
+                    )
             elif format_id in ['low', 'medium', 'high']:
                 if format_id not in formats.get('audio_only', {}):
                     return jsonify({'error': f'Audio quality {format_id} is not available for this video'}), 400
@@ -263,13 +558,13 @@ def create_download():
                 format_data = formats['audio_only'][format_id]
                 audio_format_id = format_data['format']['format_id']
                 audio_format = format_data['format']
+                audio_only = True
                 
                 task_id = UUID(bytes=os.urandom(16))
                 download = Download(
                     task_id=task_id,
                     url=url,
                     audio_format=audio_format_id,
-                    audio_only=True,
                     convert_to_mp3=convert_to_mp3
                 )
             else:
@@ -326,27 +621,51 @@ def create_download():
                     audio_format=audio_format_id
                 )
             
-        db.session.add(download)
-        db.session.commit()
-        
-        # Start async download
-        if format_id and format_id not in ['SD', 'HD', 'FullHD', '2K', '4K', 'low', 'medium', 'high']:
-            start_download_task(str(task_id), url, format_id=format_id)
+        if mode == 'direct':
+            if audio_only:
+                direct_format_id = audio_format_id or format_id
+            elif format_data:
+                if not format_data.get('progressive'):
+                    label = format_id or f'{max_size_mb:g} MB'
+                    return jsonify({'error': f'No single-file format for {label}, direct mode is not available',
+                                    'mode': 'direct'}), 400
+                direct_format_id = video_format_id
+            elif format_id:
+                direct_format_id = format_id
+            else:
+                direct_format_id = video_format_id
+            return direct_link_response(url, direct_format_id, audio_only=audio_only, convert_to_mp3=convert_to_mp3)
+
+        quality = format_id if format_id in VIDEO_QUALITIES + AUDIO_QUALITIES else None
+        # Спекулятивная загрузка этой ссылки (utils/prefetch.py) с тем же
+        # качеством передается клиенту, с другим - отменяется
+        prefetched = claim_prefetched(
+            g.api_key['id'], url,
+            quality if not clip and not prefer and not backend else None,
+            convert_to_mp3 and audio_only,
+            priority
+        )
+        if prefetched:
+            download = prefetched
         else:
-            start_download_task(
-                str(task_id), 
-                url, 
-                video_format_id=video_format_id, 
-                audio_format_id=audio_format_id,
-                audio_only=audio_only,
-                convert_to_mp3=convert_to_mp3
-            )
+            quota_error = check_download_quota()
+            if quota_error:
+                return quota_error
+
+            download.quality = quality
+            enqueue_download(download, priority, audio_only=audio_only, convert_to_mp3=convert_to_mp3 and audio_only,
+                             backend=backend, clip=clip)
         
         # Prepare response
         response = {
             'task_id': str(download.task_id),
             'url': download.url,
             'created_at': download.created_at.isoformat(),
+            'status': download.status,
+            'priority': priority,
+            'backend': backend,
+            'prefetched': bool(prefetched),
+            'clip': {'start': clip[0], 'end': clip[1]} if clip else None,
             'audio_only': audio_only,
             'convert_to_mp3': convert_to_mp3
         }
@@ -381,9 +700,13 @@ def create_download():
             })
         else:
             response.update({
-                'video_format': download.video_format,
-                'audio_format': download.audio_format,
+                'video_format': video_format_id,
+                'audio_format': audio_format_id,
                 'quality': format_id if format_id in ['SD', 'HD', 'FullHD', '2K', '4K'] else None,
+                'progressive': bool(format_data and format_data.get('progressive')),
+                'estimated_time_to_ready': format_data.get('estimated_time_to_ready') if format_data else None,
+                'max_size_mb': max_size_mb if budget_selection else None,
+                'estimated_size': format_data.get('estimated_size') if budget_selection else None,
                 'format_info': {
                     'video': {
                         'format': video_format.get('format'),
@@ -413,6 +736,147 @@ def create_download():
         logger.error(f"Error creating download: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def check_download_quota():
+    """Ответ 429, если ключ исчерпал дневную квоту трафика"""
+    api_key = db.session.get(ApiKey, g.api_key['id'])
+    if is_quota_exceeded(api_key):
+        return jsonify({'error': 'Daily byte quota exceeded'}), 429
+    return None
+
+def enqueue_download(download, priority, audio_only=False, convert_to_mp3=False, backend=None, clip=None,
+                     commit=True):
+    """Сохраняет задачу в очередь; диспетчер запустит ее с учетом лимитов ключа
+
+    С commit=False задача только добавляется в сессию (для пакетной вставки).
+    """
+    download.status = 'queued'
+    download.backend = backend
+    if clip:
+        download.clip_start, download.clip_end = clip
+    download.api_key_id = g.api_key['id']
+    download.priority = PRIORITY_CLASSES[priority]
+    download.audio_only = audio_only
+    download.convert_to_mp3 = convert_to_mp3
+    db.session.add(download)
+    if commit:
+        db.session.commit()
+        download_scheduler.notify()
+
+def direct_link_response(url, format_id, audio_only=False, convert_to_mp3=False):
+    """Ответ для mode=direct: прямая ссылка на CDN вместо загрузки через сервер"""
+    if convert_to_mp3:
+        return jsonify({'error': 'Direct mode is not available with convert_to_mp3'}), 400
+
+    info = get_cached_raw_info(url)
+    try:
+        media = get_direct_media(find_raw_format(info, format_id), audio_only=audio_only)
+    except StreamError as e:
+        return jsonify({'error': str(e), 'mode': 'direct'}), 400
+
+    logger.info(f"Direct link for {url}, format {format_id}, expires at {media['expires_at']}")
+    if request.args.get('redirect', 'false').lower() == 'true':
+        return redirect(media['url'], code=302)
+
+    return jsonify({
+        'mode': 'direct',
+        'url': url,
+        'title': info.get('title'),
+        'format': format_id,
+        'direct_url': media['url'],
+        'expires_at': media['expires_at'],
+        'ext': media['ext'],
+        'filesize': media['filesize'],
+        'http_headers': media['http_headers']
+    }), 200
+
+@api_bp.route('/download/stream', methods=['GET'])
+@require_api_key
+@rate_limit_cost(DOWNLOAD_COST)
+def stream_download():
+    """Stream merged/remuxed media straight to the client without storing it
+
+    Источники передаются в ffmpeg по прямым ссылкам, результат отдается
+    как фрагментированный MP4 (или MP3 при convert_to_mp3).
+    """
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'URL parameter is required'}), 400
+
+    format_id = request.args.get('format')
+    video_format_id = request.args.get('video_format_id')
+    audio_format_id = request.args.get('audio_format_id')
+    audio_only = request.args.get('audio_only', 'false').lower() == 'true'
+    convert_to_mp3 = request.args.get('convert_to_mp3', 'false').lower() == 'true'
+
+    if not ffmpeg_available():
+        return jsonify({'error': 'Streaming is not available: ffmpeg is not installed'}), 503
+
+    try:
+        # Качество (SD, HD, ..., low, medium, high) раскрываем в конкретные форматы
+        if format_id in ['SD', 'HD', 'FullHD', '2K', '4K']:
+            formats = get_cached_formats(url, filtered=True)
+            if format_id not in formats.get('formats', {}):
+                return jsonify({'error': f'Quality {format_id} is not available for this video'}), 400
+            format_data = formats['formats'][format_id]
+            video_format_id = format_data['video']['format_id']
+            audio_format_id = format_data['audio']['format_id'] if format_data.get('audio') else None
+            format_id = None
+        elif format_id in ['low', 'medium', 'high']:
+            formats = get_cached_formats(url, filtered=True)
+            if format_id not in formats.get('audio_only', {}):
+                return jsonify({'error': f'Audio quality {format_id} is not available for this video'}), 400
+            audio_format_id = formats['audio_only'][format_id]['format']['format_id']
+            audio_only = True
+            format_id = None
+
+        if audio_only or convert_to_mp3:
+            format_ids = [format_id or audio_format_id]
+        elif format_id:
+            format_ids = [format_id]
+        else:
+            format_ids = [video_format_id, audio_format_id]
+
+        if not all(format_ids):
+            return jsonify({'error': 'Either format or both video_format_id and audio_format_id are required'}), 400
+
+        info = get_cached_raw_info(url)
+        sources = []
+        for fid in format_ids:
+            source = find_raw_format(info, fid)
+            if not source:
+                return jsonify({'error': f'Invalid format ID: {fid}'}), 400
+            sources.append(source)
+
+        cmd, mimetype, ext = build_stream_command(
+            sources,
+            convert_to_mp3=convert_to_mp3,
+            audio_only=audio_only
+        )
+    except StreamError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error preparing stream: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+    safe_title = get_safe_filename(info.get('title') or 'video') or 'video'
+    logger.info(f"Streaming {url} formats={format_ids} as {ext}")
+
+    # Статус отправляется только после первого куска: ошибка источника - 502, а не пустой 200
+    try:
+        output = open_ffmpeg_stream(cmd)
+    except StreamProcessError as e:
+        return jsonify({'error': f'Source stream failed: {e}'}), 502
+
+    response = Response(
+        stream_with_context(output),
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{safe_title}.{ext}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_bp.route('/download/<task_id>', methods=['GET'])
 def get_download_status(task_id):
     """Get download task status"""
@@ -423,6 +887,9 @@ def get_download_status(task_id):
             return jsonify({'error': 'Download task not found'}), 404
 
         result = DownloadSchema().dump(download)
+        result['priority'] = PRIORITY_NAMES.get(download.priority)
+        if download.status == 'queued':
+            result['queue'] = get_queue_position(download)
         if result.get('file_path'):
             # Add full HTTPS download URLs if file exists
             host = request.host
@@ -476,6 +943,282 @@ def get_download_status(task_id):
         logger.error(f"Invalid UUID format: {task_id}")
         return jsonify({'error': 'Invalid task ID format'}), 400
 
+# Максимум задач в одном запросе массовой отмены
+MAX_BULK_CANCEL = 100
+
+def cancel_task(task_id):
+    """Отменяет задачу ключа текущего запроса
+
+    Returns:
+        tuple: (результат, HTTP код)
+    """
+    try:
+        task_uuid = UUID(str(task_id))
+    except ValueError:
+        return {'task_id': task_id, 'error': 'Invalid task ID format'}, 400
+
+    download = Download.query.filter_by(task_id=task_uuid, api_key_id=g.api_key['id']).first()
+    if not download:
+        return {'task_id': str(task_uuid), 'error': 'Download task not found'}, 404
+
+    previous_status = download.status
+    # Атомарно: задача могла завершиться или начаться между чтением и отменой
+    cancelled = Download.query.filter(
+        Download.id == download.id,
+        Download.status.in_(CANCELLABLE_STATUSES)
+    ).update({'status': 'cancelled', 'error': 'Cancelled by user'}, synchronize_session=False)
+    db.session.commit()
+    if not cancelled:
+        db.session.refresh(download)
+        return {
+            'task_id': str(task_uuid),
+            'error': f'Task can not be cancelled in status {download.status}',
+            'status': download.status
+        }, 409
+
+    # Задачу этого процесса прерываем сразу, остальные прервет их диспетчер
+    if not cancel_local(str(task_uuid)) and previous_status == 'queued':
+        # В каталоге могут остаться файлы прерванной попытки (задача вернулась в очередь)
+        shutil.rmtree(os.path.join(downloads_dir, str(task_uuid)), ignore_errors=True)
+    download_scheduler.notify()
+
+    logger.info(f"Task {task_uuid} cancelled (was {previous_status})")
+    return {'task_id': str(task_uuid), 'status': 'cancelled', 'previous_status': previous_status}, 200
+
+@api_bp.route('/download/<task_id>', methods=['DELETE'])
+@require_api_key
+def cancel_download(task_id):
+    """Cancel a queued or running download task"""
+    result, status = cancel_task(task_id)
+    return jsonify(result), status
+
+@api_bp.route('/download/cancel', methods=['POST'])
+@require_api_key
+def cancel_downloads():
+    """Cancel several download tasks: {"task_ids": [...]}"""
+    data = request.get_json(silent=True) or {}
+    task_ids = data.get('task_ids')
+    if not isinstance(task_ids, list) or not task_ids:
+        return jsonify({'error': 'task_ids must be a non-empty list'}), 400
+    if len(task_ids) > MAX_BULK_CANCEL:
+        return jsonify({'error': f'At most {MAX_BULK_CANCEL} task_ids per request'}), 400
+
+    results = [cancel_task(task_id)[0] for task_id in task_ids]
+    return jsonify({
+        'cancelled': sum(1 for result in results if result.get('status') == 'cancelled' and 'error' not in result),
+        'results': results
+    })
+
+def bulk_cost():
+    """Стоимость пакетной загрузки: как создание задачи для каждого элемента"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    if isinstance(urls, list):
+        return DOWNLOAD_COST * max(1, len(urls))
+    try:
+        return DOWNLOAD_COST * max(1, int(data.get('max_items', MAX_BULK_ITEMS)))
+    except (TypeError, ValueError):
+        return DOWNLOAD_COST
+
+def get_bulk_job(job_id):
+    """Пакетная загрузка ключа текущего запроса (None, если не найдена)"""
+    try:
+        job_uuid = UUID(job_id)
+    except ValueError:
+        return None
+    return BulkJob.query.filter_by(job_id=job_uuid, api_key_id=g.api_key['id']).first()
+
+@api_bp.route('/download/bulk', methods=['POST'])
+@require_api_key
+@rate_limit_cost(bulk_cost)
+def create_bulk_download():
+    """Create a download task for every item of a playlist or URL list
+
+    Тело запроса: {"urls": [...]} или {"playlist_url": "...", "max_items": 100},
+    а также "format" (SD, HD, FullHD, 2K, 4K, low, medium, high),
+    "convert_to_mp3", "priority" и "backend".
+    """
+    data = request.get_json(silent=True) or {}
+    quality = data.get('format', 'HD')
+    if quality not in VIDEO_QUALITIES + AUDIO_QUALITIES:
+        return jsonify({'error': f'Invalid format: {quality}, expected one of '
+                                 f'{", ".join(VIDEO_QUALITIES + AUDIO_QUALITIES)}'}), 400
+    priority = data.get('priority', 'normal')
+    if priority not in PRIORITY_CLASSES:
+        return jsonify({'error': f'Invalid priority: {priority}'}), 400
+    backend = data.get('backend')
+    if backend and backend not in BACKENDS:
+        return jsonify({'error': f'Invalid backend: {backend}'}), 400
+    audio_only = quality in AUDIO_QUALITIES
+    convert_to_mp3 = bool(data.get('convert_to_mp3', False)) and audio_only
+
+    playlist_url = data.get('playlist_url')
+    try:
+        if playlist_url:
+            max_items = max(1, min(int(data.get('max_items', MAX_BULK_ITEMS)), MAX_BULK_ITEMS))
+            urls = expand_playlist(playlist_url, max_items)
+        else:
+            urls = data.get('urls')
+            if not isinstance(urls, list) or not urls:
+                return jsonify({'error': 'Either urls (non-empty list) or playlist_url is required'}), 400
+            if len(urls) > MAX_BULK_ITEMS:
+                return jsonify({'error': f'Too many URLs: {len(urls)} (max {MAX_BULK_ITEMS})'}), 400
+            urls = normalize_urls(urls)
+    except (ValueError, PlaylistError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error expanding playlist: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    if not urls:
+        return jsonify({'error': 'Playlist has no downloadable items'}), 400
+
+    quota_error = check_download_quota()
+    if quota_error:
+        return quota_error
+
+    bulk = BulkJob(
+        job_id=UUID(bytes=os.urandom(16)),
+        api_key_id=g.api_key['id'],
+        source_url=playlist_url,
+        format=quality,
+        convert_to_mp3=convert_to_mp3,
+        item_count=len(urls)
+    )
+    db.session.add(bulk)
+    # Качество раскрывается в форматы при запуске каждого элемента (см. download_video)
+    for index, url in enumerate(urls, start=1):
+        download = Download(
+            task_id=UUID(bytes=os.urandom(16)),
+            url=url,
+            format=quality,
+            parent_id=bulk.job_id,
+            item_index=index
+        )
+        enqueue_download(download, priority, audio_only=audio_only, convert_to_mp3=convert_to_mp3,
+                         backend=backend, commit=False)
+    db.session.commit()
+    download_scheduler.notify()
+    logger.info(f"Bulk job {bulk.job_id}: {len(urls)} items at {quality}")
+
+    return jsonify({
+        'job_id': str(bulk.job_id),
+        'status': 'queued',
+        'format': quality,
+        'item_count': len(urls),
+        'created_at': bulk.created_at.isoformat()
+    }), 202
+
+@api_bp.route('/download/bulk/<job_id>', methods=['GET'])
+@require_api_key
+def get_bulk_download_status(job_id):
+    """Aggregate progress, ETA and per-item status of a bulk download"""
+    bulk = get_bulk_job(job_id)
+    if not bulk:
+        return jsonify({'error': 'Bulk job not found'}), 404
+
+    items = Download.query.filter_by(parent_id=bulk.job_id).all()
+    result = {
+        'job_id': str(bulk.job_id),
+        'source_url': bulk.source_url,
+        'format': bulk.format,
+        'item_count': bulk.item_count,
+        'created_at': bulk.created_at.isoformat() if bulk.created_at else None,
+        'completed_at': bulk.completed_at.isoformat() if bulk.completed_at else None,
+        **bulk_status(items)
+    }
+    for item in result['items']:
+        if item['status'] == 'completed':
+            item['download_url'] = f"https://{request.host}/api/download/{item['task_id']}/file"
+    if result['counts'].get('completed'):
+        result['archive_url'] = f"https://{request.host}/api/download/archive?job_id={bulk.job_id}"
+
+    response = jsonify(result)
+    response.ensure_ascii = False
+    return response
+
+@api_bp.route('/download/bulk/<job_id>', methods=['DELETE'])
+@require_api_key
+def cancel_bulk_download(job_id):
+    """Cancel all unfinished items of a bulk download"""
+    bulk = get_bulk_job(job_id)
+    if not bulk:
+        return jsonify({'error': 'Bulk job not found'}), 404
+
+    items = Download.query.filter(
+        Download.parent_id == bulk.job_id,
+        Download.status.in_(CANCELLABLE_STATUSES)
+    ).all()
+    results = [cancel_task(item.task_id)[0] for item in items]
+    return jsonify({
+        'job_id': str(bulk.job_id),
+        'cancelled': sum(1 for result in results if result.get('status') == 'cancelled' and 'error' not in result)
+    })
+
+def archive_response(downloads, name):
+    """Потоковая отдача ZIP с файлами завершенных задач"""
+    entries = archive_entries(downloads)
+    if not entries:
+        return jsonify({'error': 'No completed files to archive'}), 400
+
+    logger.info(f"Streaming archive {name} with {len(entries)} files")
+    response = Response(
+        stream_with_context(iter_zip(entries)),
+        mimetype='application/zip',
+        direct_passthrough=True
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.zip"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_bp.route('/download/archive', methods=['GET'])
+@require_api_key
+def download_archive():
+    """Stream a ZIP with the files of several completed tasks
+
+    Параметры: tasks (task_id через запятую) или job_id пакетной загрузки
+    (в архив попадают ее завершенные элементы).
+    """
+    job_id = request.args.get('job_id')
+    if job_id:
+        bulk = get_bulk_job(job_id)
+        if not bulk:
+            return jsonify({'error': 'Bulk job not found'}), 404
+        downloads = Download.query.filter(
+            Download.parent_id == bulk.job_id,
+            Download.status == 'completed'
+        ).order_by(Download.item_index).all()
+        return archive_response(downloads, str(bulk.job_id))
+
+    task_ids = [task_id.strip() for task_id in request.args.get('tasks', '').split(',') if task_id.strip()]
+    if not task_ids:
+        return jsonify({'error': 'Either tasks or job_id parameter is required'}), 400
+    if len(task_ids) > MAX_ARCHIVE_TASKS:
+        return jsonify({'error': f'At most {MAX_ARCHIVE_TASKS} tasks per archive'}), 400
+    try:
+        task_uuids = list(dict.fromkeys(UUID(task_id) for task_id in task_ids))
+    except ValueError:
+        return jsonify({'error': 'Invalid task ID format'}), 400
+
+    found = {
+        download.task_id: download
+        for download in Download.query.filter(
+            Download.task_id.in_(task_uuids),
+            Download.api_key_id == g.api_key['id']
+        ).all()
+    }
+    missing = [str(task_uuid) for task_uuid in task_uuids if task_uuid not in found]
+    if missing:
+        return jsonify({'error': 'Download task not found', 'task_ids': missing}), 404
+    not_ready = [
+        {'task_id': str(task_uuid), 'status': found[task_uuid].status}
+        for task_uuid in task_uuids if found[task_uuid].status != 'completed'
+    ]
+    if not_ready:
+        return jsonify({'error': 'Download not completed yet', 'tasks': not_ready}), 400
+
+    return archive_response([found[task_uuid] for task_uuid in task_uuids], 'archive')
+
 def get_safe_filename(s):
     """
     Преобразует строку в безопасное имя файла.
@@ -703,6 +1446,7 @@ def format_size(size):
 
 @api_bp.route('/audio/formats', methods=['GET'])
 @require_api_key
+@rate_limit_cost(EXTRACTION_COST)
 def get_audio_formats():
     """
     Получение доступных аудио форматов
@@ -940,6 +1684,7 @@ def get_optimal_audio_format(formats, quality_preference='medium', max_size_mb=N
 
 @api_bp.route('/audio/download', methods=['GET'])
 @require_api_key
+@rate_limit_cost(DOWNLOAD_COST)
 def create_audio_download():
     """
     Создание задачи на скачивание аудио
@@ -963,6 +1708,16 @@ def create_audio_download():
         required: false
         default: false
         description: Конвертировать в MP3
+      - name: start
+        in: query
+        type: string
+        required: false
+        description: Начало фрагмента (секунды или ЧЧ:ММ:СС)
+      - name: end
+        in: query
+        type: string
+        required: false
+        description: Конец фрагмента (секунды или ЧЧ:ММ:СС)
     responses:
       202:
         description: Задача создана
@@ -999,9 +1754,30 @@ def create_audio_download():
             
         format_id = request.args.get('format')
         convert_to_mp3 = request.args.get('convert_to_mp3', 'false').lower() == 'true'
+        mode = request.args.get('mode', 'task')
+        if mode not in DOWNLOAD_MODES:
+            return jsonify({'error': f'Invalid mode: {mode}'}), 400
+        priority = request.args.get('priority', 'normal')
+        if priority not in PRIORITY_CLASSES:
+            return jsonify({'error': f'Invalid priority: {priority}'}), 400
+        backend = request.args.get('backend')
+        if backend and backend not in BACKENDS:
+            return jsonify({'error': f'Invalid backend: {backend}'}), 400
+        try:
+            max_size_mb = get_max_size_mb()
+            clip = get_clip_range()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if clip and mode == 'direct':
+            return jsonify({'error': 'Clips are not available in direct mode'}), 400
         
         # Получаем информацию о форматах
         formats = get_cached_formats(url, filtered=False)
+        if clip:
+            try:
+                check_clip_start(url, clip)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         # Если формат не указан, используем medium качество
         if not format_id:
@@ -1010,7 +1786,7 @@ def create_audio_download():
         # Определяем формат
         if format_id in ['low', 'medium', 'high']:
             # Выбираем лучший формат для указанного качества
-            audio_format_id = get_optimal_audio_format(formats, quality_preference=format_id)
+            audio_format_id = get_optimal_audio_format(formats, quality_preference=format_id, max_size_mb=max_size_mb)
             if not audio_format_id:
                 return jsonify({'error': f'No audio formats available for quality {format_id}'}), 400
                 
@@ -1028,6 +1804,9 @@ def create_audio_download():
                 return jsonify({'error': f'Invalid audio format ID: {format_id}'}), 400
             audio_format_id = format_id
             
+        if mode == 'direct':
+            return direct_link_response(url, audio_format_id, audio_only=True, convert_to_mp3=convert_to_mp3)
+
         # Создаем задачу
         task_id = UUID(bytes=os.urandom(16))
         download = Download(
@@ -1037,23 +1816,26 @@ def create_audio_download():
             convert_to_mp3=convert_to_mp3
         )
         
-        db.session.add(download)
-        db.session.commit()
-        
-        # Запускаем скачивание
-        start_download_task(
-            str(task_id),
-            url,
-            audio_format_id=audio_format_id,
-            audio_only=True,
-            convert_to_mp3=convert_to_mp3
-        )
+        quota_error = check_download_quota()
+        if quota_error:
+            return quota_error
+
+        # Выбор аудио здесь не совпадает со спекулятивной загрузкой: она не нужна
+        claim_prefetched(g.api_key['id'], url, None, convert_to_mp3, priority)
+
+        # Ставим задачу в очередь
+        enqueue_download(download, priority, audio_only=True, convert_to_mp3=convert_to_mp3, backend=backend,
+                         clip=clip)
         
         # Готовим ответ
         response = {
             'task_id': str(task_id),
             'url': url,
             'created_at': download.created_at.isoformat(),
+            'status': download.status,
+            'priority': priority,
+            'backend': backend,
+            'clip': {'start': clip[0], 'end': clip[1]} if clip else None,
             'format': audio_format_id,
             'convert_to_mp3': convert_to_mp3,
             'format_info': {
@@ -1076,8 +1858,44 @@ def create_audio_download():
         logger.error(f"Error creating audio download: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def build_combined_info(url):
+    """Ответ /combined-info (без обращения к request, вызывается и в фоновом пуле)"""
+    # Получаем базовую информацию о видео
+    video_info = get_cached_video_info(url)
+    
+    # Получаем форматы
+    formats = get_cached_formats(url, filtered=True)
+    
+    # Подготавливаем видео форматы
+    video_formats = []
+    for quality, format_data in formats.get('formats', {}).items():
+        if 'video' in format_data:
+            format_info = format_data['video']
+            format_info['quality'] = quality
+            video_formats.append(format_info)
+    
+    # Подготавливаем аудио форматы
+    audio_formats = []
+    for quality, format_data in formats.get('formats', {}).items():
+        if 'audio' in format_data:
+            format_info = format_data['audio']
+            format_info['quality'] = quality
+            audio_formats.append(format_info)
+    
+    # Формируем полный ответ
+    combined_info = {
+        **video_info,
+        'video_formats': video_formats,
+        'audio_formats': audio_formats
+    }
+    
+    # Валидируем через схему
+    schema = CombinedVideoInfoSchema()
+    return schema.dump(combined_info)
+
 @api_bp.route('/combined-info', methods=['GET'])
 @require_api_key
+@rate_limit_cost(EXTRACTION_COST)
 def get_combined_info():
     """Get complete video information including video and audio formats"""
     url = request.args.get('url')
@@ -1085,40 +1903,19 @@ def get_combined_info():
         return jsonify({'error': 'URL parameter is required'}), 400
 
     try:
-        # Получаем базовую информацию о видео
-        video_info = get_cached_video_info(url)
-        
-        # Получаем форматы
-        formats = get_cached_formats(url, filtered=True)
-        
-        # Подготавливаем видео форматы
-        video_formats = []
-        for quality, format_data in formats.get('formats', {}).items():
-            if 'video' in format_data:
-                format_info = format_data['video']
-                format_info['quality'] = quality
-                video_formats.append(format_info)
-        
-        # Подготавливаем аудио форматы
-        audio_formats = []
-        for quality, format_data in formats.get('formats', {}).items():
-            if 'audio' in format_data:
-                format_info = format_data['audio']
-                format_info['quality'] = quality
-                audio_formats.append(format_info)
-        
-        # Формируем полный ответ
-        combined_info = {
-            **video_info,
-            'video_formats': video_formats,
-            'audio_formats': audio_formats
-        }
-        
-        # Валидируем через схему
-        schema = CombinedVideoInfoSchema()
-        result = schema.dump(combined_info)
+        if is_async_request():
+            response = info_task_response('combined-info', url, lambda: build_combined_info(url))
+        else:
+            response = jsonify(build_combined_info(url))
+
+        if g.api_key.get('speculative_prefetch'):
+            try:
+                schedule_prefetch(g.api_key['id'], url)
+            except Exception as e:
+                logger.warning(f"Speculative prefetch failed for {url}: {e}")
+                db.session.rollback()
         
-        return jsonify(result)
+        return response
         
     except Exception as e:
         logger.error(f"Error getting combined video info: {str(e)}")
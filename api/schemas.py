@@ -26,6 +26,15 @@ class DownloadSchema(Schema):
     completed_at = fields.DateTime()
     error = fields.Str()
     file_path = fields.Str()
+    audio_only = fields.Bool()
+    convert_to_mp3 = fields.Bool()
+    downloaded_bytes = fields.Int()
+    started_at = fields.DateTime()
+    backend = fields.Str()
+    postprocess_progress = fields.Float()
+    postprocess_plan = fields.Dict()
+    clip_start = fields.Float()
+    clip_end = fields.Float()
 
 class CombinedVideoInfoSchema(Schema):
     # Основная информация о видео
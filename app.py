@@ -9,6 +9,8 @@ from flask_migrate import Migrate
 from flask_cors import CORS
 from config import Config
 from utils.downloader import start_cleanup_thread
+from api.middleware import start_usage_flush_thread
+from utils.scheduler import start_scheduler_thread
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Load environment variables
@@ -91,5 +93,11 @@ with app.app_context():
 # Запускаем поток очистки с контекстом приложения
 start_cleanup_thread(app)
 
+# Запускаем пакетную запись статистики использования API ключей
+start_usage_flush_thread(app)
+
+# Запускаем диспетчер очереди загрузок
+start_scheduler_thread(app)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('FLASK_PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""Сравнение способов загрузки: yt-dlp native, aria2c, aria2 RPC и asyncio диапазоны
+
+Создает файл со случайными данными и отдает его локальным HTTP/1.1 сервером
+с поддержкой Range и keep-alive (в отдельном процессе, чтобы его CPU не
+смешивался с замерами). Скорость одного соединения можно ограничить, как это
+делают CDN. Для каждого способа замеряются время, скорость и затраченное CPU.
+
+Запуск:
+    python benchmarks/backends.py --size 256 --connections 8 --rate 8 --runs 3
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+from utils.governor import build_aria2_args
+from utils.aria2rpc import Aria2RpcClient, Aria2RpcDownloader, _daemon_command
+from utils.rangedl import download_ranges
+
+CHUNK = 256 * 1024
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    directory = None
+    rate = 0  # байт/с на соединение, 0 - без ограничения
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(body=False)
+
+    def do_GET(self, body=True):
+        path = os.path.join(self.directory, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not body:
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            started = time.monotonic()
+            sent = 0
+            while remaining > 0:
+                data = f.read(min(CHUNK, remaining))
+                self.wfile.write(data)
+                remaining -= len(data)
+                sent += len(data)
+                if self.rate:
+                    delay = sent / self.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+def serve(directory, rate, port_queue):
+    RangeHandler.directory = directory
+    RangeHandler.rate = rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def make_fixture(directory, size_mb):
+    path = os.path.join(directory, 'fixture.mp4')
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    return path
+
+
+def proc_cpu(pid):
+    """CPU (user + system, с) процесса, не являющегося нашим потомком"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_ytdlp(url, path, connections, external):
+    params = {
+        'quiet': True,
+        'noprogress': True,
+        'external_downloader': external,
+        'external_downloader_args': build_aria2_args(connections, min_split_size='1M'),
+        'http_chunk_size': 10 * 1024 * 1024,
+        'buffersize': 1024 * 1024
+    }
+    with yt_dlp.YoutubeDL(params) as ydl:
+        ydl.dl(path, {'url': url, 'protocol': 'http', 'ext': 'mp4', 'http_headers': {}})
+
+
+def run_rangedl(url, path, connections):
+    download_ranges(url, path, connections=connections, chunk_size=4 * 1024 * 1024)
+
+
+def start_aria2_daemon(port):
+    rpc_url = f'http://127.0.0.1:{port}/jsonrpc'
+    process = subprocess.Popen(_daemon_command(rpc_url, ''), stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    client = Aria2RpcClient(rpc_url, '')
+    deadline = time.monotonic() + 5
+    while not client.is_available():
+        if time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError('aria2 RPC daemon did not start')
+        time.sleep(0.1)
+    return process, Aria2RpcDownloader(client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help='Размер файла, МБ')
+    parser.add_argument('--connections', type=int, default=8, help='Соединений на загрузку')
+    parser.add_argument('--rate', type=float, default=0, help='Ограничение скорости соединения, МБ/с')
+    parser.add_argument('--runs', type=int, default=3, help='Количество прогонов')
+    parser.add_argument('--rpc-port', type=int, default=16800, help='Порт временного демона aria2')
+    args = parser.parse_args()
+
+    has_aria2 = shutil.which('aria2c') is not None
+    if not has_aria2:
+        print('aria2c is not installed, aria2c and aria2rpc backends are skipped')
+
+    with tempfile.TemporaryDirectory() as fixtures, tempfile.TemporaryDirectory() as workdir:
+        print(f"Generating {args.size} MB fixture...")
+        make_fixture(fixtures, args.size)
+        port_queue = multiprocessing.Queue()
+        server = multiprocessing.Process(
+            target=serve, args=(fixtures, int(args.rate * 1024 * 1024), port_queue), daemon=True)
+        server.start()
+        url = f"http://127.0.0.1:{port_queue.get()}/fixture.mp4"
+
+        daemon, rpc = start_aria2_daemon(args.rpc_port) if has_aria2 else (None, None)
+        backends = {
+            'native': lambda path: run_ytdlp(url, path, args.connections, 'native'),
+            'aria2c': lambda path: run_ytdlp(url, path, args.connections, 'aria2c'),
+            'aria2rpc': lambda path: rpc.download(
+                'bench', [{'url': url, 'format_id': 'x', 'ext': 'mp4'}], workdir,
+                connections=args.connections, min_split_size='1M'),
+            'asyncrange': lambda path: run_rangedl(url, path, args.connections),
+        }
+        if not has_aria2:
+            del backends['aria2c'], backends['aria2rpc']
+
+        try:
+            print(f"{'backend':<12}{'run':>4}{'time, s':>10}{'MiB/s':>10}{'cpu, s':>10}")
+            for name, run in backends.items():
+                for attempt in range(1, args.runs + 1):
+                    path = os.path.join(workdir, f'{name}.mp4')
+                    cpu_before = cpu_time() + (proc_cpu(daemon.pid) if name == 'aria2rpc' else 0)
+                    started = time.perf_counter()
+                    run(path)
+                    elapsed = time.perf_counter() - started
+                    cpu = cpu_time() + (proc_cpu(daemon.pid) if name == 'aria2rpc' else 0) - cpu_before
+                    for leftover in os.listdir(workdir):
+                        os.remove(os.path.join(workdir, leftover))
+                    print(f"{name:<12}{attempt:>4}{elapsed:>10.3f}{args.size / elapsed:>10.1f}{cpu:>10.3f}")
+        finally:
+            if daemon:
+                daemon.kill()
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Сравнение потоковой склейки (ffmpeg -> stdout) и склейки через диск
+
+Генерирует локальные тестовые файлы (видео без звука и отдельную аудио дорожку),
+отдает их встроенным HTTP сервером и замеряет для обоих вариантов время до
+первого байта, общее время и объем записи на диск.
+
+Запуск:
+    python benchmarks/stream_merge.py --duration 60 --runs 3
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.streaming import build_stream_command, open_ffmpeg_stream
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_fixtures(directory, duration):
+    """Создает видео (H.264, без звука) и аудио (AAC) фикстуры через lavfi"""
+    video = os.path.join(directory, 'video.mp4')
+    audio = os.path.join(directory, 'audio.m4a')
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-an', video
+    ], check=True)
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:a', 'aac', '-b:a', '128k', audio
+    ], check=True)
+    return video, audio
+
+
+def start_server(directory):
+    handler = partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def fetch(url, path):
+    with urllib.request.urlopen(url) as response, open(path, 'wb') as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+
+
+def run_disk(base_url, workdir):
+    """Текущий конвейер: скачать оба потока, склеить и отдать готовый файл"""
+    started = time.perf_counter()
+    video = os.path.join(workdir, 'v.mp4')
+    audio = os.path.join(workdir, 'a.m4a')
+    fetch(f"{base_url}/video.mp4", video)
+    fetch(f"{base_url}/audio.m4a", audio)
+    merged = os.path.join(workdir, 'merged.mp4')
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', video, '-i', audio,
+        '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', merged
+    ], check=True)
+    written = sum(os.path.getsize(p) for p in (video, audio, merged))
+
+    first_byte = None
+    total = 0
+    with open(merged, 'rb') as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if not chunk:
+                break
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            total += len(chunk)
+    for path in (video, audio, merged):
+        os.remove(path)
+    return first_byte, time.perf_counter() - started, total, written
+
+
+def run_stream(base_url):
+    """Новый режим: ffmpeg читает источники по HTTP и пишет fMP4 в stdout"""
+    started = time.perf_counter()
+    sources = [
+        {'format_id': 'v', 'url': f"{base_url}/video.mp4", 'protocol': 'http'},
+        {'format_id': 'a', 'url': f"{base_url}/audio.m4a", 'protocol': 'http'},
+    ]
+    cmd, _, _ = build_stream_command(sources)
+    first_byte = None
+    total = 0
+    for chunk in open_ffmpeg_stream(cmd):
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        total += len(chunk)
+    return first_byte, time.perf_counter() - started, total, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=int, default=60, help='Длительность фикстуры в секундах')
+    parser.add_argument('--runs', type=int, default=3, help='Количество прогонов')
+    args = parser.parse_args()
+
+    if shutil.which('ffmpeg') is None:
+        sys.exit('ffmpeg is required for this benchmark')
+
+    with tempfile.TemporaryDirectory() as fixtures, tempfile.TemporaryDirectory() as workdir:
+        print(f"Generating {args.duration}s fixtures...")
+        make_fixtures(fixtures, args.duration)
+        server, base_url = start_server(fixtures)
+        try:
+            print(f"{'mode':<8}{'run':>4}{'ttfb, s':>10}{'total, s':>10}{'out, MiB':>10}{'disk, MiB':>11}")
+            for mode in ('disk', 'stream'):
+                for run in range(1, args.runs + 1):
+                    if mode == 'disk':
+                        ttfb, total, size, written = run_disk(base_url, workdir)
+                    else:
+                        ttfb, total, size, written = run_stream(base_url)
+                    print(f"{mode:<8}{run:>4}{ttfb:>10.3f}{total:>10.3f}"
+                          f"{size / 1048576:>10.2f}{written / 1048576:>11.2f}")
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
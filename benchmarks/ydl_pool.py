@@ -0,0 +1,157 @@
+"""Экономия от пула YoutubeDL: новый экземпляр на вызов против экземпляра из пула
+
+Локальный HTTP/1.1 сервер с keep-alive (в отдельном процессе) отдает страницу
+с тегом <video>, которую разбирает generic экстрактор yt-dlp. Замеряются:
+  - стоимость создания и закрытия YoutubeDL без извлечения;
+  - время извлечения и число новых TCP соединений к серверу на N вызовов.
+Перед замерами проверяется, что параметры аренды (format) действуют так же,
+как у нового экземпляра.
+Переиспользование соединений зависит от HTTP обработчика yt-dlp (с пакетом
+requests соединения сохраняются между запросами, с urllib - нет).
+
+Запуск:
+    python benchmarks/ydl_pool.py --calls 50 --runs 3
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+from utils.ydl_pool import YdlPool, EXTRACTION_PROFILE
+
+PAGE = (b'<!DOCTYPE html><html><head><title>Benchmark page</title></head>'
+        b'<body><video src="/video.mp4" type="video/mp4"></video></body></html>')
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        # Один экземпляр обработчика на TCP соединение
+        super().setup()
+        with self.connections.get_lock():
+            self.connections.value += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(PAGE)))
+        self.end_headers()
+        self.wfile.write(PAGE)
+
+
+def serve(connections, port_queue):
+    PageHandler.connections = connections
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def options(params=None):
+    return {**EXTRACTION_PROFILE, 'force_generic_extractor': True, **(params or {})}
+
+
+def bench_construct(calls):
+    """Среднее время создания и закрытия YoutubeDL, мс"""
+    started = time.perf_counter()
+    for _ in range(calls):
+        with yt_dlp.YoutubeDL(options()):
+            pass
+    return (time.perf_counter() - started) / calls * 1000
+
+
+def extract_fresh(url):
+    with yt_dlp.YoutubeDL(options()) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def make_pooled(pool):
+    def extract_pooled(url):
+        with pool.lease({'force_generic_extractor': True}) as ydl:
+            return ydl.extract_info(url, download=False)
+    return extract_pooled
+
+
+def check_format_selection():
+    """Формат аренды выбирает тот же поток, что и новый экземпляр с этим форматом"""
+    info = {
+        'id': 'check', 'title': 'check', 'extractor': 'generic', 'extractor_key': 'Generic',
+        'webpage_url': 'http://127.0.0.1/check',
+        'formats': [
+            {'format_id': 'v1', 'url': 'http://127.0.0.1/v1', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 720},
+            {'format_id': 'a1', 'url': 'http://127.0.0.1/a1', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a'}
+        ]
+    }
+    pool = YdlPool('check', {**EXTRACTION_PROFILE, 'simulate': True}, size=1)
+    try:
+        for spec in ('a1', 'v1', 'bv*+ba/b'):
+            with yt_dlp.YoutubeDL({**EXTRACTION_PROFILE, 'simulate': True, 'format': spec}) as ydl:
+                expected = ydl.process_ie_result(dict(info), download=True)['format_id']
+            with pool.lease({'format': spec}) as ydl:
+                leased = ydl.process_ie_result(dict(info), download=True)['format_id']
+            assert leased == expected, f"format {spec!r}: pooled {leased}, fresh {expected}"
+        # После аренды экземпляр возвращается к формату профиля
+        with pool.lease() as ydl:
+            assert ydl.process_ie_result(dict(info), download=True)['format_id'] == 'v1+a1'
+    finally:
+        pool.close()
+
+
+def bench_extract(extract, url, calls, connections):
+    """(среднее время вызова, мс; новых соединений) на calls извлечений"""
+    with connections.get_lock():
+        connections.value = 0
+    started = time.perf_counter()
+    for _ in range(calls):
+        extract(url)
+    elapsed = time.perf_counter() - started
+    return elapsed / calls * 1000, connections.value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=50, help='Вызовов в одном прогоне')
+    parser.add_argument('--runs', type=int, default=3, help='Количество прогонов')
+    args = parser.parse_args()
+
+    connections = multiprocessing.Value('i', 0)
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(connections, port_queue), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port_queue.get()}/page.html"
+
+    print(f"yt-dlp {yt_dlp.version.__version__}, {args.calls} calls per run")
+    check_format_selection()
+    pool = YdlPool('benchmark', EXTRACTION_PROFILE, size=1)
+    extract_pooled = make_pooled(pool)
+    # Прогрев: импорт экстракторов и первый экземпляр пула не входят в замеры
+    extract_fresh(url)
+    extract_pooled(url)
+
+    print(f"{'mode':<12}{'run':>4}{'init, ms':>10}{'call, ms':>10}{'new conns':>11}")
+    try:
+        for attempt in range(1, args.runs + 1):
+            init = bench_construct(args.calls)
+            call, conns = bench_extract(extract_fresh, url, args.calls, connections)
+            print(f"{'fresh':<12}{attempt:>4}{init:>10.2f}{call:>10.2f}{conns:>11}")
+
+            call, conns = bench_extract(extract_pooled, url, args.calls, connections)
+            print(f"{'pooled':<12}{attempt:>4}{0:>10.2f}{call:>10.2f}{conns:>11}")
+    finally:
+        pool.close()
+        server.terminate()
+    print(f"pool: {pool.created} instance(s) created, {pool.reused} reuses")
+
+
+if __name__ == '__main__':
+    main()
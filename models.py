@@ -22,6 +22,50 @@ class Download(db.Model):
     completed_at = db.Column(db.DateTime)
     title = db.Column(db.String)
     convert_to_mp3 = db.Column(db.Boolean, default=False)
+    audio_only = db.Column(db.Boolean, default=False)
+    api_key_id = db.Column(db.Integer, index=True)
+    priority = db.Column(db.Integer, default=1)  # 0 - high, 1 - normal, 2 - low
+    downloaded_bytes = db.Column(db.BigInteger, default=0)
+    worker_id = db.Column(db.String)  # hostname:pid процесса, выполняющего задачу
+    started_at = db.Column(db.DateTime)
+    backend = db.Column(db.String)  # Способ загрузки (см. utils/backends.py), None - по умолчанию
+    postprocess_progress = db.Column(db.Float)  # Прогресс склейки/перекодирования, %
+    postprocess_plan = db.Column(db.JSON)  # План постобработки (см. utils/planner.py) и затраченное CPU
+    clip_start = db.Column(db.Float)  # Начало фрагмента в секундах, None - файл целиком
+    clip_end = db.Column(db.Float)  # Конец фрагмента в секундах, None - до конца
+    parent_id = db.Column(pgUUID(as_uuid=True), index=True)  # job_id пакетной загрузки (BulkJob)
+    item_index = db.Column(db.Integer)  # Номер элемента в пакетной загрузке
+    quality = db.Column(db.String)  # Запрошенное качество (SD, HD, ..., low, medium, high) - для истории выбора ключа
+    speculative = db.Column(db.Boolean, default=False)  # Спекулятивная загрузка, еще не запрошенная клиентом
+
+class BulkJob(db.Model):
+    """Пакетная загрузка плейлиста или списка ссылок; элементы - задачи Download с parent_id"""
+    __tablename__ = 'bulk_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(pgUUID(as_uuid=True), unique=True, nullable=False, default=uuid.uuid4)
+    api_key_id = db.Column(db.Integer, index=True)
+    source_url = db.Column(db.String)  # Ссылка на плейлист, None для списка ссылок
+    format = db.Column(db.String)  # Качество элементов: SD, HD, ..., low, medium, high
+    convert_to_mp3 = db.Column(db.Boolean, default=False)
+    item_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)  # Все элементы завершены
+
+class InfoTask(db.Model):
+    """Асинхронный запрос метаданных (async=true), см. utils/info_tasks.py"""
+    __tablename__ = 'info_tasks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(pgUUID(as_uuid=True), unique=True, nullable=False, default=uuid.uuid4)
+    api_key_id = db.Column(db.Integer, index=True)
+    kind = db.Column(db.String)  # info, formats, combined-info
+    url = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, default='queued')  # queued, running, completed, error
+    result = db.Column(db.JSON)
+    error = db.Column(db.String)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    completed_at = db.Column(db.DateTime)
 
 class ApiKey(db.Model):
     __tablename__ = 'api_keys'
@@ -35,6 +79,10 @@ class ApiKey(db.Model):
     expires_at = db.Column(db.DateTime)
     rate_limit = db.Column(db.Integer, default=100)  # Запросов в минуту
     downloads_count = db.Column(db.Integer, default=0)
+    max_concurrent_downloads = db.Column(db.Integer)  # None - значение по умолчанию
+    scheduling_weight = db.Column(db.Integer, default=1)
+    daily_byte_quota = db.Column(db.BigInteger)  # Байт в сутки, None - по умолчанию, 0 - без ограничений
+    speculative_prefetch = db.Column(db.Boolean, default=False)  # Заранее качать вероятное качество после /combined-info
     
     def is_valid(self):
         """Проверка валидности ключа"""
@@ -43,3 +91,12 @@ class ApiKey(db.Model):
         if self.expires_at and self.expires_at < datetime.utcnow():
             return False
         return True
+
+class RateLimitBucket(db.Model):
+    """Корзина токенов для бэкенда RATE_LIMIT_BACKEND=postgres"""
+    __tablename__ = 'rate_limit_buckets'
+
+    key_id = db.Column(db.Integer, primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix timestamp
+    allowed = db.Column(db.Boolean, default=True)
@@ -0,0 +1,106 @@
+import os
+import time
+import logging
+import zipfile
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# ZIP архив нескольких завершенных задач собирается на лету: файлы читаются
+# частями и сразу уходят клиенту, архив не сохраняется на диск, а память не
+# зависит от его размера. Медиафайлы уже сжаты, поэтому записи хранятся без сжатия.
+ARCHIVE_CHUNK_SIZE = int(os.environ.get('ARCHIVE_CHUNK_SIZE', 1024 * 1024))
+MAX_ARCHIVE_TASKS = int(os.environ.get('MAX_ARCHIVE_TASKS', 500))
+
+# Самая ранняя дата, которую можно записать в заголовок ZIP
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class _ChunkSink:
+    """Приемник без seek: zipfile пишет в него, генератор забирает накопленные байты
+
+    Без seek zipfile не возвращается к заголовкам, а пишет размеры и CRC
+    после данных записи (data descriptor).
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._chunks:
+            data = b''.join(self._chunks)
+            self._chunks.clear()
+            yield data
+
+
+def _zip_info(name, stat):
+    date_time = time.localtime(stat.st_mtime)[:6]
+    info = zipfile.ZipInfo(name, date_time=max(date_time, ZIP_EPOCH))
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = stat.st_size
+    return info
+
+
+def iter_zip(entries, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Отдает ZIP архив частями по мере чтения файлов
+
+    Args:
+        entries: Пары (путь к файлу, имя в архиве)
+        chunk_size: Размер части чтения файла
+
+    Yields:
+        bytes: Очередная часть архива
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, name in entries:
+            try:
+                source = open(path, 'rb')
+            except OSError as e:
+                # Файл мог быть удален очисткой после формирования списка
+                logger.warning(f"Skipping {path} in archive: {e}")
+                continue
+            with source:
+                with archive.open(_zip_info(name, os.fstat(source.fileno())), 'w') as entry:
+                    while True:
+                        chunk = source.read(chunk_size)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        yield from sink.drain()
+            yield from sink.drain()
+    # Центральный каталог
+    yield from sink.drain()
+
+
+def archive_entry_name(download, index, used):
+    """Имя файла задачи в архиве: номер, название и расширение, без повторов"""
+    from api.routes import get_safe_filename
+
+    ext = os.path.splitext(download.file_path)[1]
+    title = get_safe_filename(download.title or str(download.task_id)) or str(download.task_id)
+    name = f"{index:03d}_{title}{ext}"
+    suffix = 1
+    while name in used:
+        suffix += 1
+        name = f"{index:03d}_{title}_{suffix}{ext}"
+    used.add(name)
+    return name
+
+
+def archive_entries(downloads):
+    """Пары (путь, имя в архиве) для задач с сохраненным файлом, в порядке списка"""
+    used = set()
+    entries = []
+    for position, download in enumerate(downloads, start=1):
+        if download.file_path and os.path.exists(download.file_path):
+            index = download.item_index or position
+            entries.append((download.file_path, archive_entry_name(download, index, used)))
+    return entries
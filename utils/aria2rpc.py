@@ -0,0 +1,293 @@
+import os
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlparse
+import requests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Один долгоживущий aria2c на узел: соединения, DNS и TLS сессии переиспользуются
+# между задачами. Если демон недоступен, первый обратившийся процесс запускает его.
+ARIA2_RPC_URL = os.environ.get('ARIA2_RPC_URL', 'http://127.0.0.1:6800/jsonrpc')
+ARIA2_RPC_SECRET = os.environ.get('ARIA2_RPC_SECRET', '')
+ARIA2_RPC_AUTOSTART = os.environ.get('ARIA2_RPC_AUTOSTART', 'true').lower() in ('1', 'true', 'yes')
+ARIA2_RPC_MAX_CONCURRENT = int(os.environ.get('ARIA2_RPC_MAX_CONCURRENT', 16))
+ARIA2_RPC_POLL_INTERVAL = float(os.environ.get('ARIA2_RPC_POLL_INTERVAL', 0.5))
+ARIA2_RPC_TIMEOUT = 10
+ARIA2_RPC_START_TIMEOUT = 5.0
+ARIA2_RPC_LOCK_PATH = os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'videodl-aria2rpc.lock'
+)
+
+STATUS_KEYS = ['gid', 'status', 'totalLength', 'completedLength', 'downloadSpeed',
+               'errorCode', 'errorMessage', 'dir']
+
+
+class Aria2RpcError(Exception):
+    """Ошибка вызова aria2 JSON-RPC или загрузки в aria2"""
+    pass
+
+
+class Aria2DownloadCancelled(Aria2RpcError):
+    """Загрузка удалена из aria2 (отменена)"""
+    pass
+
+
+class Aria2RpcClient:
+    """Минимальный клиент aria2 JSON-RPC поверх HTTP с keep-alive"""
+
+    def __init__(self, url=ARIA2_RPC_URL, secret=ARIA2_RPC_SECRET, timeout=ARIA2_RPC_TIMEOUT):
+        self.url = url
+        self.secret = secret
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        # requests.Session не потокобезопасна, поэтому у каждого потока своя
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def call(self, method, *params):
+        if self.secret:
+            params = (f'token:{self.secret}',) + params
+        payload = {
+            'jsonrpc': '2.0',
+            'id': uuid.uuid4().hex,
+            'method': f'aria2.{method}',
+            'params': list(params)
+        }
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise Aria2RpcError(f"aria2 RPC {method} failed: {e}")
+        if data.get('error'):
+            raise Aria2RpcError(f"aria2 RPC {method} failed: {data['error'].get('message')}")
+        return data.get('result')
+
+    def add_uri(self, uris, options=None):
+        return self.call('addUri', list(uris), options or {})
+
+    def tell_status(self, gid, keys=None):
+        return self.call('tellStatus', gid, keys or STATUS_KEYS)
+
+    def tell_active(self, keys=None):
+        return self.call('tellActive', keys or STATUS_KEYS)
+
+    def tell_waiting(self, offset=0, num=1000, keys=None):
+        return self.call('tellWaiting', offset, num, keys or STATUS_KEYS)
+
+    def pause(self, gid):
+        return self.call('pause', gid)
+
+    def unpause(self, gid):
+        return self.call('unpause', gid)
+
+    def remove(self, gid):
+        return self.call('forceRemove', gid)
+
+    def remove_result(self, gid):
+        return self.call('removeDownloadResult', gid)
+
+    def change_option(self, gid, options):
+        return self.call('changeOption', gid, options)
+
+    def get_version(self):
+        return self.call('getVersion')
+
+    def is_available(self):
+        try:
+            self.get_version()
+            return True
+        except Aria2RpcError:
+            return False
+
+
+def _daemon_command(url, secret):
+    parsed = urlparse(url)
+    cmd = [
+        'aria2c',
+        '--enable-rpc',
+        f'--rpc-listen-port={parsed.port or 6800}',
+        '--rpc-listen-all=false',
+        f'--max-concurrent-downloads={ARIA2_RPC_MAX_CONCURRENT}',
+        '--max-connection-per-server=16',
+        '--file-allocation=none',
+        '--auto-file-renaming=false',
+        '--allow-overwrite=true',
+        '--continue=true',
+        '--console-log-level=warn'
+    ]
+    if secret:
+        cmd.append(f'--rpc-secret={secret}')
+    return cmd
+
+
+def ensure_daemon(client):
+    """Проверяет доступность aria2 и при необходимости запускает демон узла"""
+    if client.is_available():
+        return
+    if not ARIA2_RPC_AUTOSTART:
+        raise Aria2RpcError(f"aria2 RPC is not reachable at {client.url}")
+    if shutil.which('aria2c') is None:
+        raise Aria2RpcError('aria2c is not installed')
+
+    # Демон запускает только один процесс узла, остальные ждут его готовности
+    fd = os.open(ARIA2_RPC_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if client.is_available():
+            return
+        logger.info(f"Starting aria2 RPC daemon at {client.url}")
+        subprocess.Popen(
+            _daemon_command(client.url, client.secret),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        deadline = time.monotonic() + ARIA2_RPC_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if client.is_available():
+                return
+            time.sleep(0.1)
+        raise Aria2RpcError(f"aria2 RPC daemon did not start at {client.url}")
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class Aria2RpcDownloader:
+    """Загрузка файлов задачи через общий демон aria2
+
+    Задача в aria2 опознается по каталогу загрузки (downloads/<task_id>),
+    поэтому пауза и отмена работают из любого процесса узла.
+    """
+
+    def __init__(self, client=None):
+        self.client = client or Aria2RpcClient()
+
+    @staticmethod
+    def _options(task_dir, out, headers, connections, min_split_size):
+        return {
+            'dir': task_dir,
+            'out': out,
+            'header': [f'{key}: {value}' for key, value in (headers or {}).items()],
+            'split': str(connections),
+            'max-connection-per-server': str(min(connections, 16)),
+            'min-split-size': str(min_split_size),
+            'allow-overwrite': 'true',
+            'auto-file-renaming': 'false',
+            'file-allocation': 'none',
+            # Докачка по управляющему файлу .aria2 после перезапуска
+            'continue': 'true'
+        }
+
+    def download(self, task_id, sources, task_dir, connections=16, min_split_size='1M',
+                 progress_hook=None, lease=None, max_connections=16):
+        """Скачивает потоки задачи параллельно и возвращает пути к файлам
+
+        Args:
+            sources: Форматы из raw info (url, http_headers, format_id, ext)
+            progress_hook: Получает словари в формате progress hook yt-dlp
+            lease: Доля соединений регулятора, изменения применяются через changeOption
+            max_connections: Верхняя граница соединений при изменении доли
+        """
+        ensure_daemon(self.client)
+        jobs = []
+        try:
+            for source in sources:
+                out = f"{task_id}.f{source.get('format_id')}.{source.get('ext') or 'bin'}"
+                gid = self.client.add_uri([source['url']], self._options(
+                    task_dir, out, source.get('http_headers'), connections, min_split_size))
+                jobs.append({'gid': gid, 'path': os.path.join(task_dir, out), 'done': False})
+                logger.info(f"Task {task_id}: submitted {out} to aria2 as {gid}")
+
+            if lease is not None:
+                def apply_connections(share):
+                    share = max(1, min(share, max_connections))
+                    for job in jobs:
+                        if not job['done']:
+                            self.client.change_option(job['gid'], {
+                                'max-connection-per-server': str(min(share, 16)),
+                                'split': str(share)
+                            })
+                lease.on_change = apply_connections
+
+            while not all(job['done'] for job in jobs):
+                for job in jobs:
+                    if job['done']:
+                        continue
+                    status = self.client.tell_status(job['gid'])
+                    state = status.get('status')
+                    if state == 'error':
+                        raise Aria2RpcError(f"aria2 error {status.get('errorCode')}: "
+                                            f"{status.get('errorMessage')}")
+                    if state == 'removed':
+                        raise Aria2DownloadCancelled(f"Download {job['gid']} was removed")
+                    if progress_hook:
+                        progress_hook({
+                            'status': 'downloading',
+                            'filename': job['path'],
+                            'downloaded_bytes': int(status.get('completedLength') or 0),
+                            'total_bytes': int(status.get('totalLength') or 0) or None,
+                            'speed': int(status.get('downloadSpeed') or 0)
+                        })
+                    job['done'] = state == 'complete'
+                if lease is not None:
+                    lease.refresh()
+                if not all(job['done'] for job in jobs):
+                    time.sleep(ARIA2_RPC_POLL_INTERVAL)
+
+            return [job['path'] for job in jobs]
+        except Exception:
+            for job in jobs:
+                if not job['done']:
+                    try:
+                        self.client.remove(job['gid'])
+                    except Aria2RpcError:
+                        pass
+            raise
+        finally:
+            for job in jobs:
+                try:
+                    self.client.remove_result(job['gid'])
+                except Aria2RpcError:
+                    pass
+
+    def _task_gids(self, task_id):
+        """gid всех активных и ожидающих загрузок задачи"""
+        entries = self.client.tell_active(['gid', 'dir']) + self.client.tell_waiting(keys=['gid', 'dir'])
+        return [entry['gid'] for entry in entries
+                if os.path.basename(os.path.normpath(entry.get('dir', ''))) == task_id]
+
+    def pause(self, task_id):
+        gids = self._task_gids(task_id)
+        for gid in gids:
+            self.client.pause(gid)
+        return bool(gids)
+
+    def resume(self, task_id):
+        gids = self._task_gids(task_id)
+        for gid in gids:
+            self.client.unpause(gid)
+        return bool(gids)
+
+    def cancel(self, task_id):
+        gids = self._task_gids(task_id)
+        for gid in gids:
+            self.client.remove(gid)
+        return bool(gids)
+
+
+aria2_rpc_downloader = Aria2RpcDownloader()
@@ -0,0 +1,207 @@
+import os
+import copy
+import logging
+from abc import ABC, abstractmethod
+import yt_dlp
+from utils.governor import build_aria2_args
+from utils.aria2rpc import aria2_rpc_downloader
+from utils.rangedl import download_ranges, parse_size
+from utils.streaming import DIRECT_PROTOCOLS
+from utils.ydl_pool import download_ydl_pool
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Способ загрузки по умолчанию и переопределения для экстракторов yt-dlp,
+# например DOWNLOAD_BACKEND_BY_EXTRACTOR="youtube=asyncrange,vimeo=aria2rpc"
+DOWNLOAD_BACKEND = os.environ.get('DOWNLOAD_BACKEND', 'aria2c')
+DOWNLOAD_BACKEND_BY_EXTRACTOR = {
+    extractor.strip().lower(): backend.strip()
+    for extractor, _, backend in (
+        item.partition('=') for item in os.environ.get('DOWNLOAD_BACKEND_BY_EXTRACTOR', '').split(',')
+    )
+    if extractor.strip() and backend.strip()
+}
+FALLBACK_BACKEND = 'aria2c'
+
+
+class DownloadJob:
+    """Параметры одной загрузки, общие для всех способов загрузки"""
+
+    def __init__(self, task_id, url, info, format_spec, sources, task_dir,
+                 audio_only, convert_to_mp3, transfer, lease, progress_hook, cancel_token, clip=None):
+        self.task_id = task_id
+        self.url = url
+        self.info = info
+        self.format_spec = format_spec
+        self.sources = sources  # Выбранные форматы из raw info
+        self.task_dir = task_dir
+        self.audio_only = audio_only
+        self.convert_to_mp3 = convert_to_mp3
+        self.transfer = transfer
+        self.lease = lease
+        self.progress_hook = progress_hook
+        self.cancel_token = cancel_token
+        self.clip = clip  # (start, end) в секундах, end None - до конца; None - файл целиком
+        self.connections = min(transfer['connections'], lease.connections)
+        self.fragmented = any(f and f.get('protocol') not in DIRECT_PROTOCOLS for f in sources)
+
+    def cap(self, share):
+        """Число соединений с учетом плана передачи и доли регулятора"""
+        return max(1, min(self.transfer['connections'], share))
+
+    def source_path(self, source):
+        return os.path.join(self.task_dir, f"{self.task_id}.f{source.get('format_id')}.{source.get('ext') or 'bin'}")
+
+    @property
+    def direct(self):
+        """Все потоки задачи - обычные файлы по HTTP"""
+        return bool(self.sources) and all(
+            f and f.get('url') and f.get('protocol') in DIRECT_PROTOCOLS and not f.get('fragments')
+            for f in self.sources
+        )
+
+
+class DownloadBackend(ABC):
+    """Способ загрузки
+
+    download() скачивает каждый поток задачи в отдельный файл и возвращает их
+    список; склейку и перекодирование выполняет пул постобработки.
+    """
+    name = None
+
+    def supports(self, job):
+        return True
+
+    @abstractmethod
+    def download(self, job):
+        """Скачивает потоки задачи и возвращает список файлов"""
+
+
+class YtDlpBackend(DownloadBackend):
+    """Встроенный загрузчик yt-dlp (для HLS/DASH - параллельные фрагменты)"""
+    name = 'native'
+
+    def external_downloader(self, job):
+        return 'native'
+
+    def build_options(self, job, source):
+        """Параметры загрузки потока поверх профиля download (utils/ydl_pool.py)"""
+        options = {
+            'format': source['format_id'],
+            'progress_hooks': [job.progress_hook],
+            'outtmpl': job.source_path(source),
+            'concurrent_fragment_downloads': job.connections,
+            'buffersize': job.transfer['buffersize'],
+            'http_chunk_size': job.transfer['http_chunk_size'],
+            'external_downloader': self.external_downloader(job),
+            'external_downloader_args': build_aria2_args(job.connections, job.fragmented,
+                                                         job.transfer['min_split_size'])
+        }
+        if job.clip:
+            # Фрагмент качается через ffmpeg: для HLS/DASH запрашиваются только
+            # нужные сегменты, в обычных файлах - переход по диапазонам байт
+            start, end = job.clip
+            options['download_ranges'] = yt_dlp.utils.download_range_func(None, [(start, end or float('inf'))])
+        return options
+
+    def download(self, job):
+        files = []
+        # Потоки качаются по очереди из уже извлеченной информации, без склейки
+        for source in job.sources:
+            job.cancel_token.check()
+            ydl_opts = self.build_options(job, source)
+            logger.debug(f"YouTube-DL options: {ydl_opts}")
+            with download_ydl_pool.lease(ydl_opts) as ydl_download:
+                def apply_connections(share):
+                    # Новые параметры применяются при запуске загрузчика для следующего файла
+                    job.connections = job.cap(share)
+                    ydl_download.params['external_downloader_args'] = build_aria2_args(
+                        job.connections, job.fragmented, job.transfer['min_split_size'])
+                    ydl_download.params['concurrent_fragment_downloads'] = job.connections
+
+                job.lease.on_change = apply_connections
+                result = ydl_download.process_ie_result(copy.deepcopy(job.info), download=True)
+            downloaded = (result.get('requested_downloads') or [{}])[0].get('filepath')
+            files.append(downloaded or job.source_path(source))
+        return files
+
+
+class Aria2cBackend(YtDlpBackend):
+    """yt-dlp с внешним aria2c (загрузчик по протоколам берется из плана передачи)"""
+    name = 'aria2c'
+
+    def external_downloader(self, job):
+        return job.transfer['external_downloader']
+
+
+class Aria2RpcBackend(DownloadBackend):
+    """Общий демон aria2 узла (см. utils/aria2rpc.py)"""
+    name = 'aria2rpc'
+
+    def supports(self, job):
+        return job.direct and not job.clip
+
+    def download(self, job):
+        job.cancel_token.on_cancel(lambda: aria2_rpc_downloader.cancel(job.task_id))
+        return aria2_rpc_downloader.download(
+            job.task_id, job.sources, job.task_dir,
+            connections=job.connections,
+            min_split_size=job.transfer['min_split_size'],
+            progress_hook=job.progress_hook,
+            lease=job.lease,
+            max_connections=job.transfer['connections']
+        )
+
+
+class AsyncRangeBackend(DownloadBackend):
+    """Встроенный asyncio загрузчик диапазонами (см. utils/rangedl.py)"""
+    name = 'asyncrange'
+
+    def supports(self, job):
+        return job.direct and not job.clip
+
+    def download(self, job):
+        files = []
+        for source in job.sources:
+            job.cancel_token.check()
+            path = job.source_path(source)
+
+            def attach(range_download):
+                def apply_connections(share):
+                    job.connections = job.cap(share)
+                    range_download.set_connections(job.connections)
+                job.lease.on_change = apply_connections
+                job.cancel_token.on_cancel(range_download.cancel)
+
+            download_ranges(
+                source['url'], path,
+                headers=source.get('http_headers'),
+                connections=job.connections,
+                chunk_size=parse_size(job.transfer['min_split_size']),
+                progress_hook=job.progress_hook,
+                max_connections=job.transfer['connections'],
+                on_created=attach
+            )
+            files.append(path)
+        return files
+
+
+BACKENDS = {backend.name: backend for backend in (
+    YtDlpBackend(), Aria2cBackend(), Aria2RpcBackend(), AsyncRangeBackend()
+)}
+
+
+def select_backend(job, requested=None):
+    """Выбирает способ загрузки: параметр задачи, настройка экстрактора или значение по умолчанию"""
+    extractor = (job.info.get('extractor_key') or job.info.get('extractor') or '').lower()
+    name = requested or DOWNLOAD_BACKEND_BY_EXTRACTOR.get(extractor) or DOWNLOAD_BACKEND
+    backend = BACKENDS.get(name)
+    if backend is None:
+        logger.warning(f"Unknown download backend {name}, using {FALLBACK_BACKEND}")
+        backend = BACKENDS[FALLBACK_BACKEND]
+    if not backend.supports(job):
+        logger.info(f"Backend {backend.name} can not download task {job.task_id} "
+                    f"(fragmented or unknown formats, or a clip), using {FALLBACK_BACKEND}")
+        backend = BACKENDS[FALLBACK_BACKEND]
+    return backend
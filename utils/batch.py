@@ -0,0 +1,108 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Пакетное извлечение метаданных: URL списка извлекаются параллельно в общем
+# для процесса пуле ограниченного размера, результаты отдаются по готовности
+BATCH_EXTRACTION_WORKERS = int(os.environ.get('BATCH_EXTRACTION_WORKERS', 8))
+MAX_BATCH_URLS = int(os.environ.get('MAX_BATCH_URLS', 200))
+
+# Параметры ссылок, не влияющие на содержимое (метки источника перехода)
+TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src'}
+YOUTUBE_HOSTS = {'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com'}
+
+_executor = ThreadPoolExecutor(max_workers=BATCH_EXTRACTION_WORKERS, thread_name_prefix='batch-extract')
+
+
+def canonicalize_url(url):
+    """Приводит ссылку к каноническому виду, чтобы одинаковые видео попадали в один кэш
+
+    Raises:
+        ValueError: Не ссылка http(s)
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if scheme not in ('http', 'https') or not host:
+        raise ValueError(f'Invalid URL: {url}')
+
+    # Ссылки YouTube на одно видео сводятся к watch?v=ID
+    video_id = None
+    if host == 'youtu.be':
+        video_id = parts.path.strip('/').split('/')[0]
+    elif host in YOUTUBE_HOSTS:
+        if parts.path == '/watch':
+            video_id = dict(parse_qsl(parts.query)).get('v')
+        elif parts.path.startswith(('/shorts/', '/live/')):
+            video_id = parts.path.split('/')[2]
+    if video_id:
+        return f'https://www.youtube.com/watch?v={video_id}'
+
+    netloc = host if parts.port is None else f'{host}:{parts.port}'
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    ])
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def iter_batch(urls, extract):
+    """Извлекает данные для списка ссылок и отдает результаты по мере готовности
+
+    Повторяющиеся (после канонизации) ссылки извлекаются один раз.
+
+    Args:
+        urls: Ссылки в порядке запроса
+        extract: Функция извлечения для одной канонической ссылки (обычно кэширующая)
+
+    Yields:
+        dict: url (каноническая), requested_urls, result или error
+    """
+    requested = {}
+    for url in urls:
+        if not isinstance(url, str):
+            yield {'url': None, 'requested_urls': [url], 'error': 'URL must be a string'}
+            continue
+        try:
+            canonical = canonicalize_url(url)
+        except ValueError as e:
+            yield {'url': None, 'requested_urls': [url], 'error': str(e)}
+            continue
+        requested.setdefault(canonical, []).append(url)
+
+    futures = {_executor.submit(extract, canonical): canonical for canonical in requested}
+    try:
+        for future in as_completed(futures):
+            canonical = futures[future]
+            item = {'url': canonical, 'requested_urls': requested[canonical]}
+            try:
+                item['result'] = future.result()
+            except Exception as e:
+                logger.error(f"Batch extraction failed for {canonical}: {e}")
+                item['error'] = str(e)
+            yield item
+    finally:
+        # Клиент отключился: еще не начатые извлечения не запускаются
+        for future in futures:
+            future.cancel()
+
+
+def extract_all(urls, extract):
+    """Извлекает данные для ссылок параллельно в пуле пакетного извлечения
+
+    Returns:
+        list: (result, error) в порядке ссылок
+    """
+    futures = [_executor.submit(extract, url) for url in urls]
+    results = []
+    for url, future in zip(urls, futures):
+        try:
+            results.append((future.result(), None))
+        except Exception as e:
+            logger.error(f"Extraction failed for {url}: {e}")
+            results.append((None, str(e)))
+    return results
@@ -0,0 +1,126 @@
+import os
+import logging
+from datetime import datetime
+from collections import Counter
+from models import Download, BulkJob
+from extensions import db
+from utils.batch import canonicalize_url
+from utils.playlist import get_cached_playlist_page, MAX_PLAYLIST_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Пакетная загрузка: родительская запись BulkJob и задача Download на каждый
+# элемент. Элементы проходят через общую очередь и выполняются параллельно в
+# пределах лимитов ключа и узла, как обычные задачи.
+MAX_BULK_ITEMS = int(os.environ.get('MAX_BULK_ITEMS', 500))
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+
+def expand_playlist(url, max_items=MAX_BULK_ITEMS):
+    """Ссылки на видео плейлиста или канала (плоское извлечение страницами)"""
+    urls = []
+    offset = 0
+    while len(urls) < max_items:
+        page = get_cached_playlist_page(url, offset, MAX_PLAYLIST_PAGE_SIZE)
+        urls.extend(entry['url'] for entry in page['entries'] if entry['url'] and entry['type'] == 'url')
+        if not page['next_cursor']:
+            break
+        offset += MAX_PLAYLIST_PAGE_SIZE
+    return urls[:max_items]
+
+
+def normalize_urls(urls):
+    """Убирает повторы (по канонической форме ссылки), сохраняя порядок
+
+    В задачи попадает исходная ссылка клиента: каноническая форма служит
+    только для сравнения.
+
+    Raises:
+        ValueError: Элемент списка не является ссылкой http(s)
+    """
+    result = []
+    seen = set()
+    for url in urls:
+        if not isinstance(url, str):
+            raise ValueError('URL must be a string')
+        canonical = canonicalize_url(url)
+        if canonical not in seen:
+            seen.add(canonical)
+            result.append(url.strip())
+    return result
+
+
+def bulk_status(items):
+    """Сводный статус пакетной загрузки по задачам элементов
+
+    Returns:
+        dict: status, counts, progress (%), eta (с), items
+    """
+    counts = Counter(item.status for item in items)
+    finished = sum(counts[status] for status in TERMINAL_STATUSES)
+
+    if items and finished == len(items):
+        if counts['completed'] == len(items):
+            status = 'completed'
+        elif counts['completed']:
+            status = 'partial'
+        else:
+            status = 'failed'
+    elif counts['queued'] == len(items):
+        status = 'queued'
+    else:
+        status = 'running'
+
+    # Завершенные с ошибкой элементы тоже больше не ждут, поэтому считаются за 100%
+    progress = sum(
+        100.0 if item.status in TERMINAL_STATUSES else (item.progress or 0) for item in items
+    ) / len(items) if items else 0.0
+
+    eta = None
+    started = [item.started_at for item in items if item.started_at]
+    if started and 0 < progress < 100:
+        elapsed = (datetime.utcnow() - min(started)).total_seconds()
+        eta = round(elapsed * (100 - progress) / progress)
+
+    return {
+        'status': status,
+        'counts': dict(counts),
+        'progress': round(progress, 1),
+        'eta': eta,
+        'items': [
+            {
+                'index': item.item_index,
+                'task_id': str(item.task_id),
+                'url': item.url,
+                'title': item.title,
+                'status': item.status,
+                'progress': item.progress,
+                'error': item.error
+            }
+            for item in sorted(items, key=lambda item: item.item_index or 0)
+        ]
+    }
+
+
+def finalize_bulk_jobs():
+    """Отмечает завершенные пакетные загрузки
+
+    Вызывается диспетчером каждого процесса; завершение фиксируется атомарным UPDATE.
+    """
+    pending = BulkJob.query.filter(BulkJob.completed_at.is_(None)).all()
+    for bulk in pending:
+        unfinished = Download.query.filter(
+            Download.parent_id == bulk.job_id,
+            Download.status.notin_(TERMINAL_STATUSES)
+        ).count()
+        if unfinished:
+            continue
+
+        finished = BulkJob.query.filter(
+            BulkJob.id == bulk.id,
+            BulkJob.completed_at.is_(None)
+        ).update({'completed_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if finished:
+            logger.info(f"Bulk job {bulk.job_id} finished")
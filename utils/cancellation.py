@@ -0,0 +1,137 @@
+import os
+import time
+import signal
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Сколько ждать завершения дочерних процессов после SIGTERM до SIGKILL
+KILL_TIMEOUT = 0.5
+
+
+class DownloadCancelled(Exception):
+    """Задача отменена пользователем"""
+    pass
+
+
+class CancelToken:
+    """Флаг отмены задачи текущего процесса и обработчики, которые ее прерывают"""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise DownloadCancelled(f"Task {self.task_id} was cancelled")
+
+    def on_cancel(self, callback):
+        """Регистрирует обработчик; если задача уже отменена, вызывает его сразу"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in cancel handler for {self.task_id}: {e}")
+        kill_task_processes(self.task_id)
+
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def register(task_id):
+    with _tokens_lock:
+        token = _tokens[task_id] = CancelToken(task_id)
+    return token
+
+
+def unregister(task_id):
+    with _tokens_lock:
+        _tokens.pop(task_id, None)
+
+
+def get_token(task_id):
+    with _tokens_lock:
+        return _tokens.get(task_id)
+
+
+def cancel_local(task_id):
+    """Отменяет задачу, если она выполняется в текущем процессе"""
+    token = get_token(task_id)
+    if token is None:
+        return False
+    logger.info(f"Cancelling task {task_id}")
+    token.cancel()
+    return True
+
+
+def _child_pids(task_id):
+    """Дочерние процессы (aria2c, ffmpeg), в командной строке которых есть task_id"""
+    own_pid = os.getpid()
+    pids = []
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return pids
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != own_pid:
+                continue
+            with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                if task_id.encode() in f.read():
+                    pids.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return pids
+
+
+def _running(pid):
+    """Процесс существует и не стал зомби (ожидает wait() родителя)"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return False
+
+
+def kill_task_processes(task_id):
+    """Завершает процессы загрузчика и ffmpeg задачи"""
+    pids = _child_pids(task_id)
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + KILL_TIMEOUT
+    while pids and time.monotonic() < deadline:
+        time.sleep(0.05)
+        pids = [pid for pid in pids if _running(pid)]
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
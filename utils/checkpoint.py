@@ -0,0 +1,91 @@
+import os
+import json
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Контрольная точка задачи хранится рядом с файлами в downloads/<task_id>/.
+# Недокачанные файлы (.part, управляющие файлы aria2, карты диапазонов)
+# сохраняются между перезапусками, если источник не изменился.
+CHECKPOINT_FILE = 'checkpoint.json'
+INFO_FILE = 'info.json'
+
+# Поля формата, по которым проверяется, что на диске тот же поток
+FINGERPRINT_FIELDS = ('format_id', 'ext', 'protocol', 'filesize', 'vcodec', 'acodec', 'width', 'height')
+
+
+def format_fingerprint(sources):
+    """Отпечаток выбранных форматов: при его изменении докачка невозможна"""
+    return [
+        {field: source.get(field) for field in FINGERPRINT_FIELDS} if source else None
+        for source in sources
+    ]
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _wipe(task_dir):
+    for name in os.listdir(task_dir):
+        file_path = os.path.join(task_dir, name)
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+            logger.debug(f"Removed existing file: {file_path}")
+
+
+def prepare_task_dir(task_dir, url, format_spec, sources, backend, info):
+    """Готовит каталог задачи к загрузке
+
+    Если в каталоге есть контрольная точка той же задачи (URL, форматы,
+    способ загрузки и отпечаток форматов совпадают), файлы сохраняются и
+    загрузка продолжается с уже скачанных байт. Иначе каталог очищается.
+
+    Returns:
+        bool: True, если загрузка будет продолжена
+    """
+    os.makedirs(task_dir, mode=0o755, exist_ok=True)
+    checkpoint_path = os.path.join(task_dir, CHECKPOINT_FILE)
+    checkpoint = {
+        'url': url,
+        'format': format_spec,
+        'backend': backend,
+        'fingerprint': format_fingerprint(sources)
+    }
+
+    previous = _load(checkpoint_path)
+    resumed = previous is not None and all(
+        previous.get(key) == value for key, value in checkpoint.items()
+    )
+    if previous is not None and not resumed:
+        logger.info(f"Source formats changed since checkpoint in {task_dir}, starting over")
+    if not resumed:
+        _wipe(task_dir)
+
+    checkpoint['created_at'] = previous['created_at'] if resumed else datetime.utcnow().isoformat()
+    checkpoint['resumed_at'] = datetime.utcnow().isoformat() if resumed else None
+    _write(checkpoint_path, checkpoint)
+    _write(os.path.join(task_dir, INFO_FILE), info)
+    return resumed
+
+
+def clear_checkpoint(task_dir):
+    """Удаляет контрольную точку после успешного завершения задачи"""
+    for name in (CHECKPOINT_FILE, INFO_FILE):
+        try:
+            os.remove(os.path.join(task_dir, name))
+        except FileNotFoundError:
+            pass
@@ -4,11 +4,21 @@ import time
 import logging
 import threading
 from datetime import datetime, timedelta
-import yt_dlp
 import shutil
+from urllib.parse import urlparse
 from models import Download
 from extensions import db
 from flask import current_app
+from utils.governor import connection_governor
+from utils.transfer import plan_transfer, record_throughput, estimate_time_to_ready
+from utils.planner import plan_output, build_command, local_audio_source
+from utils.postprocess import postprocess_pool, run_ffmpeg
+from utils.backends import DownloadJob, select_backend
+from utils.checkpoint import prepare_task_dir, clear_checkpoint
+from utils.batch import canonicalize_url
+from utils.extraction import run_extraction, extract_info
+from utils import cancellation
+from utils.cancellation import DownloadCancelled
 
 # Cache for video metadata
 from functools import lru_cache
@@ -24,40 +34,89 @@ os.makedirs(downloads_dir, exist_ok=True)
 # Global variables
 cleanup_thread = None
 
+# Скачанные байты по файлам каждой активной задачи: {task_id: {filename: bytes}}
+_transferred_bytes = {}
+
+# Полная информация yt-dlp (с прямыми ссылками на потоки) кэшируется ненадолго,
+# так как ссылки на CDN со временем протухают
+RAW_INFO_CACHE_TTL = int(os.environ.get('RAW_INFO_CACHE_TTL', 300))
+RAW_INFO_CACHE_SIZE = 100
+_raw_info_cache = {}
+_raw_info_lock = threading.Lock()
+
+def extract_raw_info(url):
+    """Extract full yt-dlp info dict including stream URLs and HTTP headers"""
+    logger.info(f"Extracting raw info for URL: {url}")
+    return run_extraction(extract_info, url)
+
+def get_cached_raw_info(url):
+    """Cache full info results for RAW_INFO_CACHE_TTL seconds"""
+    now = time.time()
+    with _raw_info_lock:
+        entry = _raw_info_cache.get(url)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    info = extract_raw_info(url)
+
+    with _raw_info_lock:
+        if len(_raw_info_cache) >= RAW_INFO_CACHE_SIZE:
+            for key in [k for k, v in _raw_info_cache.items() if v[0] <= now]:
+                del _raw_info_cache[key]
+            if len(_raw_info_cache) >= RAW_INFO_CACHE_SIZE:
+                oldest = min(_raw_info_cache, key=lambda k: _raw_info_cache[k][0])
+                del _raw_info_cache[oldest]
+        _raw_info_cache[url] = (now + RAW_INFO_CACHE_TTL, info)
+    return info
+
+def find_raw_format(info, format_id):
+    """Find format dict with stream URL by format_id in raw info"""
+    if not format_id:
+        return None
+    if info.get('format_id') == format_id and info.get('url'):
+        return info
+    return next((f for f in info.get('formats') or [] if f.get('format_id') == format_id), None)
+
+def get_source_host(formats, url):
+    """Хост, с которого будут скачиваться потоки (для распределения соединений)"""
+    for f in formats:
+        host = urlparse(f.get('url') or '').hostname
+        if host:
+            return host
+    return urlparse(url).hostname or 'unknown'
+
 @lru_cache(maxsize=100)
 def get_cached_video_info(url):
     """Cache video info results to avoid repeated API calls"""
     return get_video_info(url)
 
-@lru_cache(maxsize=100)
-def get_cached_formats(url, filtered=False):
-    """Cache video formats to avoid repeated API calls"""
-    cache_key = f"{url}_{filtered}"
-    return get_video_formats(url, filtered)
+def get_cached_formats(url, filtered=False, prefer=None):
+    """Форматы из кэша полной информации (RAW_INFO_CACHE_TTL)
+
+    Сами форматы не кэшируются: они строятся из кэшированной информации без
+    обращения к источнику, а estimated_time_to_ready зависит от текущей
+    скорости хоста.
+    """
+    return get_video_formats(url, filtered, prefer)
 
 def get_video_info(url):
     """Get basic video information without formats"""
     logger.info(f"Extracting basic info for URL: {url}")
     
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-    }
-    
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            return {
-                'title': info.get('title'),
-                'author': info.get('uploader'),
-                'description': info.get('description'),
-                'duration': info.get('duration'),
-                'thumbnail': info.get('thumbnail'),
-                'view_count': info.get('view_count'),
-                'like_count': info.get('like_count'),
-                'comment_count': info.get('comment_count')
-            }
+        # Одно извлечение на ссылку используется и для информации, и для форматов
+        info = get_cached_raw_info(url)
+        
+        return {
+            'title': info.get('title'),
+            'author': info.get('uploader'),
+            'description': info.get('description'),
+            'duration': info.get('duration'),
+            'thumbnail': info.get('thumbnail'),
+            'view_count': info.get('view_count'),
+            'like_count': info.get('like_count'),
+            'comment_count': info.get('comment_count')
+        }
     except Exception as e:
         logger.error(f"Error extracting video info: {str(e)}")
         raise
@@ -80,8 +139,33 @@ def format_size(size):
         logger.error(f"Error formatting size {size}: {str(e)}")
         return "Unknown"
 
-def get_filtered_formats(formats):
-    """Filter and group formats into SD, HD, FullHD, 2K and 4K bundles"""
+# Режимы выбора форматов для качеств SD, HD, ...: quality - лучший видео поток
+# и отдельный звук, fast - по возможности один прогрессивный файл без склейки
+PREFER_MODES = ('quality', 'fast')
+VIDEO_QUALITIES = ('SD', 'HD', 'FullHD', '2K', '4K')
+AUDIO_QUALITIES = ('low', 'medium', 'high')
+
+def is_progressive(format_dict):
+    """Один файл с видео и звуком"""
+    return format_dict.get('vcodec') not in (None, 'none') and format_dict.get('acodec') not in (None, 'none')
+
+def get_height(format_dict):
+    """Высота кадра из resolution ('1280x720'), 0 если неизвестна"""
+    resolution = format_dict.get('resolution') or ''
+    try:
+        return int(resolution.split('x')[1]) if 'x' in resolution else 0
+    except (ValueError, IndexError):
+        return 0
+
+def get_filtered_formats(formats, prefer=None, duration=None, host=None):
+    """Filter and group formats into SD, HD, FullHD, 2K and 4K bundles
+
+    Args:
+        formats: Форматы из get_video_formats
+        prefer: 'fast' - выбирать прогрессивный формат, если он есть в качестве
+        duration: Длительность видео (для оценки размера по битрейту)
+        host: Хост источника (для оценки времени загрузки)
+    """
     video_formats = [f for f in formats if f.get('vcodec') != 'none']
     audio_formats = [f for f in formats if f.get('acodec') in ('opus', 'mp4a.40.2', 'mp3') and f.get('vcodec') == 'none']
     
@@ -92,15 +176,6 @@ def get_filtered_formats(formats):
     
     best_audio = next((f for f in audio_formats if f.get('tbr', 0) >= 48), audio_formats[0] if audio_formats else None)
     
-    def get_height(format_dict):
-        resolution = format_dict.get('resolution', '')
-        if 'x' in resolution:
-            try:
-                return int(resolution.split('x')[1])
-            except (ValueError, IndexError):
-                return 0
-        return 0
-    
     # Группируем видео форматы по качеству
     sd_formats = [f for f in video_formats if get_height(f) == 480]
     hd_formats = [f for f in video_formats if get_height(f) == 720]
@@ -144,40 +219,26 @@ def get_filtered_formats(formats):
         'audio_only': {}
     }
     
-    if sd_formats:
-        result['formats']['SD'] = {
-            'video': sd_formats[0],
-            'audio': best_audio,
-            'resolution': '480p'
-        }
-    
-    if hd_formats:
-        result['formats']['HD'] = {
-            'video': hd_formats[0],
-            'audio': best_audio,
-            'resolution': '720p'
-        }
-    
-    if fullhd_formats:
-        result['formats']['FullHD'] = {
-            'video': fullhd_formats[0],
-            'audio': best_audio,
-            'resolution': '1080p'
-        }
-    
-    if uhd2k_formats:
-        result['formats']['2K'] = {
-            'video': uhd2k_formats[0],
-            'audio': best_audio,
-            'resolution': '1440p'
-        }
-    
-    if uhd4k_formats:
-        result['formats']['4K'] = {
-            'video': uhd4k_formats[0],
-            'audio': best_audio,
-            'resolution': '2160p'
-        }
+    bundles = (
+        ('SD', sd_formats, '480p'),
+        ('HD', hd_formats, '720p'),
+        ('FullHD', fullhd_formats, '1080p'),
+        ('2K', uhd2k_formats, '1440p'),
+        ('4K', uhd4k_formats, '2160p')
+    )
+    for quality, quality_formats, resolution in bundles:
+        if not quality_formats:
+            continue
+        progressive = [f for f in quality_formats if is_progressive(f)] if prefer == 'fast' else []
+        if progressive:
+            # Один файл: загрузка без второго потока и без склейки
+            bundle = {'video': progressive[0], 'audio': None, 'resolution': resolution, 'progressive': True}
+            streams = [progressive[0]]
+        else:
+            bundle = {'video': quality_formats[0], 'audio': best_audio, 'resolution': resolution, 'progressive': False}
+            streams = [f for f in (quality_formats[0], best_audio) if f]
+        bundle['estimated_time_to_ready'] = estimate_time_to_ready(streams, host, duration)
+        result['formats'][quality] = bundle
     
     # Добавляем форматы только аудио
     for quality, format_data in audio_by_quality.items():
@@ -189,64 +250,147 @@ def get_filtered_formats(formats):
     
     return result
 
-def get_video_formats(url, filtered=False):
+def get_format_size(format_dict):
+    """Точный или примерный размер формата в байтах"""
+    return format_dict.get('filesize') or format_dict.get('filesize_approx')
+
+def get_budget_formats(formats, max_size_mb):
+    """Лучшая пара видео + аудио (или прогрессивный формат), которая помещается в размер
+
+    Args:
+        formats: Форматы из get_video_formats
+        max_size_mb: Ограничение суммарного размера в МБ
+
+    Returns:
+        dict: video, audio (None для прогрессивного формата), progressive,
+            estimated_size; None, если ни одна комбинация не помещается
+    """
+    budget = max_size_mb * 1024 * 1024
+    # Форматы без известного размера пропускаются: уложиться в лимит для них нельзя гарантировать
+    video_formats = [f for f in formats if f.get('vcodec') not in (None, 'none') and get_format_size(f)]
+    audio_formats = [f for f in formats
+                     if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none') and get_format_size(f)]
+
+    best = None
+    best_key = None
+    for video in video_formats:
+        video_size = get_format_size(video)
+        if video_size > budget:
+            continue
+        candidates = [None] if is_progressive(video) else audio_formats
+        for audio in candidates:
+            size = video_size + (get_format_size(audio) if audio else 0)
+            if size > budget:
+                continue
+            # Сначала разрешение и битрейт видео, затем битрейт звука, при равенстве - меньший файл
+            key = (get_height(video), video.get('tbr') or 0, (audio or video).get('tbr') or 0, -size)
+            if best_key is None or key > best_key:
+                best_key = key
+                best = {'video': video, 'audio': audio, 'size': size}
+
+    if best is None:
+        return None
+    return {
+        'video': best['video'],
+        'audio': best['audio'],
+        'resolution': best['video'].get('resolution'),
+        'progressive': best['audio'] is None,
+        'estimated_size': best['size'],
+        'formatted_estimated_size': format_size(best['size']),
+        'max_size_mb': max_size_mb
+    }
+
+def build_formats_info(info):
+    """Форматы для ответов API из raw info (размер оценивается по битрейту, если неизвестен)"""
+    raw_formats = info.get('formats', [])
+    duration = info.get('duration', 0)
+    formats_info = []
+    for f in raw_formats:
+        filesize = f.get('filesize')
+        filesize_approx = f.get('filesize_approx')
+        tbr = f.get('tbr')
+        
+        if filesize is None and filesize_approx is None and tbr and duration:
+            filesize_approx = int(tbr * duration * 125)
+            logger.debug(f"Calculated approximate size from tbr: {filesize_approx}")
+        
+        logger.debug(f"Processing format {f.get('format_id')}: size={filesize}, approx={filesize_approx}, tbr={tbr}")
+        
+        formatted_size = format_size(filesize) if filesize else None
+        formatted_size_approx = format_size(filesize_approx) if filesize_approx else None
+        
+        if formatted_size:
+            logger.debug(f"Exact size formatted: {formatted_size}")
+        if formatted_size_approx:
+            formatted_size_approx = f"~{formatted_size_approx}"
+            logger.debug(f"Approx size formatted: {formatted_size_approx}")
+
+        format_data = {
+            'format_id': f.get('format_id'),
+            'format': f.get('format'),
+            'ext': f.get('ext'),
+            'resolution': f.get('resolution'),
+            'filesize': filesize,
+            'filesize_approx': filesize_approx,
+            'formatted_filesize': formatted_size,
+            'formatted_filesize_approx': formatted_size_approx,
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'tbr': tbr,
+            'fps': f.get('fps')
+        }
+        
+        formats_info.append(format_data)
+    return formats_info
+
+def resolve_quality(info, quality):
+    """Конкретные форматы для качества (SD, HD, ..., low, medium, high) по raw info
+
+    Если качества нет, берется ближайшее более низкое, иначе ближайшее более
+    высокое: элементы плейлиста могут отличаться набором качеств.
+
+    Returns:
+        tuple: (video_format_id, audio_format_id, format_id, audio_only)
+
+    Raises:
+        ValueError: Подходящих форматов нет
+    """
+    filtered = get_filtered_formats(build_formats_info(info))
+    if quality in AUDIO_QUALITIES:
+        available, order = filtered['audio_only'], AUDIO_QUALITIES
+    else:
+        available, order = filtered['formats'], VIDEO_QUALITIES
+    position = order.index(quality)
+    candidates = list(order[position::-1]) + list(order[position + 1:])
+    selected = next((q for q in candidates if q in available), None)
+    if selected is None:
+        raise ValueError(f"No formats available for quality {quality}")
+    if selected != quality:
+        logger.info(f"Quality {quality} is not available, using {selected}")
+
+    bundle = available[selected]
+    if quality in AUDIO_QUALITIES:
+        return None, bundle['format']['format_id'], None, True
+    if not bundle.get('audio'):
+        return None, None, bundle['video']['format_id'], False
+    return bundle['video']['format_id'], bundle['audio']['format_id'], None, False
+
+def get_video_formats(url, filtered=False, prefer=None):
     """Get available video formats"""
     logger.info(f"Extracting formats for URL: {url}")
     
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-    }
-    
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            raw_formats = info.get('formats', [])
-            duration = info.get('duration', 0)
-            logger.debug(f"Got {len(raw_formats)} formats from yt-dlp")
-
-            formats_info = []
-            for f in raw_formats:
-                filesize = f.get('filesize')
-                filesize_approx = f.get('filesize_approx')
-                tbr = f.get('tbr')
-                
-                if filesize is None and filesize_approx is None and tbr and duration:
-                    filesize_approx = int(tbr * duration * 125)
-                    logger.debug(f"Calculated approximate size from tbr: {filesize_approx}")
-                
-                logger.debug(f"Processing format {f.get('format_id')}: size={filesize}, approx={filesize_approx}, tbr={tbr}")
-                
-                formatted_size = format_size(filesize) if filesize else None
-                formatted_size_approx = format_size(filesize_approx) if filesize_approx else None
-                
-                if formatted_size:
-                    logger.debug(f"Exact size formatted: {formatted_size}")
-                if formatted_size_approx:
-                    formatted_size_approx = f"~{formatted_size_approx}"
-                    logger.debug(f"Approx size formatted: {formatted_size_approx}")
-
-                format_data = {
-                    'format_id': f.get('format_id'),
-                    'format': f.get('format'),
-                    'ext': f.get('ext'),
-                    'resolution': f.get('resolution'),
-                    'filesize': filesize,
-                    'filesize_approx': filesize_approx,
-                    'formatted_filesize': formatted_size,
-                    'formatted_filesize_approx': formatted_size_approx,
-                    'vcodec': f.get('vcodec'),
-                    'acodec': f.get('acodec'),
-                    'tbr': tbr,
-                    'fps': f.get('fps')
-                }
-                
-                formats_info.append(format_data)
-            
-            if filtered:
-                return get_filtered_formats(formats_info)
-            return formats_info
-            
+        info = get_cached_raw_info(url)
+        raw_formats = info.get('formats', [])
+        duration = info.get('duration', 0)
+        logger.debug(f"Got {len(raw_formats)} formats from yt-dlp")
+        
+        formats_info = build_formats_info(info)
+        
+        if filtered:
+            return get_filtered_formats(formats_info, prefer, duration, get_source_host(raw_formats, url))
+        return formats_info
+        
     except Exception as e:
         logger.error(f"Error extracting video info: {str(e)}")
         raise
@@ -265,7 +409,7 @@ def verify_file_complete(file_path):
     
     try:
         def find_video_files(directory):
-            video_extensions = {'.mp4', '.webm', '.mkv', '.m4a'}
+            video_extensions = {'.mp4', '.webm', '.mkv', '.m4a', '.mp3'}
             files = []
             with os.scandir(directory) as entries:
                 for entry in entries:
@@ -426,6 +570,11 @@ def download_progress_hook(d):
     
     try:
         with current_app.app_context():
+            # Отмена прерывает загрузку исключением из hook
+            token = cancellation.get_token(task_id)
+            if token:
+                token.check()
+
             if d['status'] == 'downloading':
                 progress = 0
                 if 'total_bytes_estimate' in d:
@@ -435,10 +584,23 @@ def download_progress_hook(d):
                 elif 'total_fragments' in d:
                     progress = (d.get('fragment_index', 0) / d['total_fragments']) * 100
                 
-                Download.query.filter_by(task_id=task_id).update({
+                # Учитываем фактически скачанные байты по всем файлам задачи (видео и аудио)
+                files = _transferred_bytes.setdefault(task_id, {})
+                files[d.get('filename')] = d.get('downloaded_bytes', 0) or 0
+
+                # Доля соединений могла измениться из-за задач в других процессах
+                lease = connection_governor.get_lease(task_id)
+                if lease:
+                    lease.refresh()
+
+                Download.query.filter(
+                    Download.task_id == task_id,
+                    Download.status != 'cancelled'
+                ).update({
                     'progress': min(95, progress),
-                    'status': 'downloading'
-                })
+                    'status': 'downloading',
+                    'downloaded_bytes': sum(files.values())
+                }, synchronize_session=False)
                 db.session.commit()
 
                 downloaded_bytes = d.get('downloaded_bytes', 0)
@@ -457,63 +619,196 @@ def download_progress_hook(d):
                     print(f"\033[K{progress_bar}", end="", flush=True)
                 
             elif d['status'] == 'finished':
-                logger.info(f"Download finished for task {task_id}")
-                download = Download.query.filter_by(task_id=task_id).first()
-                if not download:
-                    logger.error(f"Download record not found for task {task_id}")
-                    return
-                
-                downloaded_file = d.get('filename')
-                if not downloaded_file:
-                    logger.error(f"No filename provided for task {task_id}")
-                    return
-                
-                logger.info(f"Download finished for task {task_id}, file: {downloaded_file}")
-                
-                filename = os.path.basename(downloaded_file)
-                final_path = os.path.join(downloads_dir, task_id, filename)
-                
-                download.status = 'processing'
-                download.progress = 95
-                download.file_path = final_path
-                db.session.add(download)
-                db.session.commit()
-                
-                max_retries = 3
-                retry_delay = 2
-                
-                for attempt in range(max_retries):
-                    logger.debug(f"Verification attempt {attempt + 1}/{max_retries}")
-                    time.sleep(retry_delay)
-                    
-                    if verify_file_complete(final_path):
-                        logger.info(f"File verified on attempt {attempt + 1}")
-                        download.progress = 100
-                        download.status = 'completed'
-                        download.completed_at = datetime.utcnow()
-                        db.session.add(download)
-                        db.session.commit()
-                        return
-                
-                logger.error(f"File verification failed after {max_retries} attempts")
-                download.status = 'error'
-                download.error = 'File verification failed'
-                db.session.add(download)
-                db.session.commit()
+                # Поток скачан; итоговый файл собирает пул постобработки
+                logger.info(f"Download finished for task {task_id}, file: {d.get('filename')}")
                 
             elif d['status'] == 'error':
                 error_msg = str(d.get('error', 'Unknown error'))
                 logger.error(f"Download error for task {task_id}: {error_msg}")
-                Download.query.filter_by(task_id=task_id).update({
+                Download.query.filter(
+                    Download.task_id == task_id,
+                    Download.status != 'cancelled'
+                ).update({
                     'status': 'error',
                     'error': error_msg
-                })
+                }, synchronize_session=False)
                 db.session.commit()
                 
+    except DownloadCancelled:
+        raise
     except Exception as e:
         logger.error(f"Error in progress hook: {str(e)}", exc_info=True)
 
-def download_video(task_id, url, video_format_id=None, audio_format_id=None, format_id=None, audio_only=False, convert_to_mp3=False):
+def complete_download(task_id, final_path):
+    """Проверяет итоговый файл и отмечает задачу завершенной
+
+    Статус меняется только у неотмененной задачи: отмена (или отказ от
+    спекулятивной загрузки) во время проверки не перезаписывается.
+    """
+    def update(values):
+        updated = Download.query.filter(
+            Download.task_id == task_id,
+            Download.status != 'cancelled'
+        ).update(values, synchronize_session=False)
+        db.session.commit()
+        return updated
+
+    if not update({'status': 'processing', 'progress': 95, 'file_path': final_path}):
+        logger.info(f"Task {task_id} is cancelled or missing, not completing it")
+        return
+    
+    max_retries = 3
+    retry_delay = 2
+    
+    for attempt in range(max_retries):
+        logger.debug(f"Verification attempt {attempt + 1}/{max_retries}")
+        if attempt:
+            time.sleep(retry_delay)
+        
+        if verify_file_complete(final_path):
+            logger.info(f"File verified on attempt {attempt + 1}")
+            update({'progress': 100, 'status': 'completed', 'completed_at': datetime.utcnow()})
+            return
+    
+    logger.error(f"File verification failed after {max_retries} attempts")
+    update({'status': 'error', 'error': 'File verification failed'})
+
+def clip_spec(clip):
+    """Фрагмент в синтаксисе --download-sections yt-dlp: *start-end"""
+    start, end = clip
+    return f"*{start:g}-{'inf' if end is None else f'{end:g}'}"
+
+def postprocess_download(app, task_id, files, plan, duration=None):
+    """Собирает итоговый файл из скачанных потоков (выполняется в пуле постобработки)
+
+    Способ сборки выбирается планировщиком (utils/planner.py): переименование,
+    перепаковка без перекодирования или перекодирование звука.
+    """
+    with app.app_context():
+        token = cancellation.get_token(task_id) or cancellation.register(task_id)
+        task_dir = os.path.dirname(files[0])
+        try:
+            token.check()
+            output = os.path.join(task_dir, f"{task_id}.{plan['container']}")
+
+            def report(progress):
+                Download.query.filter_by(task_id=task_id, status='postprocessing').update(
+                    {'postprocess_progress': round(progress, 1)}, synchronize_session=False)
+                db.session.commit()
+
+            started = time.monotonic()
+            if plan['action'] == 'copy':
+                os.replace(files[0], output)
+                cpu_seconds = 0.0
+            else:
+                logger.info(f"Postprocessing {len(files)} file(s) for task {task_id} into {output} "
+                            f"({plan['action']}: {plan['reason']})")
+                cpu_seconds = run_ffmpeg(build_command(plan, files, output), duration, report)
+                for path in files:
+                    if path != output and os.path.exists(path):
+                        os.remove(path)
+            report(100)
+            plan = {**plan, 'cpu_seconds': round(cpu_seconds, 3),
+                    'elapsed_seconds': round(time.monotonic() - started, 3)}
+            Download.query.filter_by(task_id=task_id).update(
+                {'postprocess_plan': plan}, synchronize_session=False)
+            db.session.commit()
+
+            token.check()
+            complete_download(task_id, output)
+            clear_checkpoint(task_dir)
+        except Exception as e:
+            db.session.rollback()
+            if token.cancelled:
+                logger.info(f"Task {task_id} cancelled during postprocessing, removing files")
+                shutil.rmtree(task_dir, ignore_errors=True)
+            else:
+                logger.error(f"Error postprocessing task {task_id}: {e}")
+                Download.query.filter(
+                    Download.task_id == task_id,
+                    Download.status != 'cancelled'
+                ).update({'status': 'error', 'error': str(e)}, synchronize_session=False)
+                db.session.commit()
+        finally:
+            cancellation.unregister(task_id)
+
+def find_local_audio(task_id, url, audio_format_id):
+    """Завершенная задача той же ссылки, файл которой содержит аудио формат без изменений
+
+    Returns:
+        tuple: (задача, источник для plan_output) или None
+    """
+    urls = {url}
+    try:
+        urls.add(canonicalize_url(url))
+    except ValueError:
+        pass
+    candidates = Download.query.filter(
+        Download.url.in_(urls),
+        Download.task_id != task_id,
+        Download.status == 'completed',
+        Download.audio_format == audio_format_id,
+        Download.file_path.isnot(None),
+        Download.clip_start.is_(None),
+        Download.clip_end.is_(None)
+    ).order_by(Download.completed_at.desc()).all()
+    for download in candidates:
+        source = local_audio_source(download.postprocess_plan)
+        if source and os.path.exists(download.file_path):
+            return download, source
+    return None
+
+def derive_audio(app, task_id, url, audio_format_id, convert_to_mp3=False, info=None):
+    """Получает звук из уже скачанного файла другой задачи без обращения к источнику
+
+    Файл задачи-источника связывается жесткой ссылкой (или копируется) в каталог
+    задачи, дальше план (копирование, перепаковка или перекодирование) выполняется
+    в пуле постобработки как обычно.
+
+    Returns:
+        bool: Задача передана в пул постобработки
+    """
+    found = find_local_audio(task_id, url, audio_format_id)
+    if not found:
+        return False
+    source_download, source = found
+    # Битрейт исходного звука (ограничивает перекодирование) и длительность (для
+    # прогресса ffmpeg) берутся из плана задачи-источника, без извлечения
+    source_plan = source_download.postprocess_plan or {}
+    duration = source_plan.get('duration')
+    if info:
+        source['abr'] = source['abr'] or (find_raw_format(info, audio_format_id) or {}).get('abr')
+        duration = duration or info.get('duration')
+    plan = {**plan_output([source], audio_only=True, convert_to_mp3=convert_to_mp3),
+            'duration': duration,
+            'derived_from': str(source_download.task_id)}
+
+    task_dir = os.path.join(downloads_dir, task_id)
+    os.makedirs(task_dir, mode=0o755, exist_ok=True)
+    local_path = os.path.join(task_dir, f"source.{source['ext']}")
+    try:
+        os.link(source_download.file_path, local_path)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(source_download.file_path, local_path)
+
+    logger.info(f"Task {task_id}: deriving audio {audio_format_id} from task {source_download.task_id} "
+                f"({plan['action']} -> {plan['container']})")
+    Download.query.filter(
+        Download.task_id == task_id,
+        Download.status != 'cancelled'
+    ).update({
+        'title': source_download.title,
+        'status': 'postprocessing',
+        'postprocess_progress': 0,
+        'postprocess_plan': plan
+    }, synchronize_session=False)
+    db.session.commit()
+    postprocess_pool.submit(task_id, postprocess_download, app, task_id, [local_path], plan, duration)
+    return True
+
+def download_video(task_id, url, video_format_id=None, audio_format_id=None, format_id=None, audio_only=False, convert_to_mp3=False, backend=None, clip_start=None, clip_end=None):
     """Download video with specified format or separate video/audio formats"""
     from app import app  # Импортируем приложение здесь
     
@@ -524,98 +819,129 @@ def download_video(task_id, url, video_format_id=None, audio_format_id=None, for
         else:
             logger.info(f"Download parameters - URL: {url}, Video Format: {video_format_id}, Audio Format: {audio_format_id}")
         
+        token = cancellation.register(task_id)
+        task_dir = os.path.join(downloads_dir, task_id)
+        handed_off = False
         try:
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                info = ydl.extract_info(url, download=False)
-                logger.info(f"Successfully extracted video info: {info.get('title')}")
-                
-                task_dir = os.path.join(downloads_dir, task_id)
-                os.makedirs(task_dir, mode=0o755, exist_ok=True)
-                
-                for f in os.listdir(task_dir):
-                    file_path = os.path.join(task_dir, f)
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                        logger.debug(f"Removed existing file: {file_path}")
-                
-                output_template = os.path.join(task_dir, f"{task_id}.%(ext)s")
-                
-                if audio_only:
-                    format_spec = audio_format_id
-                    postprocessors = [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3' if convert_to_mp3 else None,
-                        'preferredquality': '192' if convert_to_mp3 else None,
-                    }] if convert_to_mp3 else []
-                else:
-                    format_spec = format_id if format_id else f"{video_format_id}+{audio_format_id}"
-                    postprocessors = [{
-                        'key': 'FFmpegVideoRemuxer',
-                        'preferedformat': 'mp4',
-                    }]
-                
-                ydl_opts = {
-                    'format': format_spec,
-                    'progress_hooks': [
-                        lambda d: download_progress_hook({**d, 'task_id': task_id})
-                    ],
-                    'outtmpl': output_template,
-                    'merge_output_format': 'mp4' if not audio_only else None,
-                    'postprocessors': postprocessors,
-                    'writethumbnail': False,
-                    'writesubtitles': False,
-                    'overwrites': True,
-                    'keepvideo': False,
-                    'verbose': True,
-                    'quiet': False,
-                    'no_warnings': False,
-                    'ignoreerrors': False,
-                    'retries': 10,
-                    'fragment_retries': 10,
-                    'concurrent_fragments': 16,
-                    'buffersize': 1024 * 32,
-                    'file_access_retries': 5,
-                    'throttledratelimit': None,
-                    'sleep_interval': 0,
-                    'max_sleep_interval': 0,
-                    'socket_timeout': 60,
-                    'http_chunk_size': 1024 * 1024,
-                    'thread_count': 16,
-                    'external_downloader': 'aria2c',
-                    'external_downloader_args': [
-                        '-j', '16',
-                        '-x', '16',
-                        '-s', '16',
-                        '--min-split-size', '1M',
-                        '--max-connection-per-server', '16',
-                        '--optimize-concurrent-downloads',
-                        '--file-allocation=none',
-                        '--auto-file-renaming=false'
-                    ]
-                }
+            # Звук, который уже есть в файле другой задачи, не качается повторно
+            if audio_only and audio_format_id and not (clip_start or clip_end):
+                if derive_audio(app, task_id, url, audio_format_id, convert_to_mp3):
+                    handed_off = True
+                    return
+
+            info = run_extraction(extract_info, url)
+            logger.info(f"Successfully extracted video info: {info.get('title')}")
+            token.check()
+
+            # Задачи пакетной загрузки хранят качество, форматы выбираются здесь
+            if format_id in VIDEO_QUALITIES + AUDIO_QUALITIES:
+                video_format_id, audio_format_id, format_id, audio_only = resolve_quality(info, format_id)
+                Download.query.filter_by(task_id=task_id).update({
+                    'format': format_id,
+                    'video_format': video_format_id,
+                    'audio_format': audio_format_id,
+                    'audio_only': audio_only
+                }, synchronize_session=False)
+                db.session.commit()
+                convert_to_mp3 = convert_to_mp3 and audio_only
+                if audio_only and not (clip_start or clip_end):
+                    if derive_audio(app, task_id, url, audio_format_id, convert_to_mp3, info):
+                        handed_off = True
+                        return
+            
+            if audio_only:
+                format_spec = audio_format_id or format_id
+            else:
+                format_spec = format_id if format_id else f"{video_format_id}+{audio_format_id}"
+            clip = (clip_start or 0, clip_end) if clip_start or clip_end else None
+            duration = info.get('duration')
+            if clip:
+                clip_to = min(clip[1], duration) if clip[1] is not None and duration else (clip[1] or duration)
+                duration = clip_to - clip[0] if clip_to and clip_to > clip[0] else None
+            
+            # Соединения к источнику выделяет общий для узла регулятор
+            source_formats = [f for f in (find_raw_format(info, fid) for fid in
+                                          (format_id, video_format_id, audio_format_id)) if f]
+            source_host = get_source_host(source_formats, url)
+            # Параметры передачи подбираются по размеру, протоколу и скорости хоста,
+            # число соединений дополнительно ограничено долей регулятора
+            transfer = plan_transfer(source_formats, source_host, info.get('duration'))
+            lease = connection_governor.acquire(task_id, source_host)
+
+            requested_ids = [format_spec] if audio_only or format_id else [video_format_id, audio_format_id]
+            sources = [find_raw_format(info, fid) for fid in requested_ids]
+            missing = [fid for fid, source in zip(requested_ids, sources) if not source]
+            if missing:
+                raise ValueError(f"Requested format is not available: {', '.join(map(str, missing))}")
+            job = DownloadJob(
+                task_id, url, info, format_spec,
+                sources=sources,
+                task_dir=task_dir,
+                audio_only=audio_only,
+                convert_to_mp3=convert_to_mp3,
+                transfer=transfer,
+                lease=lease,
+                progress_hook=lambda d: download_progress_hook({**d, 'task_id': task_id}),
+                cancel_token=token,
+                clip=clip
+            )
+            downloader_backend = select_backend(job, backend)
+            logger.info(f"Task {task_id}: using {downloader_backend.name} backend")
+            plan = {**plan_output(job.sources, audio_only, convert_to_mp3), 'duration': duration}
+            logger.info(f"Task {task_id}: postprocess plan {plan['action']} -> {plan['container']}")
+
+            # Файлы прошлой попытки сохраняются, если источник не изменился;
+            # фрагмент записывается в контрольную точку как отдельный объект
+            if prepare_task_dir(task_dir, url, format_spec + (clip_spec(clip) if clip else ''), job.sources,
+                                downloader_backend.name, info):
+                logger.info(f"Task {task_id}: resuming from files on disk")
+            
+            download = Download.query.filter_by(task_id=task_id).first()
+            if download:
+                Download.query.filter(
+                    Download.task_id == task_id,
+                    Download.status != 'cancelled'
+                ).update({'title': info.get('title'), 'status': 'downloading', 'postprocess_plan': plan},
+                         synchronize_session=False)
+                db.session.commit()
                 
-                logger.debug(f"YouTube-DL options: {ydl_opts}")
+                started = time.monotonic()
+                files = downloader_backend.download(job)
+                token.check()
+                record_throughput(source_host, sum(_transferred_bytes.get(task_id, {}).values()),
+                                  time.monotonic() - started, job.connections)
+
+                # Слот загрузки освобождается сразу, ffmpeg выполняется в отдельном пуле
+                Download.query.filter(
+                    Download.task_id == task_id,
+                    Download.status != 'cancelled'
+                ).update({'status': 'postprocessing', 'postprocess_progress': 0}, synchronize_session=False)
+                db.session.commit()
+                postprocess_pool.submit(task_id, postprocess_download, app, task_id, files,
+                                        plan, duration)
+                handed_off = True
+            else:
+                logger.error(f"Download record not found for task {task_id}")
                 
-                download = Download.query.filter_by(task_id=task_id).first()
-                if download:
-                    download.title = info.get('title')
-                    download.status = 'downloading'
-                    db.session.add(download)
-                    db.session.commit()
-                    
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl_download:
-                        ydl_download.download([url])
-                else:
-                    logger.error(f"Download record not found for task {task_id}")
-                    
         except Exception as e:
-            logger.error(f"Error downloading video: {str(e)}")
-            download = Download.query.filter_by(task_id=task_id).first()
-            if download:
-                download.status = 'error'
-                download.error = str(e)
-                db.session.add(download)
+            if token.cancelled:
+                # Статус cancelled уже записан тем, кто отменил задачу
+                logger.info(f"Task {task_id} cancelled, removing partial files")
+                db.session.rollback()
+                shutil.rmtree(task_dir, ignore_errors=True)
+            else:
+                logger.error(f"Error downloading video: {str(e)}")
+                db.session.rollback()
+                Download.query.filter(
+                    Download.task_id == task_id,
+                    Download.status != 'cancelled'
+                ).update({'status': 'error', 'error': str(e)}, synchronize_session=False)
                 db.session.commit()
+        finally:
+            if not handed_off:
+                cancellation.unregister(task_id)
+            _transferred_bytes.pop(task_id, None)
+            connection_governor.release(task_id)
 
 def cleanup_old_files(app, retention_hours=24):
     """Очистка старых файлов по истечении времени хранения
@@ -680,20 +1006,6 @@ def start_cleanup_thread(app, retention_hours=None):
     )
     cleanup_thread.start()
 
-def start_download_task(task_id, url, video_format_id=None, audio_format_id=None, format_id=None, audio_only=False, convert_to_mp3=False):
-    """Запуск асинхронной задачи на скачивание"""
-    thread = threading.Thread(target=download_video,
-                            args=(task_id, url),
-                            kwargs={
-                                'video_format_id': video_format_id,
-                                'audio_format_id': audio_format_id,
-                                'format_id': format_id,
-                                'audio_only': audio_only,
-                                'convert_to_mp3': convert_to_mp3
-                            })
-    thread.daemon = True
-    thread.start()
-
 def get_available_resolutions(url):
     """Получить список всех доступных разрешений для видео"""
     logger.info(f"Получение доступных разрешений для URL: {url}")
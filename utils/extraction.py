@@ -0,0 +1,204 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from utils.ydl_pool import extraction_ydl_pool
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Извлечение yt-dlp (разбор страниц и JSON, расшифровка подписей) нагружает CPU
+# и держит GIL, а память после него в процессе gunicorn не возвращается. Поэтому
+# оно выполняется в отдельных процессах: у каждого вызова жесткий срок (процесс
+# убивается при превышении), процесс перезапускается после
+# EXTRACTION_MAX_TASKS_PER_CHILD задач, экстракторы загружаются заранее.
+# Результат (sanitize_info) возвращается через pipe (pickle).
+EXTRACTION_ENGINE = os.environ.get('EXTRACTION_ENGINE', 'process')  # process или thread
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', 4))  # процессов на воркер gunicorn
+EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT', 90))
+EXTRACTION_MAX_TASKS_PER_CHILD = int(os.environ.get('EXTRACTION_MAX_TASKS_PER_CHILD', 50))
+# forkserver: процессы создаются из чистого процесса с загруженным yt-dlp, а не
+# копированием многопоточного воркера gunicorn
+EXTRACTION_START_METHOD = os.environ.get('EXTRACTION_START_METHOD', 'forkserver')
+
+STOP_TIMEOUT = 5
+ACQUIRE_POLL_INTERVAL = 0.1
+
+
+class ExtractionError(Exception):
+    """Ошибка извлечения в процессе пула"""
+    pass
+
+
+class ExtractionTimeout(ExtractionError):
+    """Извлечение не уложилось в срок"""
+    pass
+
+
+def extract_info(url, options=None):
+    """Информация yt-dlp о ссылке (sanitize_info: только сериализуемые значения)
+
+    Экземпляр YoutubeDL берется из пула процесса: соединения и кэш плеера
+    сохраняются между вызовами.
+    """
+    with extraction_ydl_pool.lease(options) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+
+def _worker_main(conn):
+    """Цикл процесса пула: (функция, аргументы) -> ('ok', результат) или ('error', тип, сообщение)"""
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # Все экстракторы импортируются один раз при запуске процесса, а не в первом запросе
+    gen_extractor_classes()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        fn, args = message
+        try:
+            conn.send(('ok', fn(*args)))
+        except Exception as e:
+            conn.send(('error', type(e).__name__, str(e)))
+
+
+class _Worker:
+    """Процесс пула и его конец pipe"""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), name='extraction-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, kill=False):
+        if not kill:
+            try:
+                self.conn.send(None)
+            except OSError:
+                kill = True
+        if kill:
+            self.process.kill()
+        self.process.join(STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractionPool:
+    """Пул процессов извлечения с жестким сроком вызова и перезапуском процессов"""
+
+    def __init__(self, size=EXTRACTION_WORKERS, timeout=EXTRACTION_TIMEOUT,
+                 max_tasks_per_child=EXTRACTION_MAX_TASKS_PER_CHILD, start_method=EXTRACTION_START_METHOD):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.start_method = start_method
+        self._ctx = None
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._spawned = 0
+
+    def _context(self):
+        if self._ctx is None:
+            ctx = multiprocessing.get_context(self.start_method)
+            if self.start_method == 'forkserver':
+                ctx.set_forkserver_preload([__name__])
+            self._ctx = ctx
+        return self._ctx
+
+    def _acquire(self, deadline):
+        """Свободный процесс; новый запускается, пока их меньше size"""
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self._lock:
+                spawn = self._spawned < self.size
+                if spawn:
+                    self._spawned += 1
+            if spawn:
+                try:
+                    return _Worker(self._context())
+                except Exception:
+                    with self._lock:
+                        self._spawned -= 1
+                    raise
+
+            # Место может освободиться и без возврата процесса (перезапуск, таймаут)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ExtractionTimeout('No extraction worker became available in time')
+            try:
+                return self._idle.get(timeout=min(remaining, ACQUIRE_POLL_INTERVAL))
+            except queue.Empty:
+                continue
+
+    def _discard(self, worker, kill=False):
+        worker.stop(kill)
+        with self._lock:
+            self._spawned -= 1
+
+    def call(self, fn, *args, timeout=None):
+        """Выполняет fn(*args) в процессе пула
+
+        Args:
+            fn: Функция уровня модуля (передается по имени через pickle)
+            timeout: Срок в секундах, включая ожидание свободного процесса
+
+        Raises:
+            ExtractionTimeout: Срок истек (процесс убит)
+            ExtractionError: Ошибка в fn или процесс завершился аварийно
+        """
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(deadline)
+        try:
+            worker.conn.send((fn, args))
+            if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                logger.warning(f"{fn.__name__}{args[:1]} exceeded {timeout:g}s, "
+                               f"killing extraction worker {worker.process.pid}")
+                self._discard(worker, kill=True)
+                raise ExtractionTimeout(f'Extraction timed out after {timeout:g} s')
+            status, *payload = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # Процесс умер (например, по памяти) или pipe закрыт
+            logger.error(f"Extraction worker {worker.process.pid} died: {e}")
+            self._discard(worker, kill=True)
+            raise ExtractionError(f'Extraction worker died: {e}')
+        except ExtractionTimeout:
+            raise
+        except BaseException:
+            # Состояние pipe неизвестно (например, ответ не удалось разобрать)
+            self._discard(worker, kill=True)
+            raise
+
+        worker.tasks += 1
+        if worker.tasks >= self.max_tasks_per_child:
+            # Память, накопленная процессом, возвращается системе
+            self._discard(worker)
+        else:
+            self._idle.put(worker)
+
+        if status == 'error':
+            raise ExtractionError(payload[1])
+        return payload[0]
+
+
+extraction_pool = ExtractionPool()
+
+
+def run_extraction(fn, *args, timeout=None):
+    """Выполняет функцию извлечения в пуле процессов (или в текущем потоке при EXTRACTION_ENGINE=thread)"""
+    if EXTRACTION_ENGINE == 'thread':
+        return fn(*args)
+    return extraction_pool.call(fn, *args, timeout=timeout)
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Общий бюджет соединений узла делится между хостами-источниками, а бюджет
+# хоста - между активными задачами на этот хост. Состояние хранится в файле
+# под flock, поэтому его видят все воркеры gunicorn на узле.
+ARIA2_MAX_CONNECTIONS = int(os.environ.get('ARIA2_MAX_CONNECTIONS', 64))
+ARIA2_MAX_CONNECTIONS_PER_HOST = int(os.environ.get('ARIA2_MAX_CONNECTIONS_PER_HOST', 16))
+ARIA2_MAX_CONNECTIONS_PER_JOB = int(os.environ.get('ARIA2_MAX_CONNECTIONS_PER_JOB', 16))
+GOVERNOR_STATE_PATH = os.environ.get(
+    'GOVERNOR_STATE_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'videodl-connections.json')
+)
+# Как часто задача перечитывает свою долю, если ее изменили другие процессы
+LEASE_REFRESH_INTERVAL = 2.0
+
+# aria2c не поддерживает больше 16 соединений на сервер
+ARIA2_MAX_PER_SERVER = 16
+
+
+def build_aria2_args(connections, fragmented=False, min_split_size='1M'):
+    """Аргументы aria2c для заданного числа соединений
+
+    Для фрагментированных потоков (DASH/HLS) соединения расходуются на
+    параллельные фрагменты, для обычных файлов - на сегменты одного файла.
+    Файлы меньше двух min_split_size не делятся на сегменты.
+    """
+    connections = max(1, connections)
+    if fragmented:
+        per_file = 1
+        concurrent = connections
+    else:
+        per_file = min(connections, ARIA2_MAX_PER_SERVER)
+        concurrent = 1
+    return [
+        '-j', str(concurrent),
+        '-x', str(per_file),
+        '-s', str(per_file),
+        '--min-split-size', str(min_split_size),
+        '--max-connection-per-server', str(per_file),
+        '--optimize-concurrent-downloads',
+        '--file-allocation=none',
+        '--auto-file-renaming=false'
+    ]
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ConnectionLease:
+    """Доля соединений, выделенная задаче. Пересчитывается при изменении числа задач"""
+
+    def __init__(self, governor, task_id, host, on_change=None):
+        self.governor = governor
+        self.task_id = task_id
+        self.host = host
+        self.on_change = on_change
+        self.connections = 1
+        self._refreshed_at = 0.0
+
+    def _apply(self, connections):
+        if connections == self.connections:
+            return
+        logger.info(f"Task {self.task_id}: connections to {self.host} {self.connections} -> {connections}")
+        self.connections = connections
+        if self.on_change:
+            try:
+                self.on_change(connections)
+            except Exception as e:
+                logger.error(f"Error applying connection share for {self.task_id}: {e}")
+
+    def refresh(self, force=False):
+        """Перечитывает долю из общего состояния (не чаще LEASE_REFRESH_INTERVAL)"""
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < LEASE_REFRESH_INTERVAL:
+            return self.connections
+        self._refreshed_at = now
+        self._apply(self.governor.share_for(self.host))
+        return self.connections
+
+    def release(self):
+        self.governor.release(self.task_id)
+
+
+class ConnectionGovernor:
+    """Распределяет соединения aria2c между активными загрузками узла"""
+
+    def __init__(self, path=GOVERNOR_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._leases = {}
+
+    def _update_state(self, mutate=None):
+        """Читает (и при необходимости меняет) общее состояние под блокировкой"""
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                with os.fdopen(os.dup(fd), 'r+') as f:
+                    try:
+                        state = json.load(f)
+                    except ValueError:
+                        state = {}
+                    alive = {task_id: job for task_id, job in state.items() if _pid_alive(job['pid'])}
+                    changed = len(alive) != len(state)
+                    if mutate:
+                        mutate(alive)
+                        changed = True
+                    if changed:
+                        f.seek(0)
+                        f.truncate()
+                        json.dump(alive, f)
+                    return alive
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    @staticmethod
+    def _host_budgets(state):
+        """Делит бюджет узла между хостами пропорционально числу задач
+
+        Хосты, упирающиеся в свой лимит, получают ровно лимит, а остаток
+        бюджета распределяется между остальными (water-filling).
+        """
+        jobs = {}
+        for job in state.values():
+            jobs[job['host']] = jobs.get(job['host'], 0) + 1
+
+        budgets = {}
+        remaining = ARIA2_MAX_CONNECTIONS
+        pending = dict(jobs)
+        while pending:
+            total = sum(pending.values())
+            capped = {
+                host: min(ARIA2_MAX_CONNECTIONS_PER_HOST, count * ARIA2_MAX_CONNECTIONS_PER_JOB)
+                for host, count in pending.items()
+                if min(ARIA2_MAX_CONNECTIONS_PER_HOST, count * ARIA2_MAX_CONNECTIONS_PER_JOB) <= remaining * count / total
+            }
+            if not capped:
+                for host, count in pending.items():
+                    budgets[host] = remaining * count // total
+                break
+            for host, budget in capped.items():
+                budgets[host] = budget
+                remaining -= budget
+                del pending[host]
+        return budgets, jobs
+
+    @classmethod
+    def _compute_share(cls, state, host):
+        budgets, jobs = cls._host_budgets(state)
+        if host not in jobs:
+            return min(ARIA2_MAX_CONNECTIONS_PER_JOB, ARIA2_MAX_CONNECTIONS_PER_HOST, ARIA2_MAX_CONNECTIONS)
+        return max(1, min(ARIA2_MAX_CONNECTIONS_PER_JOB, budgets[host] // jobs[host]))
+
+    def share_for(self, host):
+        return self._compute_share(self._update_state(), host)
+
+    def acquire(self, task_id, host, on_change=None):
+        """Регистрирует задачу и возвращает ее долю соединений"""
+        def register(state):
+            state[task_id] = {'host': host, 'pid': os.getpid(), 'ts': time.time()}
+
+        state = self._update_state(register)
+        lease = ConnectionLease(self, task_id, host, on_change)
+        lease.connections = self._compute_share(state, host)
+        lease._refreshed_at = time.monotonic()
+        with self._lock:
+            self._leases[task_id] = lease
+        logger.info(f"Task {task_id}: {lease.connections} connections to {host} "
+                    f"({len(state)} active jobs on node)")
+        self._rebalance_local(state)
+        return lease
+
+    def release(self, task_id):
+        """Освобождает соединения задачи и перераспределяет их"""
+        with self._lock:
+            lease = self._leases.pop(task_id, None)
+        if lease is None:
+            return
+        state = self._update_state(lambda s: s.pop(task_id, None))
+        self._rebalance_local(state)
+
+    def get_lease(self, task_id):
+        with self._lock:
+            return self._leases.get(task_id)
+
+    def _rebalance_local(self, state):
+        """Сразу пересчитывает доли задач текущего процесса"""
+        with self._lock:
+            leases = list(self._leases.values())
+        for lease in leases:
+            lease._apply(self._compute_share(state, lease.host))
+
+
+connection_governor = ConnectionGovernor()
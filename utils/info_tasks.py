@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+from uuid import UUID
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from models import InfoTask
+from extensions import db
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Асинхронные запросы метаданных (async=true): извлечение выполняется в фоновом
+# пуле процесса, а воркер gunicorn сразу отвечает 202 с идентификатором задачи.
+# Результат хранится в таблице info_tasks, поэтому опрашивать статус можно через
+# любой воркер и узел.
+INFO_TASK_WORKERS = int(os.environ.get('INFO_TASK_WORKERS', 4))
+INFO_TASK_TTL = int(os.environ.get('INFO_TASK_TTL', 3600))  # сколько секунд хранится результат
+INFO_TASK_TIMEOUT = int(os.environ.get('INFO_TASK_TIMEOUT', 600))  # задача упавшего процесса
+
+PENDING_STATUSES = ('queued', 'running')
+
+_executor = ThreadPoolExecutor(max_workers=INFO_TASK_WORKERS, thread_name_prefix='info-task')
+
+
+def submit_info_task(api_key_id, kind, url, extract, encoder=None):
+    """Создает задачу и запускает извлечение в фоновом пуле
+
+    Args:
+        kind: Тип запроса (info, formats, combined-info)
+        extract: Функция без аргументов, возвращающая результат запроса
+        encoder: JSONEncoder для сохранения результата
+
+    Returns:
+        InfoTask: Созданная задача
+    """
+    app = current_app._get_current_object()
+    task = InfoTask(
+        task_id=UUID(bytes=os.urandom(16)),
+        api_key_id=api_key_id,
+        kind=kind,
+        url=url,
+        status='queued'
+    )
+    db.session.add(task)
+    db.session.commit()
+    _executor.submit(_run, app, str(task.task_id), extract, encoder)
+    logger.info(f"Info task {task.task_id} ({kind}) queued for URL: {url}")
+    return task
+
+
+def _run(app, task_id, extract, encoder):
+    with app.app_context():
+        InfoTask.query.filter_by(task_id=task_id, status='queued').update(
+            {'status': 'running'}, synchronize_session=False)
+        db.session.commit()
+        try:
+            values = {
+                'status': 'completed',
+                'result': json.loads(json.dumps(extract(), ensure_ascii=False, cls=encoder))
+            }
+        except Exception as e:
+            logger.error(f"Info task {task_id} failed: {e}")
+            values = {'status': 'error', 'error': str(e)}
+        values['completed_at'] = datetime.utcnow()
+        InfoTask.query.filter_by(task_id=task_id).update(values, synchronize_session=False)
+        db.session.commit()
+
+
+def info_task_status(task):
+    """Статус задачи для ответа API"""
+    status = {
+        'task_id': str(task.task_id),
+        'kind': task.kind,
+        'url': task.url,
+        'status': task.status,
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'completed_at': task.completed_at.isoformat() if task.completed_at else None
+    }
+    if task.status == 'completed':
+        status['result'] = task.result
+    elif task.status == 'error':
+        status['error'] = task.error
+    return status
+
+
+def purge_info_tasks():
+    """Завершает зависшие задачи (процесс упал) и удаляет устаревшие результаты"""
+    now = datetime.utcnow()
+    InfoTask.query.filter(
+        InfoTask.status.in_(PENDING_STATUSES),
+        InfoTask.created_at < now - timedelta(seconds=INFO_TASK_TIMEOUT)
+    ).update({'status': 'error', 'error': 'Extraction timed out', 'completed_at': now},
+             synchronize_session=False)
+    InfoTask.query.filter(
+        InfoTask.created_at < now - timedelta(seconds=INFO_TASK_TTL)
+    ).delete(synchronize_session=False)
+    db.session.commit()
@@ -0,0 +1,200 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Выбор самого дешевого способа получить итоговый файл из скачанных потоков:
+#   copy      - файл уже в нужном виде, достаточно переименовать (без ffmpeg);
+#   remux     - смена контейнера/склейка без перекодирования (ffmpeg -c copy);
+#   transcode - перекодирование звука (видео никогда не перекодируется).
+MP3_BITRATE = int(os.environ.get('MP3_BITRATE', 192))
+AAC_BITRATE = int(os.environ.get('AAC_BITRATE', 192))
+MP3_BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+CODEC_FAMILIES = (
+    ('avc', 'h264'), ('h264', 'h264'), ('hev', 'hevc'), ('hvc', 'hevc'), ('h265', 'hevc'),
+    ('av01', 'av1'), ('av1', 'av1'), ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp8', 'vp8'),
+    ('mp4a', 'aac'), ('aac', 'aac'), ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3'),
+    ('ac-3', 'ac3'), ('ac3', 'ac3'), ('ec-3', 'eac3'), ('eac3', 'eac3'), ('flac', 'flac'), ('alac', 'alac')
+)
+
+# Кодеки, которые MP4 принимает без перекодирования
+MP4_VIDEO_CODECS = {'h264', 'hevc', 'av1', 'vp9'}
+MP4_AUDIO_CODECS = {'aac', 'mp3', 'opus', 'ac3', 'eac3', 'flac', 'alac'}
+
+# Контейнер для отдельной аудио дорожки в исходном кодеке
+AUDIO_CONTAINERS = {
+    'aac': 'm4a', 'alac': 'm4a', 'flac': 'm4a', 'ac3': 'm4a', 'eac3': 'm4a',
+    'mp3': 'mp3', 'opus': 'webm', 'vorbis': 'webm'
+}
+
+ENCODERS = {'mp3': 'libmp3lame', 'aac': 'aac'}
+
+
+def codec_family(codec):
+    """'avc1.64001F' -> 'h264', 'mp4a.40.2' -> 'aac', 'none' -> None"""
+    codec = (codec or '').lower()
+    if codec in ('', 'none'):
+        return None
+    for prefix, family in CODEC_FAMILIES:
+        if codec.startswith(prefix):
+            return family
+    return codec
+
+
+def capped_bitrate(source_bitrate, target, codec):
+    """Битрейт перекодирования: не выше битрейта источника"""
+    bitrate = min(target, int(source_bitrate)) if source_bitrate else target
+    if codec == 'mp3':
+        bitrate = max([b for b in MP3_BITRATES if b <= bitrate] or [MP3_BITRATES[0]])
+    return max(32, bitrate)
+
+
+def _audio_bitrate(source):
+    return source.get('abr') or (source.get('tbr') if codec_family(source.get('vcodec')) is None else None)
+
+
+def plan_output(sources, audio_only=False, convert_to_mp3=False):
+    """Строит план получения итогового файла
+
+    Args:
+        sources: Скачиваемые форматы (1 или 2: видео и аудио) из raw info
+        audio_only: Нужна только аудио дорожка
+        convert_to_mp3: Итоговый файл должен быть MP3
+
+    Returns:
+        dict: action (copy/remux/transcode), container, streams, reason
+    """
+    audio_source = sources[-1]
+    audio_codec = codec_family(audio_source.get('acodec'))
+    # Битрейт источника сохраняется в плане: по нему ограничивается
+    # перекодирование звука, полученного позже из итогового файла
+    audio_bitrate = _audio_bitrate(audio_source)
+    single_file = len(sources) == 1
+    source_ext = (sources[0].get('ext') or '').lower()
+
+    if audio_only or convert_to_mp3:
+        has_video = codec_family(audio_source.get('vcodec')) is not None
+        if convert_to_mp3:
+            target_codec = 'mp3'
+            container = 'mp3'
+        else:
+            target_codec = audio_codec if audio_codec in AUDIO_CONTAINERS else 'aac'
+            container = AUDIO_CONTAINERS[target_codec]
+
+        if audio_codec == target_codec:
+            stream = {'type': 'audio', 'codec': audio_codec, 'action': 'copy', 'source_bitrate': audio_bitrate}
+            if single_file and not has_video and source_ext == container:
+                action, reason = 'copy', f'source is already {audio_codec} in {container}'
+            else:
+                action, reason = 'remux', f'{audio_codec} stream copied into {container}'
+        else:
+            bitrate_target = MP3_BITRATE if target_codec == 'mp3' else AAC_BITRATE
+            stream = {
+                'type': 'audio',
+                'codec': audio_codec,
+                'action': 'transcode',
+                'source_bitrate': audio_bitrate,
+                'target_codec': target_codec,
+                'bitrate': capped_bitrate(audio_bitrate, bitrate_target, target_codec)
+            }
+            action, reason = 'transcode', f'{audio_codec} can not be stored as {target_codec}'
+        return {
+            'action': action,
+            'container': container,
+            'audio_only': True,
+            'streams': [stream],
+            'reason': reason
+        }
+
+    video_codec = codec_family(sources[0].get('vcodec'))
+    streams = [{'type': 'video', 'codec': video_codec, 'action': 'copy'}]
+
+    if video_codec not in MP4_VIDEO_CODECS:
+        # Перекодирование видео слишком дорого: меняем контейнер на MKV
+        if audio_codec:
+            streams.append({'type': 'audio', 'codec': audio_codec, 'action': 'copy', 'source_bitrate': audio_bitrate})
+        return {
+            'action': 'remux',
+            'container': 'mkv',
+            'audio_only': False,
+            'streams': streams,
+            'reason': f'{video_codec} is not supported by mp4, using mkv'
+        }
+
+    if audio_codec is None or audio_codec in MP4_AUDIO_CODECS:
+        if audio_codec:
+            streams.append({'type': 'audio', 'codec': audio_codec, 'action': 'copy', 'source_bitrate': audio_bitrate})
+        if single_file and source_ext == 'mp4':
+            action, reason = 'copy', 'progressive mp4 source'
+        else:
+            action, reason = 'remux', 'all streams fit mp4'
+    else:
+        streams.append({
+            'type': 'audio',
+            'codec': audio_codec,
+            'action': 'transcode',
+            'source_bitrate': audio_bitrate,
+            'target_codec': 'aac',
+            'bitrate': capped_bitrate(audio_bitrate, AAC_BITRATE, 'aac')
+        })
+        action, reason = 'transcode', f'{audio_codec} audio is not supported by mp4'
+
+    return {
+        'action': action,
+        'container': 'mp4',
+        'audio_only': False,
+        'streams': streams,
+        'reason': reason
+    }
+
+
+def local_audio_source(plan):
+    """Источник для plan_output из итогового файла завершенной задачи
+
+    Подходит только файл, аудио дорожка которого скопирована из источника без
+    изменений: тогда она та же, что и исходный аудио формат, и звук можно
+    получить из файла, не обращаясь к источнику.
+
+    Args:
+        plan: postprocess_plan завершенной задачи
+
+    Returns:
+        dict: acodec, vcodec, ext и abr (битрейт исходного звука) файла или None
+    """
+    streams = (plan or {}).get('streams') or []
+    audio = next((stream for stream in streams if stream['type'] == 'audio'), None)
+    if not audio or audio['action'] != 'copy':
+        return None
+    video = next((stream for stream in streams if stream['type'] == 'video'), None)
+    return {
+        'acodec': audio['codec'],
+        'vcodec': video['codec'] if video else 'none',
+        'ext': plan['container'],
+        'abr': audio.get('source_bitrate')
+    }
+
+
+def build_command(plan, inputs, output):
+    """Команда ffmpeg для плана remux/transcode"""
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-nostdin', '-y']
+    for path in inputs:
+        cmd += ['-i', path]
+
+    if plan['audio_only']:
+        cmd += ['-map', f'{len(inputs) - 1}:a:0', '-vn']
+    elif len(inputs) == 2:
+        cmd += ['-map', '0:v:0', '-map', '1:a:0']
+
+    for stream in plan['streams']:
+        flag = '-c:v' if stream['type'] == 'video' else '-c:a'
+        if stream['action'] == 'copy':
+            cmd += [flag, 'copy']
+        else:
+            cmd += [flag, ENCODERS[stream['target_codec']], '-b:a', f"{stream['bitrate']}k"]
+
+    if plan['container'] in ('mp4', 'm4a'):
+        cmd += ['-movflags', '+faststart']
+    cmd.append(output)
+    return cmd
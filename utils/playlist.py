@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import base64
+import logging
+import threading
+from utils.batch import canonicalize_url, extract_all
+from utils.downloader import get_cached_video_info
+from utils.extraction import run_extraction, extract_info
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Плейлисты и каналы извлекаются плоско (без метаданных каждого видео) и
+# постранично: yt-dlp запрашивает у сайта только страницы с нужными элементами
+PLAYLIST_PAGE_SIZE = int(os.environ.get('PLAYLIST_PAGE_SIZE', 50))
+MAX_PLAYLIST_PAGE_SIZE = 200
+PLAYLIST_CACHE_TTL = int(os.environ.get('PLAYLIST_CACHE_TTL', 600))
+PLAYLIST_CACHE_SIZE = 200
+
+_page_cache = {}
+_page_cache_lock = threading.Lock()
+
+
+class PlaylistError(Exception):
+    """Ссылка не является плейлистом или каналом"""
+    pass
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Смещение из курсора страницы
+
+    Raises:
+        ValueError: Некорректный курсор
+    """
+    if not cursor:
+        return 0
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        offset = int(data['offset'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError(f'Invalid cursor: {cursor}')
+    if offset < 0:
+        raise ValueError(f'Invalid cursor: {cursor}')
+    return offset
+
+
+def _flat_entry(entry, index):
+    """Элемент плейлиста из плоской информации yt-dlp"""
+    url = entry.get('url') or entry.get('webpage_url')
+    try:
+        url = canonicalize_url(url) if url else None
+    except ValueError:
+        pass
+    thumbnails = entry.get('thumbnails') or []
+    return {
+        'index': index,
+        'id': entry.get('id'),
+        'url': url,
+        'title': entry.get('title'),
+        'duration': entry.get('duration'),
+        'uploader': entry.get('uploader') or entry.get('channel'),
+        'thumbnail': entry.get('thumbnail') or (thumbnails[-1].get('url') if thumbnails else None),
+        'type': entry.get('_type', 'url')
+    }
+
+
+def extract_playlist_page(url, offset, limit):
+    """Плоская страница плейлиста: limit элементов начиная с offset"""
+    logger.info(f"Extracting playlist page for URL: {url}, offset={offset}, limit={limit}")
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        # Лишний элемент показывает, есть ли следующая страница
+        'playlist_items': f'{offset + 1}-{offset + limit + 1}'
+    }
+    info = run_extraction(extract_info, url, ydl_opts)
+
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        raise PlaylistError(f'URL is not a playlist or channel: {url}')
+
+    entries = [entry for entry in info.get('entries') or [] if entry]
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'uploader': info.get('uploader') or info.get('channel'),
+        'webpage_url': info.get('webpage_url') or url,
+        'entry_count': info.get('playlist_count'),
+        'offset': offset,
+        'entries': [_flat_entry(entry, offset + i + 1) for i, entry in enumerate(entries[:limit])],
+        'next_cursor': encode_cursor(offset + limit) if len(entries) > limit else None
+    }
+
+
+def get_cached_playlist_page(url, offset=0, limit=PLAYLIST_PAGE_SIZE):
+    """Страница плейлиста из кэша (PLAYLIST_CACHE_TTL секунд)"""
+    key = (url, offset, limit)
+    now = time.time()
+    with _page_cache_lock:
+        entry = _page_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    page = extract_playlist_page(url, offset, limit)
+
+    with _page_cache_lock:
+        if len(_page_cache) >= PLAYLIST_CACHE_SIZE:
+            for stale in [k for k, v in _page_cache.items() if v[0] <= now]:
+                del _page_cache[stale]
+            if len(_page_cache) >= PLAYLIST_CACHE_SIZE:
+                del _page_cache[min(_page_cache, key=lambda k: _page_cache[k][0])]
+        _page_cache[key] = (now + PLAYLIST_CACHE_TTL, page)
+    return page
+
+
+def get_playlist_page(url, cursor=None, limit=PLAYLIST_PAGE_SIZE, full=False):
+    """Страница плейлиста или канала
+
+    Args:
+        url: Ссылка на плейлист или канал
+        cursor: Курсор страницы из next_cursor предыдущего ответа
+        limit: Размер страницы
+        full: Дополнить элементы полной информацией о видео (извлекается
+            параллельно и кэшируется для /info и /download)
+    """
+    # Ссылка плейлиста не канонизируется: watch?v=ID&list=... должна остаться плейлистом
+    url = url.strip()
+    limit = max(1, min(limit, MAX_PLAYLIST_PAGE_SIZE))
+    page = get_cached_playlist_page(url, decode_cursor(cursor), limit)
+    if not full:
+        return page
+
+    entries = [dict(entry) for entry in page['entries']]
+    video_urls = [entry['url'] for entry in entries if entry['url'] and entry['type'] == 'url']
+    results = dict(zip(video_urls, extract_all(video_urls, get_cached_video_info)))
+    for entry in entries:
+        result, error = results.get(entry['url'], (None, None))
+        if result is not None:
+            entry['info'] = result
+        elif error:
+            entry['error'] = error
+    return {**page, 'entries': entries}
@@ -0,0 +1,140 @@
+import os
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Склейка, перепаковка и перекодирование в MP3 загружены CPU, поэтому выполняются
+# отдельным пулом, а не в потоках загрузки. Число одновременных ffmpeg на узле
+# ограничено слотами (файлы под flock), общими для всех воркеров gunicorn.
+CPU_COUNT = os.cpu_count() or 2
+POSTPROCESS_SLOTS = int(os.environ.get('POSTPROCESS_SLOTS', CPU_COUNT))
+POSTPROCESS_NICE = int(os.environ.get('POSTPROCESS_NICE', 10))
+POSTPROCESS_FFMPEG_THREADS = int(os.environ.get('POSTPROCESS_FFMPEG_THREADS', max(1, CPU_COUNT // POSTPROCESS_SLOTS)))
+POSTPROCESS_SLOT_DIR = os.environ.get(
+    'POSTPROCESS_SLOT_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+)
+SLOT_POLL_INTERVAL = 0.2
+PROGRESS_UPDATE_INTERVAL = 1.0
+
+
+class PostprocessError(Exception):
+    """Ошибка ffmpeg при постобработке"""
+    pass
+
+
+class NodeSlot:
+    """Слот постобработки узла: занят, пока процесс держит flock на файле слота"""
+
+    def __init__(self):
+        self.fd = None
+
+    def __enter__(self):
+        while True:
+            for index in range(POSTPROCESS_SLOTS):
+                path = os.path.join(POSTPROCESS_SLOT_DIR, f'videodl-postprocess-{index}.lock')
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                self.fd = fd
+                return self
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+
+def _lower_priority():
+    os.nice(POSTPROCESS_NICE)
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None):
+    """Запускает ffmpeg с пониженным приоритетом и ограничением потоков
+
+    Args:
+        cmd: Команда ffmpeg (последний аргумент - выходной файл)
+        duration: Длительность результата в секундах, для расчета прогресса
+        on_progress: Получает прогресс в процентах (не чаще раза в секунду)
+
+    Returns:
+        float: Процессорное время ffmpeg (user + system) в секундах
+    """
+    cmd = list(cmd)
+    options = ['-progress', 'pipe:1', '-nostats']
+    if POSTPROCESS_FFMPEG_THREADS:
+        options += ['-threads', str(POSTPROCESS_FFMPEG_THREADS)]
+    cmd[-1:-1] = options
+
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        preexec_fn=_lower_priority if POSTPROCESS_NICE else None
+    )
+    # stderr читается отдельно, чтобы ffmpeg не заблокировался на переполненном канале
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    reader.start()
+
+    reported_at = 0.0
+    for line in process.stdout:
+        key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+        if key != 'out_time_us' or not duration or not on_progress or not value.isdigit():
+            continue
+        now = time.monotonic()
+        if now - reported_at >= PROGRESS_UPDATE_INTERVAL:
+            reported_at = now
+            on_progress(min(100.0, int(value) / 1e6 / duration * 100))
+    # wait4 вместо wait: rusage именно этого процесса, а не всех дочерних
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    reader.join()
+    if process.returncode != 0:
+        message = b''.join(stderr).decode('utf-8', errors='replace').strip()
+        raise PostprocessError(f"ffmpeg failed with code {process.returncode}: {message}")
+    if on_progress:
+        on_progress(100.0)
+    return usage.ru_utime + usage.ru_stime
+
+
+class PostprocessPool:
+    """Пул постобработки процесса; каждое задание дополнительно занимает слот узла"""
+
+    def __init__(self, workers=POSTPROCESS_SLOTS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='postprocess')
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def pending(self):
+        """task_id заданий, ожидающих или выполняющих постобработку"""
+        with self._lock:
+            return set(self._pending)
+
+    def submit(self, task_id, fn, *args, **kwargs):
+        def run():
+            try:
+                with NodeSlot():
+                    return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._pending.discard(task_id)
+
+        with self._lock:
+            self._pending.add(task_id)
+        logger.info(f"Task {task_id} queued for postprocessing")
+        return self.executor.submit(run)
+
+
+postprocess_pool = PostprocessPool()
@@ -0,0 +1,172 @@
+import os
+import shutil
+import logging
+from uuid import UUID
+from datetime import datetime, timedelta
+from collections import Counter
+from models import Download, ApiKey
+from extensions import db
+from utils.batch import canonicalize_url
+from utils.downloader import downloads_dir, AUDIO_QUALITIES
+from utils.scheduler import download_scheduler, is_quota_exceeded, PRIORITY_CLASSES
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Спекулятивная загрузка: после /combined-info ключа с включенным
+# speculative_prefetch заранее ставится в очередь самое вероятное качество (по
+# истории выбора ключа). Задача идет с низким приоритетом и только при простое
+# узла; /download с тем же качеством получает ее вместо новой, а неиспользованная
+# задача отменяется через PREFETCH_WINDOW секунд или при запросе другого качества.
+PREFETCH_WINDOW = int(os.environ.get('PREFETCH_WINDOW', 120))
+PREFETCH_HISTORY = int(os.environ.get('PREFETCH_HISTORY', 50))  # последних выборов ключа
+PREFETCH_MIN_SAMPLES = int(os.environ.get('PREFETCH_MIN_SAMPLES', 5))
+PREFETCH_MIN_SHARE = float(os.environ.get('PREFETCH_MIN_SHARE', 0.6))
+
+DISCARDED_STATUSES = ('error', 'cancelled')
+
+
+def _same_video(url, canonical):
+    """Ссылка задачи ведет на то же видео: задачи хранят ссылку клиента, поэтому
+    сравнивается ее каноническая форма"""
+    try:
+        return canonicalize_url(url) == canonical
+    except ValueError:
+        return url == canonical
+
+
+def predict_choice(api_key_id):
+    """Самый частый выбор ключа среди последних загрузок по качеству
+
+    Returns:
+        tuple: (качество, convert_to_mp3) или None, если выбор не устойчив
+    """
+    recent = db.session.query(Download.quality, Download.convert_to_mp3).filter(
+        Download.api_key_id == api_key_id,
+        Download.quality.isnot(None),
+        Download.speculative.isnot(True)
+    ).order_by(Download.created_at.desc()).limit(PREFETCH_HISTORY).all()
+    if len(recent) < PREFETCH_MIN_SAMPLES:
+        return None
+
+    (choice, count), = Counter((quality, bool(convert_to_mp3)) for quality, convert_to_mp3 in recent).most_common(1)
+    if count / len(recent) < PREFETCH_MIN_SHARE:
+        return None
+    return choice
+
+
+def schedule_prefetch(api_key_id, url):
+    """Ставит в очередь спекулятивную загрузку вероятного качества
+
+    Returns:
+        Download: Созданная задача или None
+    """
+    choice = predict_choice(api_key_id)
+    if not choice:
+        return None
+    quality, convert_to_mp3 = choice
+    canonical = canonicalize_url(url)
+
+    # Ссылка уже скачивается (или недавно скачивалась) этим ключом
+    recent = db.session.query(Download.url).filter(
+        Download.api_key_id == api_key_id,
+        Download.status.notin_(DISCARDED_STATUSES),
+        Download.created_at >= datetime.utcnow() - timedelta(seconds=PREFETCH_WINDOW)
+    ).all()
+    if any(_same_video(recent_url, canonical) for recent_url, in recent):
+        return None
+    if not download_scheduler.has_idle_capacity():
+        return None
+    if is_quota_exceeded(db.session.get(ApiKey, api_key_id)):
+        return None
+
+    download = Download(
+        task_id=UUID(bytes=os.urandom(16)),
+        url=url,
+        format=quality,
+        quality=quality,
+        status='queued',
+        api_key_id=api_key_id,
+        priority=PRIORITY_CLASSES['low'],
+        audio_only=quality in AUDIO_QUALITIES,
+        convert_to_mp3=convert_to_mp3,
+        speculative=True
+    )
+    db.session.add(download)
+    db.session.commit()
+    download_scheduler.notify()
+    logger.info(f"Speculative prefetch {download.task_id} for key {api_key_id}: {url} at {quality}")
+    return download
+
+
+def discard_prefetched(jobs, reason):
+    """Отменяет спекулятивные задачи и удаляет их файлы
+
+    Выполняющиеся задачи прерывают диспетчеры, у которых они запущены.
+    """
+    for job in jobs:
+        discarded = Download.query.filter(
+            Download.id == job.id,
+            Download.speculative.is_(True),
+            Download.status.notin_(DISCARDED_STATUSES)
+        ).update({'status': 'cancelled', 'error': reason, 'file_path': None}, synchronize_session=False)
+        db.session.commit()
+        if discarded:
+            if job.status in ('queued', 'completed'):
+                shutil.rmtree(os.path.join(downloads_dir, str(job.task_id)), ignore_errors=True)
+            logger.info(f"Speculative prefetch {job.task_id} discarded: {reason}")
+    download_scheduler.notify()
+
+
+def claim_prefetched(api_key_id, url, quality, convert_to_mp3, priority):
+    """Спекулятивная задача ключа для запроса /download
+
+    Совпадающая по качеству задача (в очереди, в работе или готовая) передается
+    клиенту; остальные спекулятивные задачи этой ссылки - неверная догадка и отменяются.
+
+    Args:
+        quality: Запрошенное качество или None, если запрос не по качеству
+
+    Returns:
+        Download: Задача клиента или None
+    """
+    try:
+        canonical = canonicalize_url(url)
+    except ValueError:
+        return None
+    candidates = [job for job in Download.query.filter(
+        Download.api_key_id == api_key_id,
+        Download.speculative.is_(True),
+        Download.status.notin_(DISCARDED_STATUSES)
+    ).all() if _same_video(job.url, canonical)]
+    if not candidates:
+        return None
+
+    for job in candidates:
+        if quality and job.quality == quality and bool(job.convert_to_mp3) == convert_to_mp3:
+            claimed = Download.query.filter(
+                Download.id == job.id,
+                Download.speculative.is_(True),
+                Download.status.notin_(DISCARDED_STATUSES)
+            ).update({'speculative': False, 'priority': PRIORITY_CLASSES[priority]}, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                db.session.refresh(job)
+                candidates.remove(job)
+                discard_prefetched(candidates, 'Speculative prefetch not used')
+                logger.info(f"Speculative prefetch {job.task_id} claimed ({job.status})")
+                return job
+
+    discard_prefetched(candidates, 'Speculative prefetch not used')
+    return None
+
+
+def expire_prefetched():
+    """Отменяет спекулятивные задачи, не востребованные за PREFETCH_WINDOW секунд"""
+    expired = Download.query.filter(
+        Download.speculative.is_(True),
+        Download.status.notin_(DISCARDED_STATUSES),
+        Download.created_at < datetime.utcnow() - timedelta(seconds=PREFETCH_WINDOW)
+    ).all()
+    if expired:
+        discard_prefetched(expired, 'Speculative prefetch expired')
@@ -0,0 +1,365 @@
+import os
+import ssl
+import json
+import time
+import asyncio
+import logging
+from urllib.parse import urlparse, urljoin
+from utils.cancellation import DownloadCancelled
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Встроенный загрузчик: файл делится на диапазоны, которые параллельно качают
+# несколько keep-alive соединений HTTP/1.1. Файл создается заранее нужного
+# размера, каждый диапазон пишется на свое место через os.pwrite. Готовые
+# диапазоны записываются в карту <файл>.ranges, по ней загрузка продолжается
+# после перезапуска.
+RANGE_MIN_CHUNK_SIZE = 1024 * 1024
+RANGE_READ_SIZE = 256 * 1024
+RANGE_RETRIES = 3
+RANGE_CONNECT_TIMEOUT = 30
+RANGE_READ_TIMEOUT = 60
+RANGE_MAX_REDIRECTS = 5
+PROGRESS_INTERVAL = 0.5
+
+
+class RangeDownloadError(Exception):
+    """Ошибка встроенного загрузчика диапазонами"""
+    pass
+
+
+def parse_size(value):
+    """'20M' / '512K' / 1048576 -> байты"""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().upper()
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def _parse_total(value):
+    """Размер файла из Content-Range ('bytes 0-0/1234') или Content-Length; None, если неизвестен"""
+    try:
+        total = int((value or '').rpartition('/')[2])
+    except ValueError:
+        return None
+    return total if total > 0 else None
+
+
+class _Connection:
+    """Одно keep-alive соединение HTTP/1.1 к источнику"""
+
+    def __init__(self, url, headers):
+        self.headers = headers
+        self.reader = None
+        self.writer = None
+        self.set_url(url)
+
+    def set_url(self, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            raise RangeDownloadError(f"Unsupported URL scheme: {parsed.scheme}")
+        self.url = url
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += f'?{parsed.query}'
+        self.host_header = parsed.netloc.rsplit('@', 1)[-1]
+
+    async def open(self):
+        if self.writer is not None:
+            return
+        ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context),
+            RANGE_CONNECT_TIMEOUT
+        )
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, start=None, end=None):
+        """Отправляет GET и возвращает (код ответа, заголовки)"""
+        await self.open()
+        lines = [
+            f'GET {self.path} HTTP/1.1',
+            f'Host: {self.host_header}',
+            'Connection: keep-alive',
+            'Accept-Encoding: identity'
+        ]
+        lines += [f'{key}: {value}' for key, value in self.headers.items()
+                  if key.lower() not in ('host', 'connection', 'accept-encoding', 'range')]
+        if start is not None:
+            lines.append(f"Range: bytes={start}-{'' if end is None else end}")
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await self.writer.drain()
+
+        status_line = await asyncio.wait_for(self.reader.readline(), RANGE_READ_TIMEOUT)
+        if not status_line:
+            raise ConnectionError('Connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), RANGE_READ_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        return status, headers
+
+    async def read_body(self, headers, sink):
+        """Читает тело ответа, передавая куски в sink(data)"""
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size_line = await asyncio.wait_for(self.reader.readline(), RANGE_READ_TIMEOUT)
+                size = int(size_line.split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                await self._read_exact(size, sink)
+                await self.reader.readline()
+        elif 'content-length' in headers:
+            await self._read_exact(int(headers['content-length']), sink)
+        else:
+            # Без длины тело заканчивается закрытием соединения
+            while True:
+                data = await asyncio.wait_for(self.reader.read(RANGE_READ_SIZE), RANGE_READ_TIMEOUT)
+                if not data:
+                    break
+                sink(data)
+            self.close()
+            return
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+
+    async def _read_exact(self, length, sink):
+        remaining = length
+        while remaining > 0:
+            data = await asyncio.wait_for(
+                self.reader.read(min(RANGE_READ_SIZE, remaining)), RANGE_READ_TIMEOUT
+            )
+            if not data:
+                raise ConnectionError('Connection closed before end of body')
+            remaining -= len(data)
+            sink(data)
+
+    async def discard_body(self, headers):
+        await self.read_body(headers, lambda data: None)
+
+
+class RangeDownload:
+    """Загрузка одного файла параллельными диапазонами"""
+
+    def __init__(self, url, path, headers=None, connections=8, chunk_size=RANGE_MIN_CHUNK_SIZE,
+                 progress_hook=None, max_connections=None):
+        self.url = url
+        self.path = path
+        self.headers = dict(headers or {})
+        self.max_connections = max(1, max_connections or connections)
+        self.connections = min(max(1, connections), self.max_connections)
+        self.chunk_size = max(RANGE_MIN_CHUNK_SIZE, chunk_size)
+        self.progress_hook = progress_hook
+        self.total = None
+        self.downloaded = 0
+        self.started = None
+        self._chunk = None
+        self._done = set()
+        self.cancelled = False
+
+    def set_connections(self, connections):
+        """Меняет число активных соединений (лишние доделывают текущий диапазон и ждут)"""
+        self.connections = min(max(1, connections), self.max_connections)
+
+    async def _probe(self):
+        """Определяет итоговый URL, размер файла и поддержку Range
+
+        Returns:
+            tuple: (соединение, размер или None, поддержка Range, заголовки
+                ответа); без Range тело ответа 200 еще не прочитано
+        """
+        conn = _Connection(self.url, self.headers)
+        for _ in range(RANGE_MAX_REDIRECTS + 1):
+            status, headers = await conn.request(0, 0)
+            if status in (301, 302, 303, 307, 308) and 'location' in headers:
+                await conn.discard_body(headers)
+                location = urljoin(conn.url, headers['location'])
+                conn.close()
+                conn.set_url(location)
+                continue
+            if status == 206:
+                # Размер неизвестен (bytes 0-0/* или нет Content-Range): файл
+                # качается одним запросом без диапазонов
+                total = _parse_total(headers.get('content-range'))
+                await conn.discard_body(headers)
+                return conn, total, True, headers
+            if status == 200:
+                # Range не поддерживается: тело ответа - весь файл
+                total = _parse_total(headers.get('content-length'))
+                return conn, total, False, headers
+            conn.close()
+            raise RangeDownloadError(f"HTTP {status} for {conn.url[:100]}")
+        conn.close()
+        raise RangeDownloadError('Too many redirects')
+
+    def cancel(self):
+        """Прерывает загрузку: соединения бросают работу на следующем куске данных"""
+        self.cancelled = True
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise DownloadCancelled(f"Download of {self.path} was cancelled")
+
+    @property
+    def map_path(self):
+        return f"{self.path}.ranges"
+
+    def _load_range_map(self):
+        """Карта готовых диапазонов, если она относится к тому же файлу"""
+        try:
+            with open(self.map_path) as f:
+                range_map = json.load(f)
+            if range_map.get('total') != self.total or os.path.getsize(self.path) != self.total:
+                return None
+            return range_map
+        except (OSError, ValueError):
+            return None
+
+    def _save_range_map(self):
+        tmp_path = f"{self.map_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'total': self.total, 'chunk': self._chunk, 'done': sorted(self._done)}, f)
+        os.replace(tmp_path, self.map_path)
+
+    def _report(self, status='downloading'):
+        if not self.progress_hook:
+            return
+        elapsed = max(1e-6, time.monotonic() - self.started)
+        self.progress_hook({
+            'status': status,
+            'filename': self.path,
+            'downloaded_bytes': self.downloaded,
+            'total_bytes': self.total,
+            'speed': self.downloaded / elapsed
+        })
+
+    async def _progress_loop(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            self._report()
+
+    async def _fetch_range(self, conn, fd, start, end):
+        """Качает диапазон [start, end] с повторами, продолжая с места обрыва"""
+        position = start
+
+        def sink(data):
+            nonlocal position
+            self._check_cancelled()
+            os.pwrite(fd, data, position)
+            position += len(data)
+            self.downloaded += len(data)
+
+        for attempt in range(RANGE_RETRIES + 1):
+            try:
+                status, headers = await conn.request(position, end)
+                if status != 206:
+                    await conn.discard_body(headers)
+                    raise RangeDownloadError(f"Expected 206 for range, got HTTP {status}")
+                await conn.read_body(headers, sink)
+                if position <= end:
+                    raise ConnectionError(f"Short range: {position}/{end + 1}")
+                return
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                conn.close()
+                if attempt == RANGE_RETRIES:
+                    raise RangeDownloadError(f"Range {start}-{end} failed: {e}")
+                logger.warning(f"Retrying range {position}-{end} after error: {e}")
+                await asyncio.sleep(0.5 * (attempt + 1))
+
+    async def _worker(self, index, conn, fd, ranges):
+        try:
+            while ranges:
+                self._check_cancelled()
+                if index >= self.connections:
+                    # Доля соединений уменьшилась - соединение простаивает
+                    conn.close()
+                    await asyncio.sleep(0.2)
+                    continue
+                start, end = ranges.pop(0)
+                await self._fetch_range(conn, fd, start, end)
+                self._done.add(start)
+                self._save_range_map()
+        finally:
+            conn.close()
+
+    async def run(self):
+        self.started = time.monotonic()
+        probe, self.total, ranged, probe_headers = await self._probe()
+        range_map = self._load_range_map() if ranged and self.total else None
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        if range_map is None:
+            os.ftruncate(fd, 0)
+        progress = asyncio.ensure_future(self._progress_loop())
+        try:
+            if not ranged or not self.total:
+                # Сервер не поддерживает Range: одно соединение, тело уже идет
+                position = 0
+
+                def sink(data):
+                    nonlocal position
+                    self._check_cancelled()
+                    os.pwrite(fd, data, position)
+                    position += len(data)
+                    self.downloaded += len(data)
+
+                if ranged:
+                    status, probe_headers = await probe.request()
+                    if status != 200:
+                        raise RangeDownloadError(f"HTTP {status} for {probe.url[:100]}")
+                await probe.read_body(probe_headers, sink)
+                probe.close()
+            else:
+                if range_map:
+                    self._chunk = range_map['chunk']
+                    self._done = set(range_map['done'])
+                else:
+                    os.ftruncate(fd, self.total)
+                    self._chunk = max(self.chunk_size, -(-self.total // (self.connections * 64)))
+                chunk = self._chunk
+                ranges = [(start, min(start + chunk, self.total) - 1)
+                          for start in range(0, self.total, chunk) if start not in self._done]
+                self.downloaded = sum(min(chunk, self.total - start) for start in self._done)
+                if self._done:
+                    logger.info(f"Resuming {self.path}: {self.downloaded}/{self.total} bytes on disk")
+                url = probe.url
+                # Соединения открываются при первом запросе, поэтому запасные
+                # (сверх текущей доли) ничего не стоят, пока доля не вырастет
+                workers = [probe] + [_Connection(url, self.headers) for _ in range(1, self.max_connections)]
+                await asyncio.gather(*(self._worker(i, conn, fd, ranges) for i, conn in enumerate(workers)))
+        finally:
+            progress.cancel()
+            os.close(fd)
+        if self.total and self.downloaded < self.total:
+            raise RangeDownloadError(f"Incomplete download: {self.downloaded}/{self.total}")
+        if os.path.exists(self.map_path):
+            os.remove(self.map_path)
+        self._report()
+        return self.path
+
+
+def download_ranges(url, path, headers=None, connections=8, chunk_size=RANGE_MIN_CHUNK_SIZE,
+                    progress_hook=None, max_connections=None, on_created=None):
+    """Синхронная обертка: скачивает файл в path в собственном цикле событий
+
+    on_created получает объект RangeDownload (например, чтобы менять число соединений).
+    """
+    download = RangeDownload(url, path, headers, connections, chunk_size, progress_hook, max_connections)
+    if on_created:
+        on_created(download)
+    return asyncio.run(download.run())
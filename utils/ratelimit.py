@@ -0,0 +1,210 @@
+import os
+import math
+import mmap
+import time
+import fcntl
+import struct
+import logging
+import tempfile
+import threading
+from collections import namedtuple
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Бэкенд хранения корзин:
+#   shm      - общая память (mmap файл) для всех воркеров gunicorn на узле
+#   local    - память текущего процесса (для разработки с одним воркером)
+#   postgres - таблица rate_limit_buckets, общая для нескольких узлов
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'shm')
+RATE_LIMIT_SLOTS = int(os.environ.get('RATE_LIMIT_SLOTS', 4096))
+RATE_LIMIT_SHM_PATH = os.environ.get(
+    'RATE_LIMIT_SHM_PATH',
+    os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'videodl-ratelimit')
+)
+
+# Стоимость запросов в токенах (ApiKey.rate_limit - токенов в минуту)
+DEFAULT_COST = 1
+EXTRACTION_COST = int(os.environ.get('RATE_LIMIT_EXTRACTION_COST', 2))
+DOWNLOAD_COST = int(os.environ.get('RATE_LIMIT_DOWNLOAD_COST', 5))
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'reset_after', 'retry_after'])
+
+
+def rate_limit_cost(cost):
+    """Задает стоимость эндпоинта в токенах (используется в require_api_key)
+
+    cost может быть функцией без аргументов, вычисляющей стоимость по запросу.
+    """
+    def decorator(f):
+        f.rate_limit_cost = cost
+        return f
+    return decorator
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _result(allowed, tokens, capacity, rate, cost, limit):
+    remaining = max(0, int(tokens))
+    reset_after = math.ceil((capacity - tokens) / rate) if tokens < capacity else 0
+    retry_after = 0 if allowed else max(1, math.ceil((cost - tokens) / rate))
+    return RateLimitResult(allowed, limit, remaining, reset_after, retry_after)
+
+
+class LocalRateLimiter:
+    """Корзины в памяти текущего процесса"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key_id, limit, cost=DEFAULT_COST):
+        capacity = float(limit)
+        rate = capacity / 60.0
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key_id, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key_id] = (tokens, now)
+        return _result(allowed, tokens, capacity, rate, cost, limit)
+
+
+class SharedMemoryRateLimiter:
+    """Корзины в mmap файле, общие для всех процессов узла
+
+    Таблица с открытой адресацией: слот хранит id ключа, остаток токенов и
+    время последнего обновления. Доступ защищен flock (между процессами)
+    и обычной блокировкой (между потоками одного процесса).
+    """
+
+    SLOT = struct.Struct('<qdd')
+    PROBES = 16
+
+    def __init__(self, path=RATE_LIMIT_SHM_PATH, slots=RATE_LIMIT_SLOTS):
+        self.slots = slots
+        self.size = self.SLOT.size * slots
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.size)
+        logger.info(f"Shared memory rate limiter: {path} ({slots} slots)")
+
+    def _find_slot(self, key_id, now):
+        """Находит слот ключа или свободный/самый старый слот для него"""
+        start = hash(key_id) % self.slots
+        victim = None
+        victim_updated = None
+        for probe in range(self.PROBES):
+            index = (start + probe) % self.slots
+            slot_key, tokens, updated = self.SLOT.unpack_from(self._map, index * self.SLOT.size)
+            if slot_key == key_id:
+                return index, tokens, updated
+            if slot_key == 0:
+                return index, None, None
+            if victim is None or updated < victim_updated:
+                victim, victim_updated = index, updated
+        return victim, None, None
+
+    def hit(self, key_id, limit, cost=DEFAULT_COST):
+        capacity = float(limit)
+        rate = capacity / 60.0
+        now = time.time()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                index, tokens, updated = self._find_slot(key_id, now)
+                if tokens is None:
+                    tokens = capacity
+                else:
+                    tokens = _refill(tokens, updated, now, capacity, rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                self.SLOT.pack_into(self._map, index * self.SLOT.size, key_id, tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return _result(allowed, tokens, capacity, rate, cost, limit)
+
+
+class PostgresRateLimiter:
+    """Корзины в таблице rate_limit_buckets, обновляемые одним атомарным UPSERT"""
+
+    QUERY = text("""
+        INSERT INTO rate_limit_buckets (key_id, tokens, updated_at, allowed)
+        VALUES (:key_id, :capacity - :cost, :now, :capacity >= :cost)
+        ON CONFLICT (key_id) DO UPDATE SET
+            allowed = LEAST(:capacity, rate_limit_buckets.tokens
+                + GREATEST(0, :now - rate_limit_buckets.updated_at) * :rate) >= :cost,
+            tokens = LEAST(:capacity, rate_limit_buckets.tokens
+                + GREATEST(0, :now - rate_limit_buckets.updated_at) * :rate)
+                - CASE WHEN LEAST(:capacity, rate_limit_buckets.tokens
+                    + GREATEST(0, :now - rate_limit_buckets.updated_at) * :rate) >= :cost
+                  THEN :cost ELSE 0 END,
+            updated_at = :now
+        RETURNING tokens, allowed
+    """)
+
+    def hit(self, key_id, limit, cost=DEFAULT_COST):
+        from extensions import db
+
+        capacity = float(limit)
+        rate = capacity / 60.0
+        # Отдельное соединение со своей транзакцией: сессия запроса (и ее
+        # незавершенные изменения) не фиксируется до вызова обработчика
+        with db.engine.begin() as connection:
+            row = connection.execute(self.QUERY, {
+                'key_id': key_id,
+                'capacity': capacity,
+                'cost': float(cost),
+                'rate': rate,
+                'now': time.time()
+            }).one()
+        tokens, allowed = row
+        if not allowed:
+            tokens = max(0.0, tokens)
+        return _result(bool(allowed), tokens, capacity, rate, cost, limit)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Возвращает лимитер согласно RATE_LIMIT_BACKEND (создается один раз на процесс)"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if RATE_LIMIT_BACKEND == 'postgres':
+                    _limiter = PostgresRateLimiter()
+                elif RATE_LIMIT_BACKEND == 'local':
+                    _limiter = LocalRateLimiter()
+                else:
+                    try:
+                        _limiter = SharedMemoryRateLimiter()
+                    except OSError as e:
+                        logger.error(f"Shared memory rate limiter unavailable, using local: {e}")
+                        _limiter = LocalRateLimiter()
+    return _limiter
+
+
+def rate_limit_headers(result):
+    """Заголовки X-RateLimit-* для ответа"""
+    headers = {
+        'X-RateLimit-Limit': str(result.limit),
+        'X-RateLimit-Remaining': str(result.remaining),
+        'X-RateLimit-Reset': str(result.reset_after)
+    }
+    if not result.allowed:
+        headers['Retry-After'] = str(result.retry_after)
+    return headers
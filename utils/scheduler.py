@@ -0,0 +1,404 @@
+import os
+import socket
+import logging
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import Download, ApiKey
+from extensions import db
+from utils.cancellation import cancel_local
+from utils.postprocess import postprocess_pool
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Задачи выбираются из таблицы downloads (status='queued'), поэтому очередь
+# общая для всех воркеров gunicorn и узлов. Каждый процесс запускает свой
+# диспетчер, который забирает задачи атомарным UPDATE.
+DOWNLOAD_SLOTS = int(os.environ.get('DOWNLOAD_SLOTS', 4))  # потоков загрузки на процесс
+MAX_ACTIVE_DOWNLOADS = int(os.environ.get('MAX_ACTIVE_DOWNLOADS', 8))  # активных загрузок на узел
+DEFAULT_MAX_CONCURRENT_PER_KEY = int(os.environ.get('DEFAULT_MAX_CONCURRENT_PER_KEY', 2))
+DEFAULT_DAILY_BYTE_QUOTA = int(os.environ.get('DEFAULT_DAILY_BYTE_QUOTA', 0))  # 0 - без ограничений
+SCHEDULER_INTERVAL = float(os.environ.get('SCHEDULER_INTERVAL', 0.5))
+SCHEDULER_SCAN_LIMIT = 500
+# Диспетчер обновляет updated_at своих задач; задача без обновлений дольше
+# STALE_JOB_TIMEOUT считается брошенной (воркер упал) и возвращается в очередь
+HEARTBEAT_INTERVAL = float(os.environ.get('HEARTBEAT_INTERVAL', 15))
+STALE_JOB_TIMEOUT = int(os.environ.get('STALE_JOB_TIMEOUT', 120))
+# Спекулятивные загрузки (utils/prefetch.py) запускаются, только пока на узле
+# активно меньше этой доли MAX_ACTIVE_DOWNLOADS и нет обычных задач в очереди
+PREFETCH_MAX_NODE_LOAD = float(os.environ.get('PREFETCH_MAX_NODE_LOAD', 0.5))
+PREFETCH_NODE_CAPACITY = int(MAX_ACTIVE_DOWNLOADS * PREFETCH_MAX_NODE_LOAD)
+
+PRIORITY_CLASSES = {'high': 0, 'normal': 1, 'low': 2}
+PRIORITY_NAMES = {value: name for name, value in PRIORITY_CLASSES.items()}
+DEFAULT_PRIORITY = PRIORITY_CLASSES['normal']
+
+ACTIVE_STATUSES = ('starting', 'downloading', 'processing')
+# Постобработка идет в отдельном пуле (utils/postprocess.py) и не занимает слот загрузки
+POSTPROCESS_STATUSES = ('postprocessing',)
+CANCELLABLE_STATUSES = ('queued',) + ACTIVE_STATUSES + POSTPROCESS_STATUSES
+
+NODE_ID = socket.gethostname()
+WORKER_ID = f"{NODE_ID}:{os.getpid()}"
+
+
+def _worker_alive(worker_id):
+    """Жив ли процесс worker_id (проверяется только для процессов текущего узла)"""
+    node, _, pid = (worker_id or '').rpartition(':')
+    if node != NODE_ID or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def key_limits(api_key):
+    """Лимиты ключа с учетом значений по умолчанию"""
+    if api_key is None:
+        return DEFAULT_MAX_CONCURRENT_PER_KEY, 1, DEFAULT_DAILY_BYTE_QUOTA
+    max_concurrent = api_key.max_concurrent_downloads or DEFAULT_MAX_CONCURRENT_PER_KEY
+    weight = max(1, api_key.scheduling_weight or 1)
+    quota = api_key.daily_byte_quota if api_key.daily_byte_quota is not None else DEFAULT_DAILY_BYTE_QUOTA
+    return max_concurrent, weight, quota
+
+
+def bytes_used_today(api_key_id):
+    """Сколько байт скачано задачами ключа с начала текущих суток (UTC)"""
+    day_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # Невостребованные спекулятивные загрузки ключу не засчитываются
+    used = db.session.query(func.coalesce(func.sum(Download.downloaded_bytes), 0)).filter(
+        Download.api_key_id == api_key_id,
+        Download.created_at >= day_start,
+        Download.speculative.isnot(True)
+    ).scalar()
+    return int(used or 0)
+
+
+def is_quota_exceeded(api_key):
+    """Проверка дневной квоты трафика ключа"""
+    if api_key is None:
+        return False
+    _, _, quota = key_limits(api_key)
+    return bool(quota) and bytes_used_today(api_key.id) >= quota
+
+
+def get_queue_position(download):
+    """Положение задачи в очереди ее ключа"""
+    same_key = Download.api_key_id == download.api_key_id
+    priority = download.priority if download.priority is not None else DEFAULT_PRIORITY
+    ahead = Download.query.filter(
+        same_key,
+        Download.status == 'queued',
+        db.or_(
+            Download.priority < priority,
+            db.and_(Download.priority == priority, Download.created_at < download.created_at)
+        )
+    ).count()
+    queued = Download.query.filter(same_key, Download.status == 'queued').count()
+    active = Download.query.filter(same_key, Download.status.in_(ACTIVE_STATUSES)).count()
+    return {
+        'position': ahead + 1,
+        'tenant_queued': queued,
+        'tenant_active': active
+    }
+
+
+class DownloadScheduler:
+    """Диспетчер очереди загрузок с честным распределением между ключами
+
+    Порядок выбора задачи:
+      1. класс приоритета (high, normal, low) - строго;
+      2. среди ключей, не исчерпавших max_concurrent_downloads, - ключ с
+         наименьшим числом активных задач на единицу веса (scheduling_weight);
+      3. при равенстве - ключ с наименьшим виртуальным временем (взвешенная
+         справедливая очередь: каждый запуск сдвигает время ключа на 1/weight);
+      4. внутри ключа - FIFO.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._vtime = {}
+        self._global_vtime = 0.0
+        self._thread = None
+        self._last_heartbeat = 0.0
+
+    def notify(self):
+        """Разбудить диспетчер (новая задача или освободился слот)"""
+        self._wakeup.set()
+
+    def start(self, app):
+        if self._thread is not None:
+            return
+        self.app = app
+        logger.info(f"Starting download scheduler {WORKER_ID}: {DOWNLOAD_SLOTS} slots, "
+                    f"node limit {MAX_ACTIVE_DOWNLOADS}")
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(SCHEDULER_INTERVAL)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self._check_cancelled()
+                    if time.monotonic() - self._last_heartbeat >= HEARTBEAT_INTERVAL:
+                        self._last_heartbeat = time.monotonic()
+                        self._heartbeat()
+                        self._requeue_stale()
+                        self._finalize_bulk_jobs()
+                        self._expire_prefetched()
+                        self._purge_info_tasks()
+                    while self._dispatch_once():
+                        pass
+            except Exception as e:
+                logger.error(f"Error in download scheduler: {e}", exc_info=True)
+
+    def free_slots(self):
+        with self._lock:
+            return DOWNLOAD_SLOTS - len(self.running)
+
+    def _local_task_ids(self):
+        """Задачи, выполняющиеся в этом процессе (загрузка или постобработка)"""
+        with self._lock:
+            return set(self.running) | postprocess_pool.pending()
+
+    def _check_cancelled(self):
+        """Прерывает задачи этого процесса, отмененные через API (в том числе из других процессов)"""
+        task_ids = list(self._local_task_ids())
+        if not task_ids:
+            return
+        cancelled = db.session.query(Download.task_id).filter(
+            Download.task_id.in_(task_ids),
+            Download.status == 'cancelled'
+        ).all()
+        db.session.commit()
+        for (task_id,) in cancelled:
+            cancel_local(str(task_id))
+
+    def _heartbeat(self):
+        """Отмечает задачи этого процесса как живые"""
+        task_ids = list(self._local_task_ids())
+        if not task_ids:
+            return
+        Download.query.filter(
+            Download.task_id.in_(task_ids),
+            Download.worker_id == WORKER_ID,
+            Download.status.in_(ACTIVE_STATUSES + POSTPROCESS_STATUSES)
+        ).update({'updated_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+
+    def _requeue_stale(self):
+        """Возвращает в очередь задачи упавших воркеров
+
+        Задача продолжится с файлов на диске (см. utils/checkpoint.py). Задачи
+        узла с завершившимся процессом возвращаются сразу, остальные - по
+        таймауту heartbeat.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=STALE_JOB_TIMEOUT)
+        running = self._local_task_ids()
+        candidates = Download.query.filter(
+            Download.status.in_(ACTIVE_STATUSES + POSTPROCESS_STATUSES),
+            db.or_(Download.updated_at < cutoff, Download.worker_id.like(f"{NODE_ID}:%"))
+        ).all()
+
+        requeued = 0
+        for job in candidates:
+            if job.worker_id == WORKER_ID:
+                orphaned = str(job.task_id) not in running and job.updated_at < cutoff
+            elif (job.worker_id or '').startswith(f"{NODE_ID}:"):
+                orphaned = not _worker_alive(job.worker_id)
+            else:
+                orphaned = job.updated_at < cutoff
+            if not orphaned:
+                continue
+            requeued += Download.query.filter_by(
+                id=job.id, status=job.status, worker_id=job.worker_id
+            ).update({'status': 'queued', 'worker_id': None}, synchronize_session=False)
+            logger.warning(f"Requeued task {job.task_id} abandoned by worker {job.worker_id}")
+        db.session.commit()
+        if requeued:
+            self.notify()
+
+    def _finalize_bulk_jobs(self):
+        """Завершение пакетных загрузок, все элементы которых выполнены"""
+        from utils.bulk import finalize_bulk_jobs
+
+        finalize_bulk_jobs()
+
+    def _expire_prefetched(self):
+        """Отмена невостребованных спекулятивных загрузок"""
+        from utils.prefetch import expire_prefetched
+
+        expire_prefetched()
+
+    def _purge_info_tasks(self):
+        """Очистка асинхронных запросов метаданных"""
+        from utils.info_tasks import purge_info_tasks
+
+        purge_info_tasks()
+
+    def _node_active_count(self):
+        return Download.query.filter(
+            Download.status.in_(ACTIVE_STATUSES),
+            Download.worker_id.like(f"{NODE_ID}:%")
+        ).count()
+
+    def has_idle_capacity(self):
+        """Есть ли на узле свободные мощности для спекулятивной загрузки"""
+        return self._node_active_count() < PREFETCH_NODE_CAPACITY
+
+    def _pick(self, heads, active_by_key, keys):
+        """Выбирает следующую задачу среди первых задач ключей (см. docstring класса)"""
+        candidates = []
+        for job in heads:
+            key_id = job.api_key_id
+            max_concurrent, weight, _ = key_limits(keys.get(key_id))
+            active = active_by_key.get(key_id, 0)
+            if active >= max_concurrent:
+                continue
+            candidates.append((
+                job.priority if job.priority is not None else DEFAULT_PRIORITY,
+                active / weight,
+                self._vtime.get(key_id, self._global_vtime),
+                job.created_at,
+                key_id,
+                weight,
+                job
+            ))
+
+        if not candidates:
+            return None
+
+        priority, _, vtime, _, key_id, weight, job = min(candidates, key=lambda c: c[:4])
+        self._global_vtime = max(self._global_vtime, vtime)
+        self._vtime[key_id] = max(vtime, self._global_vtime) + 1.0 / weight
+        return job
+
+    def _queued_heads(self, speculative):
+        """Первая задача в очереди каждого ключа
+
+        Ключ с сотнями задач не вытесняет остальных из выборки.
+        """
+        rank = func.row_number().over(
+            partition_by=Download.api_key_id,
+            order_by=(Download.priority, Download.created_at)
+        ).label('rank')
+        ranked = db.session.query(Download.id.label('id'), rank).filter(
+            Download.status == 'queued',
+            Download.speculative.is_(True) if speculative else Download.speculative.isnot(True)
+        ).subquery()
+        return Download.query.join(ranked, Download.id == ranked.c.id).filter(
+            ranked.c.rank == 1
+        ).limit(SCHEDULER_SCAN_LIMIT).all()
+
+    def _select(self, queued):
+        """Выбирает задачу из первых задач ключей. Возвращает (задача, ключи)"""
+        if not queued:
+            return None, {}
+
+        key_ids = {job.api_key_id for job in queued if job.api_key_id is not None}
+        keys = {key.id: key for key in ApiKey.query.filter(ApiKey.id.in_(key_ids)).all()} if key_ids else {}
+        active_by_key = dict(
+            db.session.query(Download.api_key_id, func.count(Download.id))
+            .filter(Download.status.in_(ACTIVE_STATUSES))
+            .group_by(Download.api_key_id)
+            .all()
+        )
+        return self._pick(queued, active_by_key, keys), keys
+
+    def _dispatch_once(self):
+        """Запускает одну задачу, если есть свободный слот. Возвращает True при запуске"""
+        if self.free_slots() <= 0:
+            return False
+        node_active = self._node_active_count()
+        if node_active >= MAX_ACTIVE_DOWNLOADS:
+            return False
+
+        job, keys = self._select(self._queued_heads(speculative=False))
+        if job is None and node_active < PREFETCH_NODE_CAPACITY:
+            job, keys = self._select(self._queued_heads(speculative=True))
+        if job is None:
+            db.session.rollback()
+            return False
+
+        if is_quota_exceeded(keys.get(job.api_key_id)):
+            logger.warning(f"Daily byte quota exceeded for key {job.api_key_id}, task {job.task_id} rejected")
+            Download.query.filter_by(id=job.id, status='queued').update({
+                'status': 'error',
+                'error': 'Daily byte quota exceeded'
+            }, synchronize_session=False)
+            db.session.commit()
+            return True
+
+        spec = self._job_spec(job)
+
+        # Атомарный захват: задачу получит только один процесс
+        claimed = Download.query.filter_by(id=job.id, status='queued').update({
+            'status': 'starting',
+            'worker_id': WORKER_ID,
+            'started_at': datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed != 1:
+            return True
+
+        self._start_job(spec)
+        return True
+
+    @staticmethod
+    def _job_spec(job):
+        """Параметры задачи, не привязанные к сессии БД (для передачи в поток)"""
+        return {
+            'task_id': str(job.task_id),
+            'url': job.url,
+            'api_key_id': job.api_key_id,
+            'priority': job.priority,
+            'params': {
+                'video_format_id': job.video_format,
+                'audio_format_id': job.audio_format,
+                'format_id': job.format,
+                'audio_only': bool(job.audio_only),
+                'convert_to_mp3': bool(job.convert_to_mp3),
+                'backend': job.backend,
+                'clip_start': job.clip_start,
+                'clip_end': job.clip_end
+            }
+        }
+
+    def _start_job(self, spec):
+        from utils.downloader import download_video
+
+        task_id = spec['task_id']
+        logger.info(f"Dispatching task {task_id} (key {spec['api_key_id']}, "
+                    f"priority {PRIORITY_NAMES.get(spec['priority'], spec['priority'])})")
+
+        def run():
+            try:
+                download_video(task_id, spec['url'], **spec['params'])
+            finally:
+                with self._lock:
+                    self.running.pop(task_id, None)
+                self.notify()
+
+        thread = threading.Thread(target=run, daemon=True)
+        with self._lock:
+            self.running[task_id] = thread
+        thread.start()
+
+
+download_scheduler = DownloadScheduler()
+
+
+def start_scheduler_thread(app):
+    """Запускает диспетчер очереди загрузок для текущего процесса"""
+    download_scheduler.start(app)
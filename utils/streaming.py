@@ -0,0 +1,235 @@
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Протоколы, которые ffmpeg умеет читать напрямую по ссылке из yt-dlp
+STREAMABLE_PROTOCOLS = {'http', 'https', 'm3u8', 'm3u8_native'}
+
+# Протоколы, ссылку на которые можно отдать клиенту как один файл
+DIRECT_PROTOCOLS = {'http', 'https'}
+
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 64 * 1024))
+STREAM_MP3_BITRATE = os.environ.get('STREAM_MP3_BITRATE', '192k')
+STREAM_EXIT_TIMEOUT = 10  # сколько ждать завершения ffmpeg после конца вывода
+STREAM_STDERR_LIMIT = 64 * 1024  # хвост stderr для сообщения об ошибке
+
+# Фрагментированный MP4 можно отдавать клиенту до окончания записи
+FRAGMENTED_MP4_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+
+class StreamError(Exception):
+    """Ошибка подготовки потоковой отдачи"""
+    pass
+
+
+class StreamProcessError(StreamError):
+    """ffmpeg завершился с ошибкой до начала передачи"""
+    pass
+
+
+def ffmpeg_available():
+    """Проверяет наличие ffmpeg в системе"""
+    return shutil.which('ffmpeg') is not None
+
+
+def is_streamable(format_info):
+    """Можно ли передать формат в ffmpeg по прямой ссылке"""
+    return bool(format_info and format_info.get('url')
+                and format_info.get('protocol', 'https') in STREAMABLE_PROTOCOLS)
+
+
+def parse_url_expiry(media_url):
+    """Определяет время истечения подписанной ссылки CDN (если оно в ней указано)"""
+    params = parse_qs(urlparse(media_url).query)
+    try:
+        # YouTube/Googlevideo и CloudFront хранят unix timestamp
+        for name in ('expire', 'Expires', 'expires'):
+            if name in params:
+                return datetime.utcfromtimestamp(int(params[name][0]))
+        # Подписанные ссылки S3
+        if 'X-Amz-Date' in params and 'X-Amz-Expires' in params:
+            signed_at = datetime.strptime(params['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+            return signed_at + timedelta(seconds=int(params['X-Amz-Expires'][0]))
+    except (ValueError, OverflowError):
+        logger.debug(f"Could not parse expiry from URL: {media_url[:100]}")
+    return None
+
+
+def get_direct_media(format_info, audio_only=False):
+    """Возвращает прямую ссылку на формат, если его можно скачать одним файлом
+
+    Подходят только прогрессивные форматы (видео со звуком или только аудио),
+    которые отдаются обычным HTTP без фрагментов и не требуют склейки.
+    """
+    if not format_info or not format_info.get('url'):
+        raise StreamError('Format not found or has no direct URL')
+
+    format_id = format_info.get('format_id')
+
+    if format_info.get('protocol', 'https') not in DIRECT_PROTOCOLS or format_info.get('fragments'):
+        raise StreamError(f"Format {format_id} uses protocol {format_info.get('protocol')} "
+                          f"and can not be fetched directly")
+
+    has_audio = format_info.get('acodec') not in (None, 'none')
+    has_video = format_info.get('vcodec') not in (None, 'none')
+    if audio_only and has_video:
+        raise StreamError(f'Format {format_id} is not an audio-only format')
+    if not audio_only and not (has_audio and has_video):
+        raise StreamError(f'Format {format_id} requires merging and can not be fetched directly')
+
+    expires_at = parse_url_expiry(format_info['url'])
+    return {
+        'format_id': format_id,
+        'url': format_info['url'],
+        'ext': format_info.get('ext'),
+        'protocol': format_info.get('protocol'),
+        'filesize': format_info.get('filesize') or format_info.get('filesize_approx'),
+        'http_headers': format_info.get('http_headers') or {},
+        'expires_at': expires_at.isoformat() if expires_at else None
+    }
+
+
+def build_input_args(format_info):
+    """Аргументы ffmpeg для одного входного потока с заголовками источника"""
+    args = []
+    headers = format_info.get('http_headers') or {}
+    user_agent = headers.get('User-Agent')
+    extra = ''.join(f"{key}: {value}\r\n" for key, value in headers.items() if key != 'User-Agent')
+    if user_agent:
+        args += ['-user_agent', user_agent]
+    if extra:
+        args += ['-headers', extra]
+    args += ['-i', format_info['url']]
+    return args
+
+
+def build_stream_command(sources, convert_to_mp3=False, audio_only=False):
+    """Собирает команду ffmpeg, которая пишет результат в stdout
+
+    Args:
+        sources: Список форматов (1 или 2: видео и аудио) с полями url/http_headers
+        convert_to_mp3: Перекодировать звук в MP3
+        audio_only: Отдавать только аудио дорожку
+
+    Returns:
+        tuple: (команда, mimetype, расширение)
+    """
+    if not sources or len(sources) > 2:
+        raise StreamError('One or two source streams are required')
+
+    for source in sources:
+        if not is_streamable(source):
+            raise StreamError(f"Format {source.get('format_id')} uses protocol "
+                              f"{source.get('protocol')} and can not be streamed")
+
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-loglevel', 'error', '-nostdin']
+    for source in sources:
+        cmd += build_input_args(source)
+
+    if convert_to_mp3:
+        audio_input = len(sources) - 1
+        cmd += ['-map', f'{audio_input}:a:0', '-vn',
+                '-c:a', 'libmp3lame', '-b:a', STREAM_MP3_BITRATE,
+                '-f', 'mp3', 'pipe:1']
+        return cmd, 'audio/mpeg', 'mp3'
+
+    if audio_only:
+        cmd += ['-map', f'{len(sources) - 1}:a:0', '-vn', '-c:a', 'copy',
+                '-movflags', FRAGMENTED_MP4_FLAGS, '-f', 'mp4', 'pipe:1']
+        return cmd, 'audio/mp4', 'm4a'
+
+    if len(sources) == 2:
+        cmd += ['-map', '0:v:0', '-map', '1:a:0']
+    cmd += ['-c', 'copy', '-movflags', FRAGMENTED_MP4_FLAGS, '-f', 'mp4', 'pipe:1']
+    return cmd, 'video/mp4', 'mp4'
+
+
+def _drain_stderr(pipe, buffer):
+    """Читает stderr ffmpeg параллельно с stdout, чтобы процесс не блокировался на полном pipe"""
+    for line in iter(pipe.readline, b''):
+        buffer.extend(line)
+        del buffer[:-STREAM_STDERR_LIMIT]
+
+
+def open_ffmpeg_stream(cmd, chunk_size=STREAM_CHUNK_SIZE):
+    """Запускает ffmpeg и дожидается первого куска его stdout
+
+    Ответ клиенту создается только после этого: если ffmpeg не смог открыть
+    источник (например, истекла ссылка), вызывающий код может вернуть ошибку
+    вместо пустого ответа 200.
+
+    Returns:
+        generator: Куски stdout, начиная с уже прочитанного первого
+
+    Raises:
+        StreamProcessError: ffmpeg завершился с ошибкой, не отдав данных
+    """
+    logger.info(f"Starting stream process: {' '.join(cmd[:4])} ...")
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stderr = bytearray()
+    drain = threading.Thread(target=_drain_stderr, args=(process.stderr, stderr),
+                             name='ffmpeg-stderr', daemon=True)
+    drain.start()
+    try:
+        chunk = process.stdout.read1(chunk_size)
+        if not chunk:
+            process.wait(STREAM_EXIT_TIMEOUT)
+    except BaseException:
+        _stop_process(process, drain)
+        raise
+
+    if not chunk and process.returncode != 0:
+        _stop_process(process, drain)
+        message = stderr.decode('utf-8', errors='replace').strip()
+        logger.error(f"ffmpeg stream failed with code {process.returncode}: {message}")
+        raise StreamProcessError(message or f'ffmpeg exited with code {process.returncode}')
+    return _iter_output(process, drain, stderr, chunk, chunk_size)
+
+
+def _stop_process(process, drain):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+    drain.join()
+    process.stdout.close()
+    process.stderr.close()
+
+
+def _iter_output(process, drain, stderr, chunk, chunk_size):
+    """Отдает stdout ffmpeg; процесс убивается, только если клиент закрыл соединение"""
+    sent = 0
+    disconnected = False
+    try:
+        while chunk:
+            sent += len(chunk)
+            yield chunk
+            chunk = process.stdout.read1(chunk_size)
+        # Конец stdout: процесс дописывает выход и завершается сам
+        try:
+            process.wait(STREAM_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"ffmpeg did not exit {STREAM_EXIT_TIMEOUT}s after end of output, killing it")
+    except GeneratorExit:
+        logger.info(f"Client disconnected after {sent} bytes, stopping ffmpeg")
+        disconnected = True
+        process.kill()
+        raise
+    finally:
+        _stop_process(process, drain)
+        if process.returncode != 0 and not disconnected:
+            message = stderr.decode('utf-8', errors='replace').strip()
+            logger.error(f"ffmpeg stream failed with code {process.returncode} after {sent} bytes: {message}")
+        elif not disconnected:
+            logger.info(f"Stream finished, sent {sent} bytes")
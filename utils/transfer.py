@@ -0,0 +1,185 @@
+import os
+import json
+import math
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Профиль подбора параметров передачи. Можно переопределить JSON файлом
+# TRANSFER_PROFILE_PATH (ключи верхнего уровня заменяют значения по умолчанию).
+DEFAULT_TRANSFER_PROFILE = {
+    # Уровни по размеру файла: первый подходящий по max_size (null - без ограничения)
+    'tiers': [
+        {
+            'name': 'small',
+            'max_size': 16 * 1024 * 1024,
+            'connections': 1,
+            'external_downloader': 'native',
+            'min_split_size': '16M',
+            'http_chunk_size': None,
+            'buffersize': 64 * 1024
+        },
+        {
+            'name': 'medium',
+            'max_size': 512 * 1024 * 1024,
+            'connections': 8,
+            'external_downloader': 'aria2c',
+            'min_split_size': '8M',
+            'http_chunk_size': 10 * 1024 * 1024,
+            'buffersize': 256 * 1024
+        },
+        {
+            'name': 'large',
+            'max_size': None,
+            'connections': 16,
+            'external_downloader': 'aria2c',
+            'min_split_size': '20M',
+            'http_chunk_size': 10 * 1024 * 1024,
+            'buffersize': 1024 * 1024
+        }
+    ],
+    # Загрузчик для фрагментированных протоколов (HLS/DASH): фрагменты
+    # качаются параллельно средствами yt-dlp
+    'protocol_downloaders': {
+        'm3u8': 'native',
+        'dash': 'native'
+    },
+    # Если известна скорость одного соединения к хосту, число соединений
+    # подбирается так, чтобы файл скачивался примерно за target_seconds
+    'target_seconds': 30,
+    # Вес нового замера в скользящем среднем скорости хоста
+    'throughput_ewma_alpha': 0.3,
+    # Оценка времени до готовности файла: скорость соединения (байт/с), пока
+    # для хоста нет замеров, задержка старта загрузки одного потока (с) и
+    # скорость склейки потоков без перекодирования (байт/с)
+    'default_throughput': 2 * 1024 * 1024,
+    'stream_startup_seconds': 1.5,
+    'remux_rate': 100 * 1024 * 1024
+}
+
+TRANSFER_PROFILE_PATH = os.environ.get('TRANSFER_PROFILE_PATH')
+
+
+def load_transfer_profile(path=TRANSFER_PROFILE_PATH):
+    """Профиль по умолчанию, дополненный значениями из JSON файла"""
+    profile = dict(DEFAULT_TRANSFER_PROFILE)
+    if path:
+        try:
+            with open(path) as f:
+                profile.update(json.load(f))
+            logger.info(f"Loaded transfer profile from {path}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading transfer profile {path}, using defaults: {e}")
+    return profile
+
+
+transfer_profile = load_transfer_profile()
+
+# Скорость одного соединения к хосту (байт/с), скользящее среднее по прошлым задачам
+_host_throughput = {}
+_throughput_lock = threading.Lock()
+
+
+def estimate_size(format_info, duration=None):
+    """Размер формата: точный, примерный или вычисленный по битрейту"""
+    size = format_info.get('filesize') or format_info.get('filesize_approx')
+    if not size and format_info.get('tbr') and duration:
+        size = int(format_info['tbr'] * duration * 125)
+    return size or None
+
+
+def record_throughput(host, downloaded_bytes, elapsed, connections):
+    """Учитывает скорость завершенной задачи в статистике хоста"""
+    if not host or not downloaded_bytes or elapsed <= 0:
+        return
+    per_connection = downloaded_bytes / elapsed / max(1, connections)
+    alpha = transfer_profile['throughput_ewma_alpha']
+    with _throughput_lock:
+        previous = _host_throughput.get(host)
+        _host_throughput[host] = per_connection if previous is None else (
+            alpha * per_connection + (1 - alpha) * previous
+        )
+    logger.info(f"Throughput for {host}: {per_connection / 1024 / 1024:.2f} MiB/s per connection")
+
+
+def get_host_throughput(host):
+    with _throughput_lock:
+        return _host_throughput.get(host)
+
+
+def _select_tier(size):
+    tiers = transfer_profile['tiers']
+    if size is None:
+        return tiers[-1]
+    return next((t for t in tiers if t['max_size'] is None or size <= t['max_size']), tiers[-1])
+
+
+def _tier_connections(tier, size, per_connection):
+    connections = tier['connections']
+    if size and per_connection and connections > 1:
+        needed = math.ceil(size / (per_connection * transfer_profile['target_seconds']))
+        connections = max(1, min(connections, needed))
+    return connections
+
+
+def estimate_time_to_ready(formats, host, duration=None):
+    """Примерное время до готовности файла в секундах
+
+    Потоки задачи скачиваются по очереди, каждый со своим числом соединений;
+    при нескольких потоках добавляется склейка без перекодирования.
+
+    Returns:
+        float или None, если размер потоков неизвестен
+    """
+    per_connection = get_host_throughput(host) or transfer_profile['default_throughput']
+    total_size = 0
+    seconds = 0.0
+    for f in formats:
+        size = estimate_size(f, duration)
+        if not size:
+            return None
+        connections = _tier_connections(_select_tier(size), size, per_connection)
+        seconds += transfer_profile['stream_startup_seconds'] + size / (per_connection * connections)
+        total_size += size
+    if len(formats) > 1:
+        seconds += total_size / transfer_profile['remux_rate']
+    return round(seconds, 1)
+
+
+def plan_transfer(formats, host, duration=None):
+    """Подбирает параметры передачи для задачи
+
+    Args:
+        formats: Форматы, которые будут скачаны (из raw info)
+        host: Хост источника
+        duration: Длительность видео (для оценки размера по битрейту)
+
+    Returns:
+        dict: connections, external_downloader (для yt-dlp, по протоколам),
+            min_split_size, http_chunk_size, buffersize, tier, size
+    """
+    sizes = [estimate_size(f, duration) for f in formats]
+    known = [size for size in sizes if size]
+    # Параметры подбираются по самому большому потоку задачи; маленькие
+    # потоки не делятся на части благодаря min_split_size
+    size = max(known) if known else None
+
+    tier = _select_tier(size)
+    connections = _tier_connections(tier, size, get_host_throughput(host))
+
+    external_downloader = {'default': tier['external_downloader']}
+    external_downloader.update(transfer_profile['protocol_downloaders'])
+
+    plan = {
+        'tier': tier['name'],
+        'size': size,
+        'connections': connections,
+        'external_downloader': external_downloader,
+        'min_split_size': tier['min_split_size'],
+        'http_chunk_size': tier['http_chunk_size'],
+        'buffersize': tier['buffersize']
+    }
+    logger.info(f"Transfer plan for {host}: tier={plan['tier']}, size={size}, connections={connections}")
+    return plan
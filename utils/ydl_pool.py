@@ -0,0 +1,128 @@
+import os
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Создание YoutubeDL заново загружает реестр экстракторов и cookies, создает
+# HTTP обработчики и теряет keep-alive соединения и кэш плеера между вызовами.
+# Поэтому готовые экземпляры переиспользуются: отдельный пул на профиль, каждый
+# экземпляр в один момент времени используется одним потоком, параметры вызова
+# применяются на время аренды и затем восстанавливаются.
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 4))  # свободных экземпляров на профиль
+
+EXTRACTION_PROFILE = {
+    'quiet': True,
+    'no_warnings': True
+}
+
+DOWNLOAD_PROFILE = {
+    # ffmpeg запускается только в пуле постобработки
+    'fixup': 'never',
+    'writethumbnail': False,
+    'writesubtitles': False,
+    # Недокачанные файлы остаются после перезапуска и докачиваются
+    'overwrites': False,
+    'continuedl': True,
+    'keepvideo': False,
+    'verbose': True,
+    'quiet': False,
+    'no_warnings': False,
+    'ignoreerrors': False,
+    'retries': 10,
+    'fragment_retries': 10,
+    'file_access_retries': 5,
+    'throttledratelimit': None,
+    'sleep_interval': 0,
+    'max_sleep_interval': 0,
+    'socket_timeout': 60,
+    'thread_count': 16
+}
+
+
+class YdlPool:
+    """Пул готовых экземпляров YoutubeDL одного профиля"""
+
+    def __init__(self, name, profile, size=YDL_POOL_SIZE):
+        self.name = name
+        self.profile = profile
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _get(self):
+        try:
+            ydl = self._idle.get_nowait()
+            with self._lock:
+                self.reused += 1
+            return ydl
+        except queue.Empty:
+            pass
+        with self._lock:
+            self.created += 1
+        return yt_dlp.YoutubeDL(dict(self.profile))
+
+    def _put(self, ydl):
+        if self._idle.qsize() < self.size:
+            self._idle.put(ydl)
+        else:
+            ydl.close()
+
+    @staticmethod
+    def _apply(ydl, params):
+        """Параметры вызова поверх профиля
+
+        outtmpl, format и progress_hooks YoutubeDL обрабатывает при создании
+        (format - в готовый format_selector), поэтому они применяются так же,
+        как это делает его конструктор.
+        """
+        params = dict(params)
+        hooks = params.pop('progress_hooks', None)
+        ydl.params.update(params)
+        if 'outtmpl' in params:
+            ydl._parse_outtmpl()
+        if 'format' in params:
+            spec = params['format']
+            ydl.format_selector = (spec if spec in (None, '-') or callable(spec)
+                                   else ydl.build_format_selector(spec))
+        for hook in hooks or []:
+            ydl.add_progress_hook(hook)
+
+    @contextmanager
+    def lease(self, params=None):
+        """Экземпляр YoutubeDL в монопольное пользование на время блока
+
+        Args:
+            params: Параметры вызова (поверх профиля), после блока восстанавливаются
+        """
+        ydl = self._get()
+        saved_params = dict(ydl.params)
+        saved_hooks = list(ydl._progress_hooks)
+        saved_selector = ydl.format_selector
+        try:
+            if params:
+                self._apply(ydl, params)
+            yield ydl
+        finally:
+            ydl.params.clear()
+            ydl.params.update(saved_params)
+            ydl._progress_hooks[:] = saved_hooks
+            ydl.format_selector = saved_selector
+            self._put(ydl)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+extraction_ydl_pool = YdlPool('extraction', EXTRACTION_PROFILE)
+download_ydl_pool = YdlPool('download', DOWNLOAD_PROFILE)